@@ -0,0 +1,96 @@
+"""
+Ограничение частоты ответов одному пользователю.
+
+Число сообщений пользователя считается скользящим окном из двух
+фиксированных окон: текущего и предыдущего, взятого с весом оставшейся
+доли окна. Счетчики лежат в хранилище состояния под ключами
+"abuse0:<user_id>" и "abuse1:<user_id>" (по четности номера окна), поэтому
+в памяти они попадают в упакованные IntTable, а срок жизни убирает
+неактивных пользователей - память не растет с числом ID.
+
+Ответы по уровням: в пределах лимита - полный ответ, при превышении -
+один короткий ответ "не так быстро" за окно, дальше - молча без ответа.
+Проверка идет до форматирования, так что подавленные сообщения не стоят
+ни форматирования, ни sendMessage.
+"""
+
+import logging
+import threading
+import time
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+ALLOW = 'allow'
+WARN = 'warn'
+DROP = 'drop'
+
+DECISION_COUNTER = Counter('abuse_decisions_total', 'Решения ограничителя частоты по уровням', ['tier'])
+SAVED_SECONDS = Counter('abuse_saved_seconds_total',
+                        'Оценка сэкономленного времени: средняя стоимость полного ответа на каждое подавленное')
+
+
+class AbuseLimiter:
+    """Скользящее окно сообщений на пользователя поверх хранилища состояния"""
+
+    # Вес нового замера в скользящем среднем стоимости ответа
+    COST_SMOOTHING = 0.05
+
+    def __init__(self, state, limit=20, window=60):
+        self.state = state
+        self.limit = limit
+        self.window = window
+        self._reply_cost = 0.0
+        self._lock = threading.Lock()
+
+    def configure(self, limit=None, window=None):
+        """Изменение лимита на лету; новое окно начинает считаться с нуля"""
+        if limit is not None:
+            self.limit = limit
+        if window is not None:
+            self.window = window
+
+    def check(self, user_id):
+        """Уровень ответа для очередного сообщения пользователя: ALLOW, WARN или DROP"""
+        if not self.limit or user_id is None:
+            return ALLOW
+        window = self.window
+        now = time.time()
+        index, offset = divmod(now, window)
+        index = int(index)
+        try:
+            # Ключ окна переиспользуется через окно, поэтому запись живет ровно
+            # до конца следующего окна (там она нужна как предыдущее)
+            ttl = (index + 2) * window - now
+            current = self.state.incr(f"abuse{index % 2}:{user_id}", 1, ttl=ttl)
+            estimate = current
+            if current <= self.limit:
+                previous = self.state.get(f"abuse{(index - 1) % 2}:{user_id}")
+                if previous:
+                    estimate += int(previous) * (1 - offset / window)
+            if estimate <= self.limit:
+                tier = ALLOW
+            elif self.state.add(f"abuse_notice:{user_id}", 1, ttl=window):
+                tier = WARN
+            else:
+                tier = DROP
+        except Exception as e:
+            # Недоступное хранилище не должно лишать пользователей ответов
+            logger.warning(f"Ошибка проверки частоты для {user_id}: {e}")
+            return ALLOW
+
+        DECISION_COUNTER.inc(tier=tier)
+        if tier == DROP:
+            SAVED_SECONDS.inc(self._reply_cost)
+        elif tier == WARN:
+            logger.info(f"Пользователь {user_id} превысил {self.limit} сообщений за {window} с, ответы приостановлены")
+        return tier
+
+    def observe_reply(self, seconds):
+        """Учесть стоимость полного ответа (форматирование и отправка)"""
+        with self._lock:
+            if self._reply_cost:
+                self._reply_cost += (seconds - self._reply_cost) * self.COST_SMOOTHING
+            else:
+                self._reply_cost = seconds
@@ -1,19 +1,95 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import asyncio
+import hmac
 import logging
-from bot import TelegramBot
-from config import FLASK_HOST, FLASK_PORT, FLASK_DEBUG
+from bot import TelegramBot, WEBHOOK_ENDPOINT
+from config import (
+    FLASK_HOST, FLASK_PORT, FLASK_DEBUG, ADMIN_TOKEN, WEBHOOK_URL, WEBHOOK_MONITOR_INTERVAL, WEBHOOK_MAX_CONNECTIONS,
+    WEBHOOK_BACKLOG_THRESHOLD, WEBHOOK_DRAIN_WORKERS, WEBHOOK_DRAIN_TIMEOUT,
+    BOT_TOKEN, CAPTURE_DIR, CAPTURE_SAMPLE_RATE, CAPTURE_SALT, CAPTURE_MAX_BYTES, CAPTURE_MAX_AGE,
+    CAPTURE_MAX_FILES, CAPTURE_QUEUE_SIZE, CAPTURE_KEEP_TEXT, settings, on_reload, install_reload_handler
+)
+from capture import TrafficCapture
+from metrics import REGISTRY, CONTENT_TYPE
+from profiling import sample_stacks, format_collapsed, ProfilerBusyError
+from server import WebhookServer
+from tracing import tracer, KIND_SERVER
+from webhook_monitor import WebhookMonitor
 
 # Настройка логирования
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=settings.LOG_LEVEL.upper())
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 bot = TelegramBot()
+webhook_monitor = WebhookMonitor(
+    bot,
+    WEBHOOK_ENDPOINT,
+    interval=WEBHOOK_MONITOR_INTERVAL,
+    # Telegram не должен открывать больше соединений, чем мы готовы обработать
+    max_connections=WEBHOOK_MAX_CONNECTIONS or bot.limiter.max_limit,
+    backlog_threshold=WEBHOOK_BACKLOG_THRESHOLD,
+    drain_workers=WEBHOOK_DRAIN_WORKERS,
+    drain_timeout=WEBHOOK_DRAIN_TIMEOUT
+)
+traffic_capture = TrafficCapture(
+    CAPTURE_DIR,
+    sample_rate=CAPTURE_SAMPLE_RATE,
+    salt=CAPTURE_SALT or BOT_TOKEN or '',
+    max_bytes=CAPTURE_MAX_BYTES,
+    max_age=CAPTURE_MAX_AGE,
+    max_files=CAPTURE_MAX_FILES,
+    queue_size=CAPTURE_QUEUE_SIZE,
+    keep_text=CAPTURE_KEEP_TEXT
+)
+
+@on_reload
+def apply_runtime_settings(settings, changed):
+    """Применение перезагруженных настроек к работающим компонентам"""
+    bot.limiter.configure(
+        min_limit=settings.CONCURRENCY_MIN_LIMIT,
+        max_limit=settings.CONCURRENCY_MAX_LIMIT,
+        target_latency=settings.CONCURRENCY_TARGET_LATENCY,
+        backoff=settings.CONCURRENCY_BACKOFF
+    )
+    webhook_monitor.configure(
+        max_connections=settings.WEBHOOK_MAX_CONNECTIONS or settings.CONCURRENCY_MAX_LIMIT,
+        backlog_threshold=settings.WEBHOOK_BACKLOG_THRESHOLD,
+        drain_workers=settings.WEBHOOK_DRAIN_WORKERS,
+        drain_timeout=settings.WEBHOOK_DRAIN_TIMEOUT
+    )
+    bot.abuse.configure(limit=settings.ABUSE_LIMIT, window=settings.ABUSE_WINDOW)
+    bot.media.configure(
+        max_bytes=settings.MEDIA_MAX_BYTES,
+        timeout=settings.MEDIA_TIMEOUT,
+        cache_ttl=settings.MEDIA_CACHE_TTL,
+        cache_size=settings.MEDIA_CACHE_SIZE
+    )
+    traffic_capture.configure(
+        sample_rate=settings.CAPTURE_SAMPLE_RATE,
+        max_bytes=settings.CAPTURE_MAX_BYTES,
+        max_age=settings.CAPTURE_MAX_AGE,
+        max_files=settings.CAPTURE_MAX_FILES,
+        keep_text=settings.CAPTURE_KEEP_TEXT
+    )
 
 @app.route('/webhook', methods=['POST'])
 def webhook():
     """Webhook endpoint для Telegram Bot API"""
+    # При перегрузке отбрасываем обновление до разбора, а не ставим в очередь
+    if not bot.limiter.try_acquire():
+        return shed_response()
+    
+    try:
+        with tracer.span('receive', kind=KIND_SERVER) as span:
+            response, status = process_webhook(span)
+            span.set_attribute('http.status_code', status)
+            return response, status
+    finally:
+        bot.limiter.release()
+
+def process_webhook(span):
+    """Разбор и обработка тела запроса /webhook"""
     try:
         # Получаем данные от Telegram
         update_data = request.get_json()
@@ -22,6 +98,10 @@ def webhook():
             logger.warning("Получены пустые данные от Telegram")
             return jsonify({"status": "error", "message": "Empty data"}), 400
         
+        # Запись в фоне: сюда попадает только сырое тело, без разбора и диска
+        traffic_capture.offer(request.get_data())
+        
+        span.set_attribute('telegram.update_id', update_data.get('update_id', -1))
         logger.info(f"Получен webhook: {update_data.get('update_id', 'unknown')}")
         
         # Обрабатываем обновление синхронно
@@ -36,6 +116,54 @@ def webhook():
         logger.error(f"Ошибка при обработке webhook: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+def shed_response():
+    """Ответ на обновление, отброшенное из-за перегрузки"""
+    if settings.SHED_MODE == 'ack':
+        # Telegram считает обновление доставленным, пользователь ответа не получит
+        return jsonify({"status": "shed"}), 200
+    
+    status = 429 if settings.SHED_MODE == '429' else 503
+    response = jsonify({"status": "error", "message": "Overloaded"})
+    response.headers['Retry-After'] = str(settings.SHED_RETRY_AFTER)
+    return response, status
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Метрики в формате Prometheus"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+def is_admin_request():
+    """Проверка токена администратора"""
+    token = request.headers.get('X-Admin-Token', '')
+    # compare_digest на строках падает с TypeError на не-ASCII символах
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+@app.route('/admin/profile', methods=['POST'])
+def admin_profile():
+    """Семплирующее профилирование процесса на N секунд (collapsed stacks)"""
+    if not is_admin_request():
+        # Не раскрываем наличие эндпоинта
+        return jsonify({"error": "Not found"}), 404
+    
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', 0.005))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid seconds/interval"}), 400
+    max_seconds = settings.PROFILE_MAX_SECONDS
+    if not 0 < seconds <= max_seconds or not 0.001 <= interval <= 1:
+        return jsonify({"status": "error", "message": f"seconds: 0..{max_seconds}, interval: 0.001..1"}), 400
+    
+    logger.info(f"Профилирование на {seconds} с (интервал {interval} с)")
+    try:
+        counts = sample_stacks(seconds, interval)
+    except ProfilerBusyError as e:
+        return jsonify({"status": "error", "message": str(e)}), 409
+    
+    response = Response(format_collapsed(counts), content_type='text/plain; charset=utf-8')
+    response.headers['Content-Disposition'] = 'attachment; filename="profile.collapsed"'
+    return response
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Проверка состояния сервиса"""
@@ -65,7 +193,8 @@ def index():
         "service": "Telegram Bot Webhook",
         "endpoints": {
             "webhook": "/webhook",
-            "health": "/health"
+            "health": "/health",
+            "metrics": "/metrics"
         },
         "status": "running"
     })
@@ -78,10 +207,41 @@ def not_found(error):
 def internal_error(error):
     return jsonify({"error": "Internal server error"}), 500
 
+def start_background_tasks():
+    """Запуск фоновых задач процесса"""
+    if WEBHOOK_MONITOR_INTERVAL > 0:
+        if WEBHOOK_URL:
+            webhook_monitor.start()
+        else:
+            # Иначе монитор каждый интервал регистрировал бы "None:8443/webhook"
+            logger.warning("WEBHOOK_URL не задан, мониторинг webhook выключен")
+    if CAPTURE_DIR:
+        traffic_capture.start()
+
+def stop_background_tasks():
+    """Остановка фоновых задач и выгрузка буферов перед выходом"""
+    webhook_monitor.stop(timeout=10)
+    traffic_capture.close()
+    bot.media.shutdown(wait=False)
+    tracer.shutdown()
+    bot.state.close()
+    for handler in logging.getLogger().handlers:
+        handler.flush()
+
 if __name__ == '__main__':
+    install_reload_handler()
+    start_background_tasks()
     logger.info(f"Запуск Flask-приложения на {FLASK_HOST}:{FLASK_PORT}")
-    app.run(
-        host=FLASK_HOST,
-        port=FLASK_PORT,
-        debug=FLASK_DEBUG
-    ) 
\ No newline at end of file
+    if FLASK_DEBUG:
+        # Отладочный сервер Flask с перезагрузкой кода; без плавной остановки
+        app.run(
+            host=FLASK_HOST,
+            port=FLASK_PORT,
+            debug=FLASK_DEBUG
+        )
+    else:
+        WebhookServer(
+            app, FLASK_HOST, FLASK_PORT,
+            state=bot.state,
+            on_shutdown=stop_background_tasks
+        ).serve() 
\ No newline at end of file
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк форматирования ответов: каталог i18n против прежних f-строк.
+
+Прежние форматтеры (только русский текст) сохранены здесь как эталон:
+обычный текст синхронного пути и Markdown асинхронных обработчиков.
+Сначала проверяется, что русские шаблоны каталога в обоих вариантах дают
+байт в байт тот же текст, затем сравнивается время форматирования одного
+update, включая выбор языка:
+
+    python bench_i18n.py --updates 20000 --repeat 5
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime
+
+from i18n import CATALOG, get_replies
+
+
+def legacy_start(user):
+    return f"👋 Привет, {user.first_name}!\n\nЯ бот для получения информации о пользователях и каналах.\n\n📋 Что я умею:\n• Отвечаю на команду /start\n• Анализирую пересланные сообщения\n• Показываю ID пользователей и каналов\n\n📤 Перешлите мне сообщение из другого чата или канала, и я покажу всю доступную информацию!"
+
+
+def legacy_forwarded(message, user, chat):
+    """Прежний TelegramBot._format_forwarded_info_sync"""
+    info_text = "📤 Информация о пересланном сообщении:\n\n"
+    info_text += f"👤 Отправитель запроса:\n"
+    info_text += f"• ID: {user.id}\n"
+    info_text += f"• Имя: {user.first_name}\n"
+    if user.last_name:
+        info_text += f"• Фамилия: {user.last_name}\n"
+    if user.username:
+        info_text += f"• Username: @{user.username}\n"
+    info_text += "\n"
+    if message.forward_from:
+        forward_user = message.forward_from
+        info_text += f"📤 Переслано от пользователя:\n"
+        info_text += f"• ID: {forward_user.id}\n"
+        info_text += f"• Имя: {forward_user.first_name}\n"
+        if forward_user.last_name:
+            info_text += f"• Фамилия: {forward_user.last_name}\n"
+        if forward_user.username:
+            info_text += f"• Username: @{forward_user.username}\n"
+        info_text += "\n"
+    if message.forward_from_chat:
+        forward_chat = message.forward_from_chat
+        info_text += f"📢 Переслано из чата/канала:\n"
+        info_text += f"• ID: {forward_chat.id}\n"
+        info_text += f"• Тип: {forward_chat.type}\n"
+        if forward_chat.title:
+            info_text += f"• Название: {forward_chat.title}\n"
+        if forward_chat.username:
+            info_text += f"• Username: @{forward_chat.username}\n"
+        info_text += "\n"
+    if hasattr(message, 'forward_date') and message.forward_date:
+        if isinstance(message.forward_date, datetime):
+            forward_date = message.forward_date
+        else:
+            forward_date = datetime.fromtimestamp(message.forward_date)
+        info_text += f"📅 Дата пересылки:\n"
+        info_text += f"• {forward_date.strftime('%d.%m.%Y %H:%M:%S')}\n\n"
+    info_text += f"💬 Текущий чат:\n"
+    info_text += f"• ID: {chat.id}\n"
+    info_text += f"• Тип: {chat.type}\n"
+    if hasattr(chat, 'title') and chat.title:
+        info_text += f"• Название: {chat.title}\n"
+    if hasattr(chat, 'username') and chat.username:
+        info_text += f"• Username: @{chat.username}\n"
+    return info_text
+
+
+def legacy_message(message, user, chat):
+    """Прежний TelegramBot._format_message_info_sync"""
+    info_text = (
+        f"📝 Информация о сообщении:\n\n"
+        f"👤 Отправитель:\n"
+        f"• ID: {user.id}\n"
+        f"• Имя: {user.first_name}\n"
+    )
+    if user.last_name:
+        info_text += f"• Фамилия: {user.last_name}\n"
+    if user.username:
+        info_text += f"• Username: @{user.username}\n"
+    info_text += f"\n💬 Чат:\n"
+    info_text += f"• ID: {chat.id}\n"
+    info_text += f"• Тип: {chat.type}\n"
+    if hasattr(chat, 'title') and chat.title:
+        info_text += f"• Название: {chat.title}\n"
+    if hasattr(chat, 'username') and chat.username:
+        info_text += f"• Username: @{chat.username}\n"
+    info_text += f"\n💡 Подсказка: Перешлите сообщение из другого чата, "
+    info_text += f"чтобы получить больше информации!"
+    return info_text
+
+
+def legacy_forwarded_markdown(message, user, chat):
+    """Прежний TelegramBot.handle_forwarded_message
+
+    Дата разбирается как в синхронном варианте: PTB 20 отдает datetime,
+    а прежний datetime.fromtimestamp() на нем падал.
+    """
+    info_text = "📤 Информация о пересланном сообщении:\n\n"
+    info_text += f"👤 **Отправитель запроса:**\n"
+    info_text += f"• ID: `{user.id}`\n"
+    info_text += f"• Имя: {user.first_name}\n"
+    if user.last_name:
+        info_text += f"• Фамилия: {user.last_name}\n"
+    if user.username:
+        info_text += f"• Username: @{user.username}\n"
+    info_text += "\n"
+    if message.forward_from:
+        forward_user = message.forward_from
+        info_text += f"📤 **Переслано от пользователя:**\n"
+        info_text += f"• ID: `{forward_user.id}`\n"
+        info_text += f"• Имя: {forward_user.first_name}\n"
+        if forward_user.last_name:
+            info_text += f"• Фамилия: {forward_user.last_name}\n"
+        if forward_user.username:
+            info_text += f"• Username: @{forward_user.username}\n"
+        info_text += "\n"
+    if message.forward_from_chat:
+        forward_chat = message.forward_from_chat
+        info_text += f"📢 **Переслано из чата/канала:**\n"
+        info_text += f"• ID: `{forward_chat.id}`\n"
+        info_text += f"• Тип: {forward_chat.type}\n"
+        info_text += f"• Название: {forward_chat.title}\n"
+        if forward_chat.username:
+            info_text += f"• Username: @{forward_chat.username}\n"
+        info_text += "\n"
+    if message.forward_date:
+        if isinstance(message.forward_date, datetime):
+            forward_date = message.forward_date
+        else:
+            forward_date = datetime.fromtimestamp(message.forward_date)
+        info_text += f"📅 **Дата пересылки:**\n"
+        info_text += f"• {forward_date.strftime('%d.%m.%Y %H:%M:%S')}\n\n"
+    info_text += f"💬 **Текущий чат:**\n"
+    info_text += f"• ID: `{chat.id}`\n"
+    info_text += f"• Тип: {chat.type}\n"
+    if chat.title:
+        info_text += f"• Название: {chat.title}\n"
+    if chat.username:
+        info_text += f"• Username: @{chat.username}\n"
+    return info_text
+
+
+def legacy_message_markdown(message, user, chat):
+    """Прежний TelegramBot.handle_message"""
+    info_text = (
+        f"📝 **Информация о сообщении:**\n\n"
+        f"👤 **Отправитель:**\n"
+        f"• ID: `{user.id}`\n"
+        f"• Имя: {user.first_name}\n"
+    )
+    if user.last_name:
+        info_text += f"• Фамилия: {user.last_name}\n"
+    if user.username:
+        info_text += f"• Username: @{user.username}\n"
+    info_text += f"\n💬 **Чат:**\n"
+    info_text += f"• ID: `{chat.id}`\n"
+    info_text += f"• Тип: {chat.type}\n"
+    if chat.title:
+        info_text += f"• Название: {chat.title}\n"
+    if chat.username:
+        info_text += f"• Username: @{chat.username}\n"
+    info_text += f"\n💡 **Подсказка:** Перешлите сообщение из другого чата, "
+    info_text += f"чтобы получить больше информации!"
+    return info_text
+
+
+def legacy_format(message, user, chat):
+    if message.text == '/start':
+        return legacy_start(user)
+    if message.forward_from or message.forward_from_chat:
+        return legacy_forwarded(message, user, chat)
+    return legacy_message(message, user, chat)
+
+
+def legacy_format_markdown(message, user, chat):
+    # /start и в асинхронном пути отправлялся без разметки
+    if message.text == '/start':
+        return legacy_start(user)
+    if message.forward_from or message.forward_from_chat:
+        return legacy_forwarded_markdown(message, user, chat)
+    return legacy_message_markdown(message, user, chat)
+
+
+def catalog_format(message, user, chat):
+    """То же ветвление, что в TelegramBot.webhook_handler_sync"""
+    replies = get_replies(user.language_code)
+    if message.text == '/start':
+        return replies.start(user)
+    if message.forward_from or message.forward_from_chat:
+        return replies.forwarded(message, user, chat)
+    return replies.message(message, user, chat)
+
+
+def catalog_format_markdown(message, user, chat):
+    """То же, что в асинхронных обработчиках TelegramBot"""
+    if message.text == '/start':
+        return get_replies(user.language_code).start(user)
+    replies = get_replies(user.language_code, markdown=True)
+    if message.forward_from or message.forward_from_chat:
+        return replies.forwarded(message, user, chat)
+    return replies.message(message, user, chat)
+
+
+def make_updates(count, languages, seed=1):
+    """Сообщения трех видов: /start, обычный текст, пересланное"""
+    from telegram import Update
+
+    rnd = random.Random(seed)
+    updates = []
+    for i in range(count):
+        uid = rnd.randrange(10 ** 8, 10 ** 10)
+        sender = {'id': uid, 'is_bot': False, 'first_name': 'Иван', 'language_code': rnd.choice(languages)}
+        if rnd.random() < 0.5:
+            sender['last_name'] = 'Петров'
+        if rnd.random() < 0.7:
+            sender['username'] = f'u{uid}'
+        message = {
+            'message_id': i, 'date': 1700000000,
+            'chat': {'id': uid, 'type': 'private', 'first_name': 'Иван'},
+            'from': sender,
+        }
+        kind = rnd.random()
+        if kind < 0.2:
+            message['text'] = '/start'
+        elif kind < 0.6:
+            message['text'] = 'привет'
+        else:
+            message['text'] = 'пересланное'
+            if rnd.random() < 0.5:
+                message['forward_from'] = {'id': uid + 1, 'is_bot': False, 'first_name': 'Анна', 'username': 'anna'}
+            else:
+                message['forward_from_chat'] = {'id': -100 * uid, 'type': 'channel', 'title': 'Новости',
+                                                'username': 'news'}
+            message['forward_date'] = 1700000000 - i
+        update = Update.de_json({'update_id': i, 'message': message}, None)
+        updates.append((update.message, update.effective_user, update.effective_chat))
+    return updates
+
+
+def best_time(format_reply, updates, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for message, user, chat in updates:
+            format_reply(message, user, chat)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время форматирования ответа: каталог i18n и прежние f-строки")
+    parser.add_argument('--updates', type=int, default=20000, help="Количество обновлений")
+    parser.add_argument('--repeat', type=int, default=5, help="Повторы; берется лучший результат")
+    args = parser.parse_args()
+
+    russian = make_updates(args.updates, ['ru'])
+    mismatches = 0
+    for variant, legacy, catalog in (("текст", legacy_format, catalog_format),
+                                     ("Markdown", legacy_format_markdown, catalog_format_markdown)):
+        count = sum(1 for item in russian if legacy(*item) != catalog(*item))
+        print(f"Обновлений: {args.updates}, расхождений русских шаблонов с прежним текстом ({variant}): {count}")
+        mismatches += count
+
+    mixed = make_updates(args.updates, list(CATALOG) + ['en-US', 'de', None])
+    cases = [
+        ("прежние f-строки (ru)", legacy_format, russian),
+        ("каталог i18n (ru)", catalog_format, russian),
+        ("каталог i18n (смесь языков)", catalog_format, mixed),
+    ]
+    print(f"{'Вариант':<32} {'мкс/update':>11} {'upd/s':>10}")
+    for name, format_reply, updates in cases:
+        elapsed = best_time(format_reply, updates, args.repeat)
+        print(f"{name:<32} {elapsed / len(updates) * 1e6:>11.2f} {len(updates) / elapsed:>10.0f}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
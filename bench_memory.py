@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк памяти для долгоживущего состояния бота.
+
+Сравнивает, сколько байт занимает одна отслеживаемая сущность (отметка
+update, счетчик пользователя) в разных представлениях:
+
+    python bench_memory.py --entities 1000000
+
+Время построения измеряется под tracemalloc и годится только для сравнения
+представлений между собой. Массивы IntTable лежат в анонимном mmap, который
+tracemalloc не видит, поэтому их размер добавляется по IntTable.nbytes.
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from state import MemoryStateBackend
+
+
+def measure(build):
+    """Прирост памяти (байт) после построения структуры"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    holder = build()
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    untracked = sum(table.nbytes for table in getattr(holder, '_tables', {}).values())
+    del holder
+    return after - before + untracked, elapsed
+
+
+def build_ptb_users(count):
+    """Объекты telegram.User в dict по ID (если держать в памяти сами объекты PTB)"""
+    from telegram import User
+    return {i: User(id=i, first_name='User', is_bot=False, username=f'user{i}') for i in range(count)}
+
+
+def build_dict_entries(count):
+    """Прежнее представление MemoryStateBackend: "prefix:id" -> [str, expires]"""
+    now = time.monotonic()
+    data = {}
+    for i in range(count):
+        data[f"update:{i}"] = [str(1), now + 3600]
+    return data
+
+
+def build_memory_backend(count):
+    """Текущий MemoryStateBackend (IntTable для целочисленных ключей)"""
+    backend = MemoryStateBackend()
+    for i in range(count):
+        backend.add(f"update:{i}", 1, ttl=3600)
+    return backend
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Память на одну отслеживаемую сущность")
+    parser.add_argument('--entities', type=int, default=200000, help="Количество сущностей")
+    parser.add_argument('--skip-ptb', action='store_true', help="Не измерять объекты telegram.User")
+    args = parser.parse_args()
+
+    cases = [
+        ("dict: str-ключ -> [значение, срок]", build_dict_entries),
+        ("MemoryStateBackend (IntTable)", build_memory_backend),
+    ]
+    if not args.skip_ptb:
+        cases.insert(0, ("dict: id -> telegram.User", build_ptb_users))
+
+    print(f"Сущностей: {args.entities}")
+    print(f"{'Представление':<40} {'байт/сущность':>14} {'всего, МБ':>10} {'время, с':>9}")
+    for name, build in cases:
+        total, elapsed = measure(lambda: build(args.entities))
+        print(f"{name:<40} {total / args.entities:>14.1f} {total / 2 ** 20:>10.1f} {elapsed:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,87 @@
 import logging
 import asyncio
+import time
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from config import BOT_TOKEN, WEBHOOK_URL, WEBHOOK_PORT
+from telegram.ext import (
+    Application, ApplicationHandlerStop, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes
+)
+from config import (
+    BOT_TOKEN, WEBHOOK_URL, WEBHOOK_PORT, STATE_BACKEND, LOG_LEVEL,
+    CONCURRENCY_INITIAL_LIMIT, CONCURRENCY_MIN_LIMIT, CONCURRENCY_MAX_LIMIT,
+    CONCURRENCY_TARGET_LATENCY, CONCURRENCY_BACKOFF, TRACE_EXPORT, TRACE_SERVICE_NAME, settings
+)
+from abuse import AbuseLimiter, ALLOW, DROP
+from concurrency import AdaptiveLimiter
+from i18n import get_replies
+from media import MediaInspector, extract_media
+from metrics import Histogram
+from state import create_state_backend
+from tracing import tracer, install_log_context, BatchExportProcessor, create_exporter, KIND_CLIENT
 
-# Настройка логирования
+# Настройка логирования (с ID trace для связи строк лога с обработкой update)
+install_log_context()
 logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+    format='%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s',
+    level=LOG_LEVEL.upper()
 )
 logger = logging.getLogger(__name__)
 
+# Выгрузка span'ов обработки обновлений
+if TRACE_EXPORT:
+    tracer.add_processor(BatchExportProcessor(create_exporter(TRACE_EXPORT), TRACE_SERVICE_NAME))
+
+WEBHOOK_ENDPOINT = f"{WEBHOOK_URL}:{WEBHOOK_PORT}/webhook"
+
+class TelegramAPIError(Exception):
+    """Bot API вернул ошибку"""
+
+    def __init__(self, method, description):
+        super().__init__(f"{method}: {description}")
+        self.method = method
+        self.description = description
+
+SEND_LATENCY = Histogram('telegram_send_latency_seconds', 'Задержка вызова sendMessage', ['status'])
+
 class TelegramBot:
-    def __init__(self):
-        self.application = Application.builder().token(BOT_TOKEN).build()
+    def __init__(self, state=None, token=None, request=None):
+        builder = Application.builder().token(token or BOT_TOKEN)
+        if request is not None:
+            # Свой транспорт Bot API (например, заглушка для replay.py)
+            builder = builder.request(request).get_updates_request(request)
+        self.application = builder.build()
+        # Общее состояние: все, что должно быть согласовано между процессами и репликами
+        self.state = state or create_state_backend(STATE_BACKEND)
+        # Ограничение параллельной обработки webhook по задержке sendMessage
+        self.limiter = AdaptiveLimiter(
+            initial_limit=CONCURRENCY_INITIAL_LIMIT,
+            min_limit=CONCURRENCY_MIN_LIMIT,
+            max_limit=CONCURRENCY_MAX_LIMIT,
+            target_latency=CONCURRENCY_TARGET_LATENCY,
+            backoff=CONCURRENCY_BACKOFF
+        )
+        # Ограничение частоты ответов одному пользователю
+        self.abuse = AbuseLimiter(self.state, limit=settings.ABUSE_LIMIT, window=settings.ABUSE_WINDOW)
+        # Скачивание и хеширование вложений пересланных сообщений (MEDIA_HASH)
+        self.media = MediaInspector(
+            self, self.state,
+            enabled=settings.MEDIA_HASH,
+            max_bytes=settings.MEDIA_MAX_BYTES,
+            timeout=settings.MEDIA_TIMEOUT,
+            workers=settings.MEDIA_WORKERS,
+            queue_size=settings.MEDIA_QUEUE_SIZE,
+            cache_size=settings.MEDIA_CACHE_SIZE,
+            cache_ttl=settings.MEDIA_CACHE_TTL
+        )
         self.setup_handlers()
     
     def setup_handlers(self):
         """Настройка обработчиков сообщений"""
+        # Отбрасываем повторные доставки одного и того же update до остальных обработчиков
+        self.application.add_handler(TypeHandler(Update, self.drop_duplicate_update), group=-2)
+        
+        # Ограничение частоты: после дедупликации, но до форматирования ответа
+        self.application.add_handler(TypeHandler(Update, self.throttle_abuser), group=-1)
+        
         # Обработчик команды /start
         self.application.add_handler(CommandHandler("start", self.start_command))
         
@@ -27,118 +91,75 @@ class TelegramBot:
         # Обработчик всех остальных сообщений
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
     
+    def is_duplicate_update(self, update_id):
+        """Проверка, обрабатывался ли уже update с таким ID"""
+        if update_id is None:
+            return False
+        try:
+            return not self.state.add(f"update:{update_id}", 1, ttl=settings.UPDATE_DEDUP_TTL)
+        except Exception as e:
+            # Недоступное хранилище не должно останавливать обработку
+            logger.warning(f"Ошибка проверки дубликата update {update_id}: {e}")
+            return False
+    
+    async def drop_duplicate_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Прерывание обработки повторно доставленного update"""
+        if self.is_duplicate_update(update.update_id):
+            logger.info(f"Повторный update {update.update_id} пропущен")
+            raise ApplicationHandlerStop
+    
+    async def throttle_abuser(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Короткий ответ или молчание вместо полного ответа слишком частому отправителю"""
+        user = update.effective_user
+        if update.message is None or user is None:
+            return
+        tier = self.abuse.check(user.id)
+        if tier == ALLOW:
+            return
+        if tier != DROP:
+            await update.message.reply_text(get_replies(user.language_code).slow_down)
+        raise ApplicationHandlerStop
+    
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка команды /start"""
         user = update.effective_user
-        welcome_text = (
-            f"👋 Привет, {user.first_name}!\n\n"
-            "Я бот для получения информации о пользователях и каналах.\n\n"
-            "📋 Что я умею:\n"
-            "• Отвечаю на команду /start\n"
-            "• Анализирую пересланные сообщения\n"
-            "• Показываю ID пользователей и каналов\n\n"
-            "📤 Перешлите мне сообщение из другого чата или канала, "
-            "и я покажу всю доступную информацию!"
-        )
-        
-        await update.message.reply_text(welcome_text)
+        await update.message.reply_text(get_replies(user.language_code).start(user))
     
     async def handle_forwarded_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка пересланных сообщений"""
         message = update.message
         user = update.effective_user
-        
-        # Собираем информацию о пересланном сообщении
-        info_text = "📤 Информация о пересланном сообщении:\n\n"
-        
-        # Информация о текущем пользователе
-        info_text += f"👤 **Отправитель запроса:**\n"
-        info_text += f"• ID: `{user.id}`\n"
-        info_text += f"• Имя: {user.first_name}\n"
-        if user.last_name:
-            info_text += f"• Фамилия: {user.last_name}\n"
-        if user.username:
-            info_text += f"• Username: @{user.username}\n"
-        info_text += "\n"
-        
-        # Информация о пересланном сообщении
-        if message.forward_from:
-            forward_user = message.forward_from
-            info_text += f"📤 **Переслано от пользователя:**\n"
-            info_text += f"• ID: `{forward_user.id}`\n"
-            info_text += f"• Имя: {forward_user.first_name}\n"
-            if forward_user.last_name:
-                info_text += f"• Фамилия: {forward_user.last_name}\n"
-            if forward_user.username:
-                info_text += f"• Username: @{forward_user.username}\n"
-            info_text += "\n"
-        
-        # Информация о чате, откуда переслано
-        if message.forward_from_chat:
-            forward_chat = message.forward_from_chat
-            info_text += f"📢 **Переслано из чата/канала:**\n"
-            info_text += f"• ID: `{forward_chat.id}`\n"
-            info_text += f"• Тип: {forward_chat.type}\n"
-            info_text += f"• Название: {forward_chat.title}\n"
-            if forward_chat.username:
-                info_text += f"• Username: @{forward_chat.username}\n"
-            info_text += "\n"
-        
-        # Информация о дате пересылки
-        if message.forward_date:
-            from datetime import datetime
-            forward_date = datetime.fromtimestamp(message.forward_date)
-            info_text += f"📅 **Дата пересылки:**\n"
-            info_text += f"• {forward_date.strftime('%d.%m.%Y %H:%M:%S')}\n\n"
-        
-        # Информация о текущем чате
-        chat = message.chat
-        info_text += f"💬 **Текущий чат:**\n"
-        info_text += f"• ID: `{chat.id}`\n"
-        info_text += f"• Тип: {chat.type}\n"
-        if chat.title:
-            info_text += f"• Название: {chat.title}\n"
-        if chat.username:
-            info_text += f"• Username: @{chat.username}\n"
-        
-        await message.reply_text(info_text, parse_mode='Markdown')
+        replies = get_replies(user.language_code, markdown=True)
+        media = extract_media(message)
+        analysis = None
+        future = self.media.submit(media)
+        if future is not None and settings.MEDIA_WAIT > 0:
+            try:
+                # shield: по таймауту перестаем ждать сами, а общая загрузка продолжается
+                analysis = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), settings.MEDIA_WAIT)
+            except asyncio.TimeoutError:
+                pass
+        text = replies.forwarded(message, user, message.chat, media, analysis)
+        await message.reply_text(text, parse_mode='Markdown')
     
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка обычных текстовых сообщений"""
         message = update.message
         user = update.effective_user
-        
-        info_text = (
-            f"📝 **Информация о сообщении:**\n\n"
-            f"👤 **Отправитель:**\n"
-            f"• ID: `{user.id}`\n"
-            f"• Имя: {user.first_name}\n"
-        )
-        
-        if user.last_name:
-            info_text += f"• Фамилия: {user.last_name}\n"
-        if user.username:
-            info_text += f"• Username: @{user.username}\n"
-        
-        info_text += f"\n💬 **Чат:**\n"
-        info_text += f"• ID: `{message.chat.id}`\n"
-        info_text += f"• Тип: {message.chat.type}\n"
-        
-        if message.chat.title:
-            info_text += f"• Название: {message.chat.title}\n"
-        if message.chat.username:
-            info_text += f"• Username: @{message.chat.username}\n"
-        
-        info_text += f"\n💡 **Подсказка:** Перешлите сообщение из другого чата, "
-        info_text += f"чтобы получить больше информации!"
-        
-        await message.reply_text(info_text, parse_mode='Markdown')
+        replies = get_replies(user.language_code, markdown=True)
+        await message.reply_text(replies.message(message, user, message.chat), parse_mode='Markdown')
     
     def webhook_handler_sync(self, update_dict):
         """Полностью синхронная обработка webhook"""
         try:
+            update_id = update_dict.get('update_id')
+            if self.is_duplicate_update(update_id):
+                logger.info(f"Повторный update {update_id} пропущен")
+                return True
+            
             from telegram import Update
-            update = Update.de_json(update_dict, self.application.bot)
+            with tracer.span('parse'):
+                update = Update.de_json(update_dict, self.application.bot)
             
             message = update.message
             user = update.effective_user
@@ -147,141 +168,108 @@ class TelegramBot:
             if not message:
                 return True
             
-            # Определяем тип сообщения и формируем ответ
-            if message.text == '/start':
-                response_text = f"👋 Привет, {user.first_name}!\n\nЯ бот для получения информации о пользователях и каналах.\n\n📋 Что я умею:\n• Отвечаю на команду /start\n• Анализирую пересланные сообщения\n• Показываю ID пользователей и каналов\n\n📤 Перешлите мне сообщение из другого чата или канала, и я покажу всю доступную информацию!"
-            elif message.forward_from or message.forward_from_chat:
-                response_text = self._format_forwarded_info_sync(message, user, chat)
-            else:
-                response_text = self._format_message_info_sync(message, user, chat)
+            # Частому отправителю - короткий ответ или ничего, до форматирования
+            tier = self.abuse.check(user.id) if user else ALLOW
+            if tier == DROP:
+                return True
             
-            # Отправляем ответ синхронно через HTTP API
-            import requests
-            url = f"https://api.telegram.org/bot{self.application.bot.token}/sendMessage"
-            data = {
-                'chat_id': chat.id,
-                'text': response_text,
-                # 'parse_mode': 'Markdown'  # закомментируйте эту строку
-            }
+            # Определяем тип сообщения и формируем ответ на языке пользователя
+            started = time.monotonic()
+            with tracer.span('format') as span:
+                replies = get_replies(user.language_code)
+                span.set_attribute('bot.locale', replies.locale)
+                if tier != ALLOW:
+                    span.set_attribute('bot.reply', 'slow_down')
+                    response_text = replies.slow_down
+                elif message.text == '/start':
+                    span.set_attribute('bot.reply', 'start')
+                    response_text = replies.start(user)
+                elif message.forward_from or message.forward_from_chat:
+                    span.set_attribute('bot.reply', 'forwarded')
+                    media = extract_media(message)
+                    analysis = None
+                    if media is not None:
+                        span.set_attribute('bot.media', media['kind'])
+                        with tracer.span('media'):
+                            analysis = self.media.inspect(media, settings.MEDIA_WAIT)
+                    response_text = replies.forwarded(message, user, chat, media, analysis)
+                else:
+                    span.set_attribute('bot.reply', 'message')
+                    response_text = replies.message(message, user, chat)
             
-            response = requests.post(url, json=data)
-            if response.status_code == 200:
-                logger.info(f"Сообщение отправлено в чат {chat.id}")
-            else:
-                logger.error(f"Ошибка отправки: {response.status_code} - {response.text}")
+            # Отправляем ответ синхронно через HTTP API
+            self._send_message_sync(chat.id, response_text)
+            if tier == ALLOW:
+                self.abuse.observe_reply(time.monotonic() - started)
             
             return True
             
         except Exception as e:
             logger.error(f"Ошибка в webhook_handler_sync: {e}")
+            # Даем Telegram повторить доставку: снимаем отметку об обработке
+            try:
+                self.state.delete(f"update:{update_dict.get('update_id')}")
+            except Exception:
+                pass
             return False
 
-    def _format_forwarded_info_sync(self, message, user, chat):
-        """Форматирование информации о пересланном сообщении"""
-        info_text = "📤 Информация о пересланном сообщении:\n\n"
-        
-        # Информация о текущем пользователе
-        info_text += f"👤 Отправитель запроса:\n"
-        info_text += f"• ID: {user.id}\n"
-        info_text += f"• Имя: {user.first_name}\n"
-        if user.last_name:
-            info_text += f"• Фамилия: {user.last_name}\n"
-        if user.username:
-            info_text += f"• Username: @{user.username}\n"
-        info_text += "\n"
-        
-        # Информация о пересланном сообщении
-        if message.forward_from:
-            forward_user = message.forward_from
-            info_text += f"📤 Переслано от пользователя:\n"
-            info_text += f"• ID: {forward_user.id}\n"
-            info_text += f"• Имя: {forward_user.first_name}\n"
-            if forward_user.last_name:
-                info_text += f"• Фамилия: {forward_user.last_name}\n"
-            if forward_user.username:
-                info_text += f"• Username: @{forward_user.username}\n"
-            info_text += "\n"
-        
-        # Информация о чате, откуда переслано
-        if message.forward_from_chat:
-            forward_chat = message.forward_from_chat
-            info_text += f"📢 Переслано из чата/канала:\n"
-            info_text += f"• ID: {forward_chat.id}\n"
-            info_text += f"• Тип: {forward_chat.type}\n"
-            if forward_chat.title:
-                info_text += f"• Название: {forward_chat.title}\n"
-            if forward_chat.username:
-                info_text += f"• Username: @{forward_chat.username}\n"
-            info_text += "\n"
+    def _send_message_sync(self, chat_id, text):
+        """Отправка сообщения через HTTP API с учетом задержки в лимитере"""
+        import requests
+        url = f"https://api.telegram.org/bot{self.application.bot.token}/sendMessage"
+        data = {
+            'chat_id': chat_id,
+            'text': text,
+            # 'parse_mode': 'Markdown'  # закомментируйте эту строку
+        }
         
-        # Информация о дате пересылки (исправлено)
-        if hasattr(message, 'forward_date') and message.forward_date:
+        with tracer.span('send', kind=KIND_CLIENT) as span:
+            started = time.monotonic()
             try:
-                from datetime import datetime
-                # Проверяем тип forward_date
-                if isinstance(message.forward_date, datetime):
-                    forward_date = message.forward_date
-                else:
-                    # Если это timestamp, конвертируем
-                    forward_date = datetime.fromtimestamp(message.forward_date)
-                
-                info_text += f"📅 Дата пересылки:\n"
-                info_text += f"• {forward_date.strftime('%d.%m.%Y %H:%M:%S')}\n\n"
-            except Exception as e:
-                logger.warning(f"Ошибка форматирования даты: {e}")
-                info_text += f"📅 Дата пересылки:\n"
-                info_text += f"• {message.forward_date}\n\n"
+                response = requests.post(url, json=data, timeout=settings.SEND_TIMEOUT)
+            except requests.RequestException:
+                elapsed = time.monotonic() - started
+                SEND_LATENCY.observe(elapsed, status='error')
+                self.limiter.observe(elapsed, ok=False)
+                raise
+            elapsed = time.monotonic() - started
+            span.set_attribute('http.status_code', response.status_code)
         
-        # Информация о текущем чате
-        info_text += f"💬 Текущий чат:\n"
-        info_text += f"• ID: {chat.id}\n"
-        info_text += f"• Тип: {chat.type}\n"
-        if hasattr(chat, 'title') and chat.title:
-            info_text += f"• Название: {chat.title}\n"
-        if hasattr(chat, 'username') and chat.username:
-            info_text += f"• Username: @{chat.username}\n"
+        SEND_LATENCY.observe(elapsed, status=str(response.status_code))
+        # 4xx - ошибка запроса, а не перегрузка; на лимит влияют только 429 и 5xx
+        overloaded = response.status_code == 429 or response.status_code >= 500
+        self.limiter.observe(elapsed, ok=not overloaded)
         
-        return info_text
+        if response.status_code == 200:
+            logger.info(f"Сообщение отправлено в чат {chat_id}")
+        else:
+            logger.error(f"Ошибка отправки: {response.status_code} - {response.text}")
+        return response
+
+    def api_call_sync(self, method, params=None, timeout=None):
+        """Синхронный вызов метода Bot API; возвращает поле result"""
+        import requests
+        url = f"https://api.telegram.org/bot{self.application.bot.token}/{method}"
+        response = requests.post(url, json=params or {}, timeout=timeout or settings.SEND_TIMEOUT)
+        try:
+            payload = response.json()
+        except ValueError:
+            raise TelegramAPIError(method, f"HTTP {response.status_code}: {response.text[:200]}")
+        if not payload.get('ok'):
+            raise TelegramAPIError(method, payload.get('description', f"HTTP {response.status_code}"))
+        return payload.get('result')
 
-    def _format_message_info_sync(self, message, user, chat):
-        """Форматирование информации о сообщении"""
-        info_text = (
-            f"📝 Информация о сообщении:\n\n"
-            f"👤 Отправитель:\n"
-            f"• ID: {user.id}\n"
-            f"• Имя: {user.first_name}\n"
-        )
-        
-        if user.last_name:
-            info_text += f"• Фамилия: {user.last_name}\n"
-        if user.username:
-            info_text += f"• Username: @{user.username}\n"
-        
-        info_text += f"\n💬 Чат:\n"
-        info_text += f"• ID: {chat.id}\n"
-        info_text += f"• Тип: {chat.type}\n"
-        
-        if hasattr(chat, 'title') and chat.title:
-            info_text += f"• Название: {chat.title}\n"
-        if hasattr(chat, 'username') and chat.username:
-            info_text += f"• Username: @{chat.username}\n"
-        
-        info_text += f"\n💡 Подсказка: Перешлите сообщение из другого чата, "
-        info_text += f"чтобы получить больше информации!"
-        
-        return info_text
-    
     def run_webhook(self):
         """Запуск бота через webhook"""
         # Устанавливаем webhook
-        self.application.bot.set_webhook(url=f"{WEBHOOK_URL}:{WEBHOOK_PORT}/webhook")
-        logger.info(f"Webhook установлен на {WEBHOOK_URL}:{WEBHOOK_PORT}/webhook")
+        self.application.bot.set_webhook(url=WEBHOOK_ENDPOINT)
+        logger.info(f"Webhook установлен на {WEBHOOK_ENDPOINT}")
         
         # Запускаем приложение
         self.application.run_webhook(
             listen="0.0.0.0",
             port=WEBHOOK_PORT,
-            webhook_url=f"{WEBHOOK_URL}:{WEBHOOK_PORT}/webhook"
+            webhook_url=WEBHOOK_ENDPOINT
         )
 
 if __name__ == "__main__":
@@ -0,0 +1,227 @@
+"""
+Запись входящих обновлений /webhook для replay.py и бенчмарков.
+
+Выбранная доля запросов (CAPTURE_SAMPLE_RATE) кладется в ограниченную
+очередь; фоновый поток обезличивает их и пишет в сжатые JSONL-файлы
+с ротацией по размеру. Обработка запроса никогда не ждет диска: при
+переполненной очереди запись просто пропускается.
+
+Обезличивание детерминировано: одинаковые ID и имена при одной соли
+превращаются в одинаковые значения, поэтому связи между обновлениями
+в записи сохраняются.
+"""
+
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+from metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+SAMPLED_COUNTER = Counter('capture_sampled_total', 'Обновления, выбранные для записи')
+DROPPED_COUNTER = Counter('capture_dropped_total', 'Обновления, не записанные из-за переполненной очереди')
+WRITTEN_COUNTER = Counter('capture_written_total', 'Записанные обновления')
+QUEUE_GAUGE = Gauge('capture_queue_size', 'Обновления в очереди записи')
+
+# Поля с персональными данными и префиксы для обезличенных значений
+NAME_FIELDS = {
+    'first_name': 'Name',
+    'last_name': 'Surname',
+    'title': 'Chat',
+    'username': 'user',
+    'phone_number': 'phone',
+    # Пересылка от скрытого пользователя: вместо объекта User приходит только имя
+    'forward_sender_name': 'Name',
+    'sender_user_name': 'Name',
+    # Подписи авторов постов в каналах
+    'forward_signature': 'Author',
+    'author_signature': 'Author',
+}
+ID_FIELDS = ('user_id', 'chat_id')
+TEXT_FIELDS = ('text', 'caption')
+# Маскируются всегда, даже с CAPTURE_KEEP_TEXT: в vCard контакта имя, телефоны и адреса
+PRIVATE_FIELDS = ('vcard',)
+
+
+class Redactor:
+    """Детерминированное обезличивание обновлений"""
+
+    def __init__(self, salt, keep_text=False):
+        self._key = salt.encode() if isinstance(salt, str) else salt
+        self.keep_text = keep_text
+
+    def _digest(self, value):
+        return hmac.new(self._key, str(value).encode(), hashlib.sha256).digest()
+
+    def hash_id(self, value):
+        """Целый ID -> 48-битный хеш с тем же знаком (отрицательные ID - группы и каналы)"""
+        hashed = int.from_bytes(self._digest(value)[:6], 'big') or 1
+        return -hashed if value < 0 else hashed
+
+    def hash_name(self, prefix, value):
+        return f"{prefix}_{self._digest(value)[:4].hex()}"
+
+    @staticmethod
+    def _mask_text(text):
+        # Команды нужны для воспроизведения; остальной текст заменяется
+        # строкой той же длины, чтобы смещения entities оставались верными.
+        # Telegram считает смещения в кодовых единицах UTF-16: эмодзи - это две
+        # единицы, а 'x' - одна
+        if text.startswith('/'):
+            return text
+        return 'x' * (len(text.encode('utf-16-le')) // 2)
+
+    def redact(self, value):
+        if isinstance(value, list):
+            return [self.redact(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+
+        # Пользователь или чат: у них есть is_bot или type вместе с id
+        is_entity = 'id' in value and ('is_bot' in value or 'type' in value)
+        result = {}
+        for key, item in value.items():
+            if key in NAME_FIELDS and isinstance(item, str):
+                result[key] = self.hash_name(NAME_FIELDS[key], item)
+            elif isinstance(item, int) and not isinstance(item, bool) and (
+                    key in ID_FIELDS or (key == 'id' and is_entity)):
+                result[key] = self.hash_id(item)
+            elif key in TEXT_FIELDS and isinstance(item, str) and not self.keep_text:
+                result[key] = self._mask_text(item)
+            elif key in PRIVATE_FIELDS and isinstance(item, str):
+                result[key] = 'x' * len(item)
+            else:
+                result[key] = self.redact(item)
+        return result
+
+
+class TrafficCapture:
+    """Выборочная запись обновлений в фоновом потоке"""
+
+    def __init__(self, directory, sample_rate, salt, max_bytes=64 * 2 ** 20, max_age=3600, max_files=100,
+                 queue_size=10000, keep_text=False):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_files = max_files
+        self.redactor = Redactor(salt, keep_text=keep_text)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._path = None
+        self._written = 0
+        self._opened_at = 0.0
+        self._sequence = 0
+        self._thread = None
+        QUEUE_GAUGE.set_function(self._queue.qsize)
+
+    def configure(self, sample_rate=None, max_bytes=None, max_age=None, max_files=None, keep_text=None):
+        """Изменение параметров на лету; ротация учитывает их со следующей записи"""
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if max_age is not None:
+            self.max_age = max_age
+        if max_files is not None:
+            self.max_files = max_files
+        if keep_text is not None:
+            self.redactor.keep_text = keep_text
+
+    def start(self):
+        """Запуск фонового потока записи"""
+        if self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name='traffic-capture', daemon=True)
+        self._thread.start()
+        logger.info(f"Запись трафика в {self.directory} (доля {self.sample_rate})")
+
+    def offer(self, body):
+        """Предложить сырое тело запроса для записи; никогда не блокирует"""
+        if self._thread is None or random.random() >= self.sample_rate:
+            return False
+        SAMPLED_COUNTER.inc()
+        try:
+            self._queue.put_nowait(body)
+            return True
+        except queue.Full:
+            DROPPED_COUNTER.inc()
+            return False
+
+    def close(self, timeout=10):
+        """Записать очередь, закрыть текущий файл и остановить поток"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                body = self._queue.get(timeout=1)
+            except queue.Empty:
+                # Без новых записей файл все равно закрывается по возрасту,
+                # чтобы запись была доступна для чтения
+                if self._file is not None and self._expired():
+                    self._finish_file()
+                continue
+            if body is None:
+                break
+            try:
+                self._write(body)
+            except Exception as e:
+                logger.error(f"Ошибка записи трафика: {e}")
+        self._finish_file()
+
+    def _expired(self):
+        return self.max_age and time.monotonic() - self._opened_at >= self.max_age
+
+    def _write(self, body):
+        update = self.redactor.redact(json.loads(body))
+        line = (json.dumps(update, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+        if self._file is None or self._written + len(line) > self.max_bytes or self._expired():
+            self._rotate()
+        self._file.write(line)
+        self._written += len(line)
+        WRITTEN_COUNTER.inc()
+
+    def _rotate(self):
+        self._finish_file()
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        self._sequence += 1
+        name = f"capture-{stamp}-{os.getpid()}-{self._sequence:04d}.jsonl.gz"
+        # Пока файл пишется, у него суффикс .part: незакрытый gzip нельзя прочитать до конца
+        self._path = os.path.join(self.directory, name + '.part')
+        self._file = gzip.open(self._path, 'wb', compresslevel=6)
+        self._written = 0
+        self._opened_at = time.monotonic()
+
+    def _finish_file(self):
+        if self._file is None:
+            return
+        self._file.close()
+        os.replace(self._path, self._path[:-len('.part')])
+        self._file = None
+        self._cleanup()
+
+    def _cleanup(self):
+        """Удаление старых файлов сверх max_files"""
+        if not self.max_files:
+            return
+        files = sorted(
+            (os.path.join(self.directory, name) for name in os.listdir(self.directory)
+             if name.startswith('capture-') and name.endswith('.jsonl.gz')),
+            key=os.path.getmtime
+        )
+        for path in files[:-self.max_files]:
+            os.remove(path)
@@ -101,16 +101,17 @@ def check_environment():
         print("💡 Скопируйте env.example в .env и настройте переменные")
         return False
     
-    # Загружаем переменные окружения
+    # Читаем .env без load_dotenv(): иначе его значения попадут в окружение
+    # процесса, и проверка конфигурации покажет их источником [env]
     try:
-        from dotenv import load_dotenv
-        load_dotenv()
+        from dotenv import dotenv_values
+        env_values = dotenv_values(env_file)
         
         required_vars = ['BOT_TOKEN']
         missing_vars = []
         
         for var in required_vars:
-            value = os.getenv(var)
+            value = os.getenv(var) or env_values.get(var)
             if value and value != "your_bot_token_here":
                 print(f"✅ {var}: {'*' * len(value)}")
             else:
@@ -133,22 +134,25 @@ def check_config():
     print_section("Проверка конфигурации")
     
     try:
-        from config import BOT_TOKEN, WEBHOOK_URL, WEBHOOK_PORT, FLASK_HOST, FLASK_PORT, FLASK_DEBUG
-        
-        print(f"BOT_TOKEN: {'*' * len(BOT_TOKEN) if BOT_TOKEN else 'не установлен'}")
-        print(f"WEBHOOK_URL: {WEBHOOK_URL}")
-        print(f"WEBHOOK_PORT: {WEBHOOK_PORT}")
-        print(f"FLASK_HOST: {FLASK_HOST}")
-        print(f"FLASK_PORT: {FLASK_PORT}")
-        print(f"FLASK_DEBUG: {FLASK_DEBUG}")
-        
-        if BOT_TOKEN:
-            print("\n✅ Конфигурация загружена корректно")
-            return True
-        else:
-            print("\n❌ BOT_TOKEN не установлен")
+        from config import SCHEMA, ConfigError, load_settings
+
+        try:
+            settings = load_settings(require_token=True)
+        except ConfigError as e:
+            for error in e.errors:
+                print(f"❌ {error}")
             return False
-            
+
+        for setting in SCHEMA:
+            value = getattr(settings, setting.name)
+            if setting.secret and value:
+                value = '*' * len(value)
+            reload_mark = ' (SIGHUP)' if setting.reloadable else ''
+            print(f"{setting.name}: {value}  [{settings.source(setting.name)}]{reload_mark}")
+
+        print("\n✅ Конфигурация загружена корректно")
+        return True
+
     except Exception as e:
         print(f"❌ Ошибка при загрузке конфигурации: {e}")
         return False
@@ -0,0 +1,369 @@
+"""
+Компактные структуры для долгоживущего состояния с целочисленными ключами.
+
+IntTable - хеш-таблица с открытой адресацией поверх упакованных массивов:
+ключ (int64), значение (int64) и срок жизни (float64) занимают 24 байта на
+слот вместо сотен байт на запись в dict со строковыми ключами.
+
+Расширение и сжатие идут постепенно: рядом с новыми массивами остаются
+старые, и каждая запись переносит из них MIGRATE_SLOTS слотов, а очистка
+(sweep) - столько же слотов, сколько просматривает сама. Ни одна операция
+не обходит всю таблицу, так что задержка записи не растет с числом записей.
+
+Таблица может лежать в анонимной разделяемой памяти (IntTable.shared):
+созданная до fork, она видна всем дочерним воркерам. Писать в такую таблицу
+должен один процесс, остальные только читают.
+"""
+
+import mmap
+import struct
+
+EMPTY = -(2 ** 63)
+DELETED = EMPTY + 1
+
+_SLOT_SIZE = 8 + 8 + 8
+_GOLDEN = 0x9E3779B97F4A7C15
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+
+
+def _new_buffer(size):
+    """Буфер под массивы таблицы
+
+    Анонимный mmap не обнуляется заранее: страницы выделяются при первой
+    записи, поэтому крупная таблица создается за время заполнения ключей,
+    а не всего буфера. MAP_PRIVATE сохраняет копирование при записи после
+    fork, как у bytearray.
+    """
+    if hasattr(mmap, 'MAP_PRIVATE'):
+        return mmap.mmap(-1, size, flags=mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS)
+    return bytearray(size)
+
+
+def _fill_empty(buffer, capacity):
+    """Заполнить массив ключей значением EMPTY копированием удваивающихся кусков"""
+    view = memoryview(buffer)
+    total = capacity * 8
+    view[:8] = struct.pack('q', EMPTY)
+    filled = 8
+    while filled < total:
+        step = min(filled, total - filled)
+        view[filled:filled + step] = view[:step]
+        filled += step
+    view.release()
+
+
+class TableFullError(Exception):
+    """В таблице фиксированного размера закончилось место"""
+
+
+class IntTable:
+    """Словарь int64 -> int64 со сроком жизни записей"""
+
+    MAX_LOAD = 0.7
+    # Слотов старых массивов, переносимых в новые за одну вставку во время переноса.
+    # Размер новых массивов выбирается так, чтобы перенос закончился раньше, чем
+    # вставки заполнят их до MAX_LOAD (см. _resize)
+    MIGRATE_SLOTS = 64
+
+    __slots__ = ('_bits', '_capacity', '_buffer', '_keys', '_values', '_expires',
+                 '_used', '_size', '_fixed', '_cursor',
+                 '_old_bits', '_old_buffer', '_old_keys', '_old_values', '_old_expires', '_migrated')
+
+    def __init__(self, capacity=1024, buffer=None):
+        bits = max(3, (capacity - 1).bit_length())
+        self._fixed = buffer is not None
+        self._size = 0
+        self._drop_old()
+        self._allocate(bits, buffer)
+
+    @classmethod
+    def shared(cls, capacity):
+        """Таблица фиксированного размера в разделяемой памяти (наследуется при fork)"""
+        bits = max(3, (int(capacity / cls.MAX_LOAD) - 1).bit_length())
+        return cls(1 << bits, buffer=mmap.mmap(-1, (1 << bits) * _SLOT_SIZE))
+
+    @staticmethod
+    def _views(bits, buffer):
+        """Массивы ключей, значений и сроков жизни поверх буфера"""
+        capacity = 1 << bits
+        view = memoryview(buffer)
+        return (view[:capacity * 8].cast('q'),
+                view[capacity * 8:capacity * 16].cast('q'),
+                view[capacity * 16:capacity * 24].cast('d'))
+
+    def _allocate(self, bits, buffer=None):
+        capacity = 1 << bits
+        if buffer is None:
+            buffer = _new_buffer(capacity * _SLOT_SIZE)
+        _fill_empty(buffer, capacity)
+        self._bits = bits
+        self._capacity = capacity
+        self._buffer = buffer
+        self._keys, self._values, self._expires = self._views(bits, buffer)
+        self._used = 0
+        self._cursor = 0
+
+    def _drop_old(self):
+        self._old_bits = 0
+        self._old_buffer = self._old_keys = self._old_values = self._old_expires = None
+        self._migrated = 0
+
+    def copy(self):
+        """Независимая копия: упакованные массивы копируются целиком, без обхода записей"""
+        clone = IntTable.__new__(IntTable)
+        clone._fixed = False
+        clone._bits = self._bits
+        clone._capacity = self._capacity
+        clone._buffer = bytearray(self._buffer[:self._capacity * _SLOT_SIZE])
+        clone._keys, clone._values, clone._expires = self._views(self._bits, clone._buffer)
+        clone._used = self._used
+        clone._size = self._size
+        clone._cursor = 0
+        clone._drop_old()
+        if self._old_keys is not None:
+            clone._old_bits = self._old_bits
+            clone._old_buffer = bytearray(self._old_buffer[:(1 << self._old_bits) * _SLOT_SIZE])
+            clone._old_keys, clone._old_values, clone._old_expires = self._views(self._old_bits, clone._old_buffer)
+            clone._migrated = self._migrated
+        return clone
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def migrating(self):
+        """Идет перенос из старых массивов"""
+        return self._old_keys is not None
+
+    @property
+    def nbytes(self):
+        """Размер упакованных массивов в байтах (со старыми, пока идет расширение)"""
+        return (self._capacity + (1 << self._old_bits if self._old_keys is not None else 0)) * _SLOT_SIZE
+
+    @staticmethod
+    def _probe(keys, bits, key):
+        """Индекс слота с ключом key в массиве keys или -1"""
+        mask = (1 << bits) - 1
+        i = ((key * _GOLDEN) & _MASK64) >> (64 - bits)
+        while True:
+            k = keys[i]
+            if k == key:
+                return i
+            if k == EMPTY:
+                return -1
+            i = (i + 1) & mask
+
+    def _find(self, key, now):
+        """Индекс живой записи с ключом key или -1"""
+        # Проба по новым массивам встроена: это самый частый путь каждой операции
+        keys = self._keys
+        mask = self._capacity - 1
+        i = ((key * _GOLDEN) & _MASK64) >> (64 - self._bits)
+        while True:
+            k = keys[i]
+            if k == key:
+                break
+            if k == EMPTY:
+                i = -1
+                break
+            i = (i + 1) & mask
+        if i < 0:
+            if self._old_keys is None:
+                return -1
+            j = self._probe(self._old_keys, self._old_bits, key)
+            if j < 0:
+                return -1
+            # Запись еще не перенесена из старых массивов: переносим ее сразу
+            i = self._move(j)
+        expires = self._expires[i]
+        if expires and expires <= now:
+            self._remove_at(i)
+            return -1
+        return i
+
+    def _remove_at(self, i):
+        self._keys[i] = DELETED
+        self._size -= 1
+
+    def _place(self, key):
+        """Слот для ключа, которого нет в новых массивах"""
+        keys = self._keys
+        mask = self._capacity - 1
+        i = ((key * _GOLDEN) & _MASK64) >> (64 - self._bits)
+        while True:
+            k = keys[i]
+            if k == EMPTY:
+                self._used += 1
+                break
+            if k == DELETED:
+                break
+            i = (i + 1) & mask
+        keys[i] = key
+        return i
+
+    def _move(self, j):
+        """Перенос слота j старых массивов в новые"""
+        key = self._old_keys[j]
+        self._old_keys[j] = DELETED
+        i = self._place(key)
+        self._values[i] = self._old_values[j]
+        self._expires[i] = self._old_expires[j]
+        return i
+
+    def migrate(self, now, limit=None):
+        """Перенос следующих limit слотов старых массивов (всех - если None)"""
+        keys, expires = self._old_keys, self._old_expires
+        capacity = 1 << self._old_bits
+        start = self._migrated
+        end = capacity if limit is None else min(capacity, start + limit)
+        # Занятые слоты ищем по списку ключей целиком, как и в sweep
+        occupied = [j for j, k in enumerate(keys[start:end].tolist(), start)
+                    if k != EMPTY and k != DELETED]
+        for j in occupied:
+            if expires[j] and expires[j] <= now:
+                keys[j] = DELETED
+                self._size -= 1
+            else:
+                self._move(j)
+        self._migrated = end
+        if end == capacity:
+            self._drop_old()
+
+    def _insert_at(self, key, now):
+        """Индекс слота для новой записи (ключа в таблице нет)"""
+        if self._old_keys is not None:
+            self.migrate(now, self.MIGRATE_SLOTS)
+        if (self._used + 1) > self._capacity * self.MAX_LOAD:
+            self._resize(now)
+        i = self._place(key)
+        self._size += 1
+        return i
+
+    def _resize(self, now, reserve=0):
+        """Начать перенос записей в массивы по их текущему числу"""
+        if self._fixed:
+            self._rebuild_fixed(now)
+            return
+        if self._old_keys is not None:
+            # Размер массивов ниже не дает вставкам обогнать перенос, а reserve
+            # переносит все сразу; сюда попадаем, только если это нарушено
+            self.migrate(now)
+        # После переноса таблица заполнена не больше чем наполовину от MAX_LOAD, и
+        # до MAX_LOAD остается не меньше вставок, чем нужно на перенос старых
+        # массивов: иначе при сжатии большой таблицы маленькая новая заполнится
+        # раньше, и весь перенос придется сделать за одну вставку
+        pending = (self._capacity + self.MIGRATE_SLOTS - 1) // self.MIGRATE_SLOTS
+        bits = 3
+        while ((self._size + reserve) * 2 > (1 << bits) * self.MAX_LOAD
+               or self._size + reserve + pending + 1 > (1 << bits) * self.MAX_LOAD):
+            bits += 1
+        self._old_bits = self._bits
+        self._old_buffer = self._buffer
+        self._old_keys, self._old_values, self._old_expires = self._keys, self._values, self._expires
+        self._migrated = 0
+        self._allocate(bits)
+
+    def _rebuild_fixed(self, now):
+        """Пересборка таблицы в разделяемой памяти на месте, без изменения размера"""
+        live = [(k, self._values[i], self._expires[i])
+                for i, k in enumerate(self._keys)
+                if k not in (EMPTY, DELETED) and not (self._expires[i] and self._expires[i] <= now)]
+        # Пересобираем только если это освободит место
+        if len(live) + 1 > self._capacity * self.MAX_LOAD:
+            raise TableFullError(f"Таблица заполнена ({len(live)} записей)")
+        self._allocate(self._bits, self._buffer)
+        for key, value, expires in live:
+            i = self._place(key)
+            self._values[i] = value
+            self._expires[i] = expires
+        self._size = len(live)
+
+    def reserve(self, count, now):
+        """Заранее расширить таблицу под count новых записей
+
+        Массовая вставка без этого идет через серию расширений, а записи,
+        выгруженные из другой таблицы, приходят в порядке хешей и в
+        маленькой таблице выстраиваются в длинные цепочки проб. Перенос
+        здесь выполняется сразу целиком: reserve зовется при загрузке снимка,
+        до приема запросов.
+        """
+        if not self._fixed and (self._used + count) > self._capacity * self.MAX_LOAD:
+            self._resize(now, reserve=count)
+            self.migrate(now)
+
+    def get(self, key, now):
+        i = self._find(key, now)
+        return None if i < 0 else self._values[i]
+
+    def put(self, key, value, expires, now):
+        """Записать значение; expires - момент истечения (0 - бессрочно)"""
+        i = self._find(key, now)
+        if i < 0:
+            i = self._insert_at(key, now)
+        self._values[i] = value
+        self._expires[i] = expires or 0.0
+
+    def add(self, key, value, expires, now):
+        """Записать значение, только если ключа нет"""
+        if self._find(key, now) >= 0:
+            return False
+        i = self._insert_at(key, now)
+        self._values[i] = value
+        self._expires[i] = expires or 0.0
+        return True
+
+    def incr(self, key, amount, expires, now):
+        """Увеличить счетчик; expires применяется только к новой записи"""
+        i = self._find(key, now)
+        if i < 0:
+            i = self._insert_at(key, now)
+            self._values[i] = amount
+            self._expires[i] = expires or 0.0
+            return amount
+        value = self._values[i] + amount
+        self._values[i] = value
+        return value
+
+    def delete(self, key, now):
+        i = self._find(key, now)
+        if i >= 0:
+            self._remove_at(i)
+            return True
+        return False
+
+    def sweep(self, now, limit=None):
+        """Удалить просроченные записи в следующих limit слотах (все - если None)
+
+        Проход по частям не дает одной очистке остановить обработку, когда
+        в таблице миллионы записей. Из старых массивов за тот же вызов
+        переносится столько же слотов (их просроченные записи перенос
+        отбрасывает), так что они освобождаются и без новых вставок.
+        """
+        if self._old_keys is not None:
+            self.migrate(now, limit)
+        keys = self._keys
+        start = self._cursor if limit is not None else 0
+        end = min(self._capacity, start + limit) if limit is not None else self._capacity
+        # Кандидатов ищем по списку сроков целиком: это в разы быстрее обращений к слотам по одному
+        expired = [i for i, expires in enumerate(self._expires[start:end].tolist(), start)
+                   if expires and expires <= now]
+        for i in expired:
+            k = keys[i]
+            if k != EMPTY and k != DELETED:
+                self._remove_at(i)
+        self._cursor = end if end < self._capacity else 0
+        if (self._cursor == 0 and not self._fixed and self._old_keys is None and self._bits > 10
+                and self._size * 8 < self._capacity * self.MAX_LOAD):
+            # Таблица почти пуста: сжимаем постепенным переносом, как при расширении
+            self._resize(now)
+
+    def items(self, now):
+        """Живые записи: (key, value, expires)"""
+        arrays = [(self._keys, self._values, self._expires)]
+        if self._old_keys is not None:
+            arrays.append((self._old_keys, self._old_values, self._old_expires))
+        for keys, values, expires in arrays:
+            for i in range(len(keys)):
+                k = keys[i]
+                if k != EMPTY and k != DELETED and not (expires[i] and expires[i] <= now):
+                    yield k, values[i], expires[i]
@@ -0,0 +1,104 @@
+"""
+Адаптивное ограничение параллельности обработки обновлений.
+
+Лимит подбирается по схеме AIMD по задержке sendMessage: пока задержка
+ниже целевой, лимит медленно растет (+1 за "окно" запросов), при превышении
+целевой задержки или ошибке отправки - умножается на коэффициент backoff.
+Запросы сверх лимита не ставятся в очередь, а сразу отбрасываются;
+ждать слота (acquire) может только фоновая работа, которую нельзя отбросить.
+"""
+
+import threading
+import time
+
+from metrics import Counter, Gauge
+
+LIMIT_GAUGE = Gauge('webhook_concurrency_limit', 'Текущий адаптивный лимит параллельной обработки', ['limiter'])
+INFLIGHT_GAUGE = Gauge('webhook_inflight', 'Обновления в обработке', ['limiter'])
+SHED_COUNTER = Counter('webhook_shed_total', 'Обновления, отброшенные из-за перегрузки', ['limiter'])
+DECREASE_COUNTER = Counter('webhook_limit_decrease_total', 'Снижения адаптивного лимита', ['limiter'])
+
+
+class AdaptiveLimiter:
+    """AIMD-ограничитель параллельности по наблюдаемой задержке"""
+
+    def __init__(self, name='webhook', initial_limit=16, min_limit=1, max_limit=256,
+                 target_latency=0.5, backoff=0.9):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self._limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self._inflight = 0
+        self._last_decrease = 0.0
+        # Condition, а не Lock: acquire ждет освобождения слота или роста лимита
+        self._lock = threading.Condition()
+
+        LIMIT_GAUGE.set_function(lambda: self.limit, limiter=name)
+        INFLIGHT_GAUGE.set_function(lambda: self._inflight, limiter=name)
+
+    def configure(self, min_limit=None, max_limit=None, target_latency=None, backoff=None):
+        """Изменение параметров на лету (перезагрузка настроек)"""
+        with self._lock:
+            if min_limit is not None:
+                self.min_limit = min_limit
+            if max_limit is not None:
+                self.max_limit = max_limit
+            if target_latency is not None:
+                self.target_latency = target_latency
+            if backoff is not None:
+                self.backoff = backoff
+            self._limit = float(max(self.min_limit, min(self._limit, self.max_limit)))
+            self._lock.notify_all()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    @property
+    def inflight(self):
+        return self._inflight
+
+    def try_acquire(self):
+        """Занять слот; False, если лимит исчерпан и запрос нужно отбросить"""
+        with self._lock:
+            if self._inflight >= int(self._limit):
+                SHED_COUNTER.inc(limiter=self.name)
+                return False
+            self._inflight += 1
+            return True
+
+    def acquire(self, timeout=None):
+        """Дождаться свободного слота; False, если он не освободился за timeout секунд
+
+        Для фоновой работы (разбор очереди webhook), которая делит лимит с
+        запросами, но не должна отбрасываться. Ожидание не считается отказом.
+        """
+        with self._lock:
+            if not self._lock.wait_for(lambda: self._inflight < int(self._limit), timeout):
+                return False
+            self._inflight += 1
+            return True
+
+    def release(self):
+        """Освободить слот"""
+        with self._lock:
+            self._inflight = max(0, self._inflight - 1)
+            self._lock.notify()
+
+    def observe(self, latency, ok=True):
+        """Учесть задержку очередного sendMessage"""
+        now = time.monotonic()
+        with self._lock:
+            if not ok or latency > self.target_latency:
+                # Одна перегрузка дает пачку медленных ответов сразу; снижаем
+                # лимит не чаще раза за целевую задержку, иначе он схлопнется до минимума
+                if now - self._last_decrease >= self.target_latency:
+                    self._limit = max(self.min_limit, self._limit * self.backoff)
+                    self._last_decrease = now
+                    DECREASE_COUNTER.inc(limiter=self.name)
+            elif self._inflight >= self._limit / 2:
+                # Растем, только если лимит действительно используется
+                self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+                self._lock.notify()
@@ -1,14 +1,347 @@
+import json
+import logging
 import os
-from dotenv import load_dotenv
+import signal
+import threading
+from dotenv import dotenv_values
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-# Конфигурация бота
-BOT_TOKEN = os.getenv('BOT_TOKEN')
-WEBHOOK_URL = os.getenv('WEBHOOK_URL')
-WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+# .env читается как отдельный слой и не копируется в os.environ: иначе его значения
+# выглядели бы как переменные процесса (systemd, docker), были бы главнее себя же
+# при перезагрузке и не обновлялись по SIGHUP. Скрипты не должны вызывать load_dotenv()
+ENV_FILE = '.env'
+# JSON- или TOML-файл с настройками; .env и переменные окружения важнее файла
+CONFIG_FILE = os.environ.get('CONFIG_FILE') or dotenv_values(ENV_FILE).get('CONFIG_FILE') or ''
 
-# Настройки Flask
-FLASK_HOST = os.getenv('FLASK_HOST', '0.0.0.0')
-FLASK_PORT = int(os.getenv('FLASK_PORT', 5000))
-FLASK_DEBUG = os.getenv('FLASK_DEBUG', 'False').lower() == 'true' 
\ No newline at end of file
+
+class ConfigError(ValueError):
+    """Ошибки проверки настроек"""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+class Setting:
+    """Описание одной настройки"""
+
+    __slots__ = ('name', 'type', 'default', 'reloadable', 'secret', 'choices', 'min', 'max', 'description')
+
+    def __init__(self, name, type, default, description, reloadable=False, secret=False,
+                 choices=None, min=None, max=None):
+        self.name = name
+        self.type = type
+        self.default = default
+        self.description = description
+        self.reloadable = reloadable
+        self.secret = secret
+        self.choices = choices
+        self.min = min
+        self.max = max
+
+    def parse(self, raw):
+        """Значение из строки окружения или из файла; ValueError при ошибке"""
+        if raw is None:
+            return None
+        if self.type is bool:
+            if isinstance(raw, bool):
+                return raw
+            text = str(raw).strip().lower()
+            if text in ('true', '1', 'yes', 'on'):
+                return True
+            if text in ('false', '0', 'no', 'off', ''):
+                return False
+            raise ValueError(f"ожидается true/false, получено {raw!r}")
+        if self.type is int:
+            if isinstance(raw, float) and not raw.is_integer():
+                raise ValueError(f"ожидается целое число, получено {raw!r}")
+            return int(raw)
+        if self.type is float:
+            return float(raw)
+        value = str(raw).strip()
+        return value.lower() if self.choices else value
+
+    def check(self, value):
+        """Текст ошибки или None"""
+        if value is None:
+            return None
+        if self.choices and value not in self.choices:
+            return f"допустимые значения: {', '.join(self.choices)}"
+        if self.min is not None and value < self.min:
+            return f"должно быть не меньше {self.min}"
+        if self.max is not None and value > self.max:
+            return f"должно быть не больше {self.max}"
+        return None
+
+
+# Reloadable-настройки применяются по SIGHUP без перезапуска процесса
+SCHEMA = [
+    # Конфигурация бота
+    Setting('BOT_TOKEN', str, None, "Токен бота от @BotFather", secret=True),
+    Setting('WEBHOOK_URL', str, None, "URL сервера без порта"),
+    Setting('WEBHOOK_PORT', int, 8443, "Порт webhook", min=1, max=65535),
+
+    # Настройки Flask
+    Setting('FLASK_HOST', str, '0.0.0.0', "Адрес Flask-сервера"),
+    Setting('FLASK_PORT', int, 5000, "Порт Flask-сервера", min=1, max=65535),
+    Setting('FLASK_DEBUG', bool, False, "Режим отладки Flask"),
+    Setting('SHUTDOWN_TIMEOUT', float, 25.0, "Сколько ждать обработки текущих обновлений при остановке, секунды",
+            reloadable=True, min=0.0),
+    Setting('HANDOFF_TIMEOUT', float, 60.0, "Сколько ждать готовности нового процесса по SIGUSR2, секунды",
+            reloadable=True, min=1.0),
+    Setting('LOG_LEVEL', str, 'info', "Уровень логирования", reloadable=True,
+            choices=('debug', 'info', 'warning', 'error', 'critical')),
+
+    # Общее состояние (дедупликация, счетчики, лимиты)
+    Setting('STATE_BACKEND', str, 'memory', "memory | sqlite:///state.db | redis://host:6379/0"),
+    Setting('UPDATE_DEDUP_TTL', int, 3600, "Сколько секунд помнить update_id", reloadable=True, min=1),
+
+    # Отправка ответов и адаптивное ограничение параллельности /webhook
+    Setting('SEND_TIMEOUT', float, 10.0, "Таймаут вызовов Bot API, секунды", reloadable=True, min=0.1),
+    Setting('CONCURRENCY_INITIAL_LIMIT', int, 16, "Начальный лимит параллельной обработки", min=1),
+    Setting('CONCURRENCY_MIN_LIMIT', int, 2, "Нижняя граница лимита", reloadable=True, min=1),
+    Setting('CONCURRENCY_MAX_LIMIT', int, 128, "Верхняя граница лимита", reloadable=True, min=1),
+    Setting('CONCURRENCY_TARGET_LATENCY', float, 0.5, "Целевая задержка sendMessage, секунды",
+            reloadable=True, min=0.001),
+    Setting('CONCURRENCY_BACKOFF', float, 0.9, "Множитель снижения лимита", reloadable=True, min=0.1, max=0.99),
+    Setting('SHED_MODE', str, '503', "Ответ сверх лимита", reloadable=True, choices=('ack', '429', '503')),
+    Setting('SHED_RETRY_AFTER', int, 1, "Retry-After при отказе, секунды", reloadable=True, min=0),
+
+    # Профилирование и трассировка
+    Setting('ADMIN_TOKEN', str, '', "Токен для /admin/*; пустой - выключено", secret=True),
+    Setting('PROFILE_MAX_SECONDS', int, 60, "Максимальная длительность профилирования", reloadable=True, min=1),
+    Setting('TRACE_EXPORT', str, '', "Файл или URL коллектора для span'ов"),
+    Setting('TRACE_SERVICE_NAME', str, 'gettginfobot', "service.name в выгрузке"),
+
+    # Мониторинг webhook
+    Setting('WEBHOOK_MONITOR_INTERVAL', int, 60, "Интервал getWebhookInfo, секунды; 0 - выключен", min=0),
+    Setting('WEBHOOK_MAX_CONNECTIONS', int, 0, "max_connections; 0 - по CONCURRENCY_MAX_LIMIT",
+            reloadable=True, min=0, max=100),
+    Setting('WEBHOOK_BACKLOG_THRESHOLD', int, 1000, "Очередь, после которой включается getUpdates",
+            reloadable=True, min=1),
+    Setting('WEBHOOK_DRAIN_WORKERS', int, 8, "Потоки разбора очереди", reloadable=True, min=1, max=64),
+    Setting('WEBHOOK_DRAIN_TIMEOUT', int, 300, "Наибольшая длительность одного разбора очереди, секунды",
+            reloadable=True, min=1),
+
+    # Запись трафика
+    Setting('CAPTURE_DIR', str, '', "Каталог записи трафика; пустой - выключено"),
+    Setting('CAPTURE_SAMPLE_RATE', float, 0.01, "Доля записываемых обновлений", reloadable=True, min=0.0, max=1.0),
+    Setting('CAPTURE_SALT', str, '', "Соль обезличивания", secret=True),
+    Setting('CAPTURE_MAX_BYTES', int, 64 * 1024 * 1024, "Размер файла записи до ротации", reloadable=True, min=1024),
+    Setting('CAPTURE_MAX_AGE', int, 3600, "Возраст файла записи до ротации, секунды", reloadable=True, min=0),
+    Setting('CAPTURE_MAX_FILES', int, 100, "Сколько файлов записи хранить; 0 - все", reloadable=True, min=0),
+    Setting('CAPTURE_QUEUE_SIZE', int, 10000, "Очередь записи трафика", min=1),
+    Setting('CAPTURE_KEEP_TEXT', bool, False, "Не маскировать текст сообщений", reloadable=True),
+
+    # Ограничение частоты ответов одному пользователю
+    Setting('ABUSE_LIMIT', int, 20, "Полных ответов пользователю за окно; 0 - без ограничения",
+            reloadable=True, min=0),
+    Setting('ABUSE_WINDOW', int, 60, "Окно ограничения частоты, секунды", reloadable=True, min=1),
+
+    # Анализ вложений пересланных сообщений
+    Setting('MEDIA_HASH', bool, False, "Скачивать вложения и считать SHA-256"),
+    Setting('MEDIA_MAX_BYTES', int, 20 * 1024 * 1024, "Лимит скачивания одного файла, байт",
+            reloadable=True, min=1024),
+    Setting('MEDIA_TIMEOUT', float, 10.0, "Лимит времени скачивания одного файла, секунды", reloadable=True, min=0.1),
+    Setting('MEDIA_WAIT', float, 2.0, "Сколько ответ ждет хеш; 0 - не ждать", reloadable=True, min=0.0),
+    Setting('MEDIA_WORKERS', int, 4, "Потоки скачивания вложений", min=1, max=64),
+    Setting('MEDIA_QUEUE_SIZE', int, 64, "Вложения в очереди и в работе; сверх - без хеша", min=1),
+    Setting('MEDIA_CACHE_SIZE', int, 10000, "Результаты анализа в памяти процесса", reloadable=True, min=1),
+    Setting('MEDIA_CACHE_TTL', int, 86400, "Сколько хранить результат в общем хранилище, секунды",
+            reloadable=True, min=1),
+]
+
+SCHEMA_BY_NAME = {setting.name: setting for setting in SCHEMA}
+
+
+class Settings:
+    """Проверенные значения настроек; имена атрибутов совпадают с переменными окружения"""
+
+    def __init__(self, values, sources):
+        self.__dict__.update(values)
+        self._sources = sources
+
+    def as_dict(self):
+        return {setting.name: getattr(self, setting.name) for setting in SCHEMA}
+
+    def source(self, name):
+        """Откуда взято значение: default, файл настроек, .env или env"""
+        return self._sources.get(name, 'default')
+
+
+def _read_config_file(path):
+    if path.endswith('.toml'):
+        import tomllib  # Python 3.11+
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _layers(config_file):
+    """Источники по возрастанию приоритета: файл настроек, .env, окружение процесса"""
+    layers = []
+    if config_file:
+        layers.append((config_file, _read_config_file(config_file)))
+    if os.path.exists(ENV_FILE):
+        layers.append((ENV_FILE, dotenv_values(ENV_FILE)))
+    layers.append(('env', dict(os.environ)))
+    return layers
+
+
+def load_settings(config_file=None, require_token=False):
+    """Чтение и проверка всех настроек; ConfigError со списком ошибок"""
+    config_file = CONFIG_FILE if config_file is None else config_file
+    try:
+        layers = _layers(config_file)
+    except (OSError, ValueError, ImportError) as e:
+        raise ConfigError([f"Не удалось прочитать {config_file}: {e}"])
+
+    errors = []
+    raw, sources = {}, {}
+    for source, mapping in layers:
+        for name, value in mapping.items():
+            if name in SCHEMA_BY_NAME:
+                raw[name] = value
+                sources[name] = source
+            elif source == config_file:
+                # В окружении много чужих переменных, а в файле настроек лишний ключ - опечатка
+                errors.append(f"{source}: неизвестная настройка {name}")
+
+    values = {}
+    for setting in SCHEMA:
+        try:
+            value = setting.parse(raw[setting.name]) if setting.name in raw else setting.default
+        except (TypeError, ValueError) as e:
+            errors.append(f"{setting.name}: {e}")
+            continue
+        problem = setting.check(value)
+        if problem:
+            errors.append(f"{setting.name}={value!r}: {problem}")
+        values[setting.name] = value
+
+    if not errors:
+        if not values['CONCURRENCY_MIN_LIMIT'] <= values['CONCURRENCY_INITIAL_LIMIT'] <= values['CONCURRENCY_MAX_LIMIT']:
+            errors.append("Нужно CONCURRENCY_MIN_LIMIT <= CONCURRENCY_INITIAL_LIMIT <= CONCURRENCY_MAX_LIMIT")
+        if require_token and not values['BOT_TOKEN']:
+            errors.append("BOT_TOKEN не установлен")
+    if errors:
+        raise ConfigError(errors)
+    return Settings(values, sources)
+
+
+_reload_callbacks = []
+_reload_lock = threading.Lock()
+
+
+def on_reload(callback):
+    """Подписка на перезагрузку: callback(settings, changed) со списком измененных настроек"""
+    _reload_callbacks.append(callback)
+    return callback
+
+
+def reload_settings():
+    """Перечитать источники и применить reloadable-настройки к settings"""
+    with _reload_lock:
+        fresh = load_settings()
+        changed = []
+        for setting in SCHEMA:
+            old, new = getattr(settings, setting.name), getattr(fresh, setting.name)
+            if old == new:
+                continue
+            if setting.reloadable:
+                setattr(settings, setting.name, new)
+                settings._sources[setting.name] = fresh.source(setting.name)
+                changed.append(setting.name)
+            else:
+                logger.warning(f"{setting.name} изменен, но применится только после перезапуска")
+        for callback in _reload_callbacks:
+            try:
+                callback(settings, changed)
+            except Exception as e:
+                logger.error(f"Ошибка применения настроек в {callback.__name__}: {e}")
+        return changed
+
+
+def _reload_in_background(signum, frame):
+    # Обработчик сигнала только запускает поток, обработка запросов не прерывается
+    def run():
+        try:
+            changed = reload_settings()
+            logger.info(f"Настройки перезагружены: {', '.join(changed) or 'без изменений'}")
+        except ConfigError as e:
+            logger.error(f"Новые настройки не применены: {e}")
+    threading.Thread(target=run, name='config-reload', daemon=True).start()
+
+
+def install_reload_handler():
+    """Перезагрузка настроек по SIGHUP (systemctl reload)"""
+    if hasattr(signal, 'SIGHUP') and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGHUP, _reload_in_background)
+
+
+@on_reload
+def _apply_log_level(settings, changed):
+    if 'LOG_LEVEL' in changed:
+        logging.getLogger().setLevel(settings.LOG_LEVEL.upper())
+
+
+settings = load_settings()
+
+# Значения на момент запуска под прежними именами.
+# Reloadable-настройки нужно читать из settings в момент использования.
+BOT_TOKEN = settings.BOT_TOKEN
+WEBHOOK_URL = settings.WEBHOOK_URL
+WEBHOOK_PORT = settings.WEBHOOK_PORT
+
+FLASK_HOST = settings.FLASK_HOST
+FLASK_PORT = settings.FLASK_PORT
+FLASK_DEBUG = settings.FLASK_DEBUG
+SHUTDOWN_TIMEOUT = settings.SHUTDOWN_TIMEOUT
+HANDOFF_TIMEOUT = settings.HANDOFF_TIMEOUT
+LOG_LEVEL = settings.LOG_LEVEL
+
+STATE_BACKEND = settings.STATE_BACKEND
+UPDATE_DEDUP_TTL = settings.UPDATE_DEDUP_TTL
+SEND_TIMEOUT = settings.SEND_TIMEOUT
+
+CONCURRENCY_INITIAL_LIMIT = settings.CONCURRENCY_INITIAL_LIMIT
+CONCURRENCY_MIN_LIMIT = settings.CONCURRENCY_MIN_LIMIT
+CONCURRENCY_MAX_LIMIT = settings.CONCURRENCY_MAX_LIMIT
+CONCURRENCY_TARGET_LATENCY = settings.CONCURRENCY_TARGET_LATENCY
+CONCURRENCY_BACKOFF = settings.CONCURRENCY_BACKOFF
+SHED_MODE = settings.SHED_MODE
+SHED_RETRY_AFTER = settings.SHED_RETRY_AFTER
+
+ADMIN_TOKEN = settings.ADMIN_TOKEN
+PROFILE_MAX_SECONDS = settings.PROFILE_MAX_SECONDS
+TRACE_EXPORT = settings.TRACE_EXPORT
+TRACE_SERVICE_NAME = settings.TRACE_SERVICE_NAME
+
+WEBHOOK_MONITOR_INTERVAL = settings.WEBHOOK_MONITOR_INTERVAL
+WEBHOOK_MAX_CONNECTIONS = settings.WEBHOOK_MAX_CONNECTIONS
+WEBHOOK_BACKLOG_THRESHOLD = settings.WEBHOOK_BACKLOG_THRESHOLD
+WEBHOOK_DRAIN_WORKERS = settings.WEBHOOK_DRAIN_WORKERS
+WEBHOOK_DRAIN_TIMEOUT = settings.WEBHOOK_DRAIN_TIMEOUT
+
+CAPTURE_DIR = settings.CAPTURE_DIR
+CAPTURE_SAMPLE_RATE = settings.CAPTURE_SAMPLE_RATE
+CAPTURE_SALT = settings.CAPTURE_SALT
+CAPTURE_MAX_BYTES = settings.CAPTURE_MAX_BYTES
+CAPTURE_MAX_AGE = settings.CAPTURE_MAX_AGE
+CAPTURE_MAX_FILES = settings.CAPTURE_MAX_FILES
+CAPTURE_QUEUE_SIZE = settings.CAPTURE_QUEUE_SIZE
+CAPTURE_KEEP_TEXT = settings.CAPTURE_KEEP_TEXT
+
+ABUSE_LIMIT = settings.ABUSE_LIMIT
+ABUSE_WINDOW = settings.ABUSE_WINDOW
+
+MEDIA_HASH = settings.MEDIA_HASH
+MEDIA_MAX_BYTES = settings.MEDIA_MAX_BYTES
+MEDIA_TIMEOUT = settings.MEDIA_TIMEOUT
+MEDIA_WAIT = settings.MEDIA_WAIT
+MEDIA_WORKERS = settings.MEDIA_WORKERS
+MEDIA_QUEUE_SIZE = settings.MEDIA_QUEUE_SIZE
+MEDIA_CACHE_SIZE = settings.MEDIA_CACHE_SIZE
+MEDIA_CACHE_TTL = settings.MEDIA_CACHE_TTL
@@ -0,0 +1,298 @@
+"""
+Каталог ответов бота на нескольких языках.
+
+Тексты хранятся в CATALOG по языкам и при импорте модуля один раз
+компилируются в готовые шаблоны: для каждого языка два варианта -
+Markdown (асинхронные обработчики) и обычный текст (синхронный путь
+webhook). Во время обработки update остается только выбрать шаблон по
+user.language_code (поиск в dict) и склеить строки со значениями полей.
+
+Разметка в каталоге: *жирный текст*. В Markdown-варианте она становится
+**жирным**, в обычном тексте - убирается.
+"""
+
+import logging
+import re
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCALE = 'ru'
+
+CATALOG = {
+    'ru': {
+        'start': (
+            "👋 Привет, {name}!\n\n"
+            "Я бот для получения информации о пользователях и каналах.\n\n"
+            "📋 Что я умею:\n"
+            "• Отвечаю на команду /start\n"
+            "• Анализирую пересланные сообщения\n"
+            "• Показываю ID пользователей и каналов\n\n"
+            "📤 Перешлите мне сообщение из другого чата или канала, "
+            "и я покажу всю доступную информацию!"
+        ),
+        'forwarded_title': "📤 Информация о пересланном сообщении:",
+        'requester': "👤 *Отправитель запроса:*",
+        'forwarded_from_user': "📤 *Переслано от пользователя:*",
+        'forwarded_from_chat': "📢 *Переслано из чата/канала:*",
+        'forward_date': "📅 *Дата пересылки:*",
+        'current_chat': "💬 *Текущий чат:*",
+        'message_title': "📝 *Информация о сообщении:*",
+        'sender': "👤 *Отправитель:*",
+        'chat': "💬 *Чат:*",
+        'hint': "💡 *Подсказка:* Перешлите сообщение из другого чата, чтобы получить больше информации!",
+        'id': "ID",
+        'first_name': "Имя",
+        'last_name': "Фамилия",
+        'username': "Username",
+        'type': "Тип",
+        'title': "Название",
+        'media': "📎 *Вложение:*",
+        'file_name': "Имя файла",
+        'size': "Размер",
+        'bytes': "байт",
+        'mime_type': "MIME-тип",
+        'dimensions': "Размеры",
+        'duration': "Длительность",
+        'seconds': "с",
+        'hash_too_large': "не посчитан: файл больше лимита",
+        'hash_failed': "не посчитан",
+        'slow_down': "⏳ Слишком много сообщений. Ответы ненадолго приостановлены, попробуйте чуть позже.",
+        'date_format': "%d.%m.%Y %H:%M:%S",
+    },
+    'en': {
+        'start': (
+            "👋 Hi, {name}!\n\n"
+            "I show information about users and channels.\n\n"
+            "📋 What I can do:\n"
+            "• Reply to the /start command\n"
+            "• Analyze forwarded messages\n"
+            "• Show user and channel IDs\n\n"
+            "📤 Forward me a message from another chat or channel "
+            "and I will show everything available about it!"
+        ),
+        'forwarded_title': "📤 Forwarded message info:",
+        'requester': "👤 *Requested by:*",
+        'forwarded_from_user': "📤 *Forwarded from user:*",
+        'forwarded_from_chat': "📢 *Forwarded from chat/channel:*",
+        'forward_date': "📅 *Forward date:*",
+        'current_chat': "💬 *Current chat:*",
+        'message_title': "📝 *Message info:*",
+        'sender': "👤 *Sender:*",
+        'chat': "💬 *Chat:*",
+        'hint': "💡 *Tip:* Forward a message from another chat to get more information!",
+        'id': "ID",
+        'first_name': "First name",
+        'last_name': "Last name",
+        'username': "Username",
+        'type': "Type",
+        'title': "Title",
+        'media': "📎 *Attachment:*",
+        'file_name': "File name",
+        'size': "Size",
+        'bytes': "bytes",
+        'mime_type': "MIME type",
+        'dimensions': "Dimensions",
+        'duration': "Duration",
+        'seconds': "s",
+        'hash_too_large': "not computed: file exceeds the limit",
+        'hash_failed': "not computed",
+        'slow_down': "⏳ Too many messages. Replies are paused for a while, please try again a bit later.",
+        'date_format': "%Y-%m-%d %H:%M:%S",
+    },
+    'uk': {
+        'start': (
+            "👋 Привіт, {name}!\n\n"
+            "Я бот для отримання інформації про користувачів і канали.\n\n"
+            "📋 Що я вмію:\n"
+            "• Відповідаю на команду /start\n"
+            "• Аналізую переслані повідомлення\n"
+            "• Показую ID користувачів і каналів\n\n"
+            "📤 Перешліть мені повідомлення з іншого чату або каналу, "
+            "і я покажу всю доступну інформацію!"
+        ),
+        'forwarded_title': "📤 Інформація про переслане повідомлення:",
+        'requester': "👤 *Відправник запиту:*",
+        'forwarded_from_user': "📤 *Переслано від користувача:*",
+        'forwarded_from_chat': "📢 *Переслано з чату/каналу:*",
+        'forward_date': "📅 *Дата пересилання:*",
+        'current_chat': "💬 *Поточний чат:*",
+        'message_title': "📝 *Інформація про повідомлення:*",
+        'sender': "👤 *Відправник:*",
+        'chat': "💬 *Чат:*",
+        'hint': "💡 *Підказка:* Перешліть повідомлення з іншого чату, щоб отримати більше інформації!",
+        'id': "ID",
+        'first_name': "Ім'я",
+        'last_name': "Прізвище",
+        'username': "Username",
+        'type': "Тип",
+        'title': "Назва",
+        'media': "📎 *Вкладення:*",
+        'file_name': "Ім'я файлу",
+        'size': "Розмір",
+        'bytes': "байт",
+        'mime_type': "MIME-тип",
+        'dimensions': "Розміри",
+        'duration': "Тривалість",
+        'seconds': "с",
+        'hash_too_large': "не обчислено: файл більший за ліміт",
+        'hash_failed': "не обчислено",
+        'slow_down': "⏳ Забагато повідомлень. Відповіді ненадовго призупинено, спробуйте трохи пізніше.",
+        'date_format': "%d.%m.%Y %H:%M:%S",
+    },
+}
+
+_BOLD = re.compile(r'\*([^*]+)\*')
+
+
+class Replies:
+    """Скомпилированные шаблоны ответов одного языка в одном варианте разметки"""
+
+    __slots__ = (
+        'locale', 'markdown', 'start_head', 'start_tail', 'date_format',
+        'forwarded_head', 'forwarded_from_user', 'forwarded_from_chat', 'forward_date', 'current_chat',
+        'message_head', 'chat_head', 'hint_tail', 'media_head', 'code', 'hash_too_large', 'hash_failed',
+        'bytes', 'seconds', 'file_name_line', 'size_line', 'mime_type_line', 'dimensions_line', 'duration_line',
+        'hash_line', 'slow_down', 'id_line', 'id_end', 'first_name_line', 'last_name_line', 'username_line',
+        'type_line', 'title_line',
+    )
+
+    def __init__(self, locale, texts, markdown):
+        self.locale = locale
+        self.markdown = markdown
+
+        def mark(text):
+            return _BOLD.sub(r'**\1**' if markdown else r'\1', text)
+
+        self.start_head, self.start_tail = mark(texts['start']).split('{name}')
+        self.date_format = texts['date_format']
+        # Постоянные куски ответа склеиваются заранее, вместе с переводами строк
+        self.forwarded_head = mark(texts['forwarded_title']) + '\n\n' + mark(texts['requester']) + '\n'
+        self.forwarded_from_user = '\n' + mark(texts['forwarded_from_user']) + '\n'
+        self.forwarded_from_chat = '\n' + mark(texts['forwarded_from_chat']) + '\n'
+        self.forward_date = '\n' + mark(texts['forward_date']) + '\n• '
+        self.current_chat = '\n' + mark(texts['current_chat']) + '\n'
+        self.message_head = mark(texts['message_title']) + '\n\n' + mark(texts['sender']) + '\n'
+        self.chat_head = '\n' + mark(texts['chat']) + '\n'
+        self.hint_tail = '\n' + mark(texts['hint'])
+        self.media_head = '\n' + mark(texts['media']) + '\n'
+        self.hash_too_large = texts['hash_too_large']
+        self.hash_failed = texts['hash_failed']
+        self.slow_down = texts['slow_down']
+        self.bytes = texts['bytes']
+        self.seconds = texts['seconds']
+        # Строки полей: "• Имя: " + значение + "\n". Идентификаторы и имена файлов
+        # в Markdown - моноширинные (и без разбора разметки)
+        self.code = '`' if markdown else ''
+        self.id_line = f"• {texts['id']}: {self.code}"
+        self.id_end = f"{self.code}\n"
+        self.first_name_line = f"• {texts['first_name']}: "
+        self.last_name_line = f"• {texts['last_name']}: "
+        self.username_line = f"• {texts['username']}: @"
+        self.type_line = f"• {texts['type']}: "
+        self.title_line = f"• {texts['title']}: "
+        for key in ('file_name', 'size', 'mime_type', 'dimensions', 'duration'):
+            setattr(self, f'{key}_line', f"• {texts[key]}: ")
+        self.hash_line = "• SHA-256: "
+
+    def start(self, user):
+        """Приветствие на /start"""
+        return self.start_head + str(user.first_name) + self.start_tail
+
+    def _user_lines(self, user):
+        text = f"{self.id_line}{user.id}{self.id_end}{self.first_name_line}{user.first_name}\n"
+        if user.last_name:
+            text += f"{self.last_name_line}{user.last_name}\n"
+        if user.username:
+            text += f"{self.username_line}{user.username}\n"
+        return text
+
+    def _chat_lines(self, chat):
+        text = f"{self.id_line}{chat.id}{self.id_end}{self.type_line}{chat.type}\n"
+        if chat.title:
+            text += f"{self.title_line}{chat.title}\n"
+        if chat.username:
+            text += f"{self.username_line}{chat.username}\n"
+        return text
+
+    def _format_date(self, value):
+        try:
+            if not isinstance(value, datetime):
+                # Старые версии PTB отдают timestamp
+                value = datetime.fromtimestamp(value)
+            return value.strftime(self.date_format)
+        except Exception as e:
+            logger.warning(f"Ошибка форматирования даты: {e}")
+            return str(value)
+
+    def _media_lines(self, media, analysis):
+        code = self.code
+        text = (f"{self.media_head}{self.type_line}{media['kind']}\n"
+                f"• file_id: {code}{media['file_id']}{code}\n"
+                f"• file_unique_id: {code}{media['file_unique_id']}{code}\n")
+        if media['file_name']:
+            text += f"{self.file_name_line}{code}{media['file_name']}{code}\n"
+        if media['file_size']:
+            text += f"{self.size_line}{media['file_size']} {self.bytes}\n"
+        if media['mime_type']:
+            text += f"{self.mime_type_line}{media['mime_type']}\n"
+        if media['width'] and media['height']:
+            text += f"{self.dimensions_line}{media['width']}×{media['height']}\n"
+        if media['duration']:
+            text += f"{self.duration_line}{media['duration']} {self.seconds}\n"
+        if analysis is not None:
+            if analysis.get('sha256'):
+                text += f"{self.hash_line}{code}{analysis['sha256']}{code}\n"
+            elif analysis.get('status') == 'too_large':
+                text += f"{self.hash_line}{self.hash_too_large}\n"
+            else:
+                text += f"{self.hash_line}{self.hash_failed}\n"
+        return text
+
+    def forwarded(self, message, user, chat, media=None, analysis=None):
+        """Информация о пересланном сообщении; media - из media.extract_media, analysis - хеш файла"""
+        text = self.forwarded_head + self._user_lines(user)
+        if message.forward_from:
+            text += self.forwarded_from_user + self._user_lines(message.forward_from)
+        if message.forward_from_chat:
+            text += self.forwarded_from_chat + self._chat_lines(message.forward_from_chat)
+        if message.forward_date:
+            text += f"{self.forward_date}{self._format_date(message.forward_date)}\n"
+        if media is not None:
+            text += self._media_lines(media, analysis)
+        return text + self.current_chat + self._chat_lines(chat)
+
+    def message(self, message, user, chat):
+        """Информация об обычном сообщении"""
+        return self.message_head + self._user_lines(user) + self.chat_head + self._chat_lines(chat) + self.hint_tail
+
+
+def compile_catalog(catalog):
+    """Шаблоны всех языков: {(язык, markdown): Replies}; ошибки каталога - при запуске, а не в обработке"""
+    base = catalog[DEFAULT_LOCALE]
+    compiled = {}
+    for locale, texts in catalog.items():
+        missing = set(base) - set(texts)
+        if missing:
+            raise ValueError(f"В каталоге {locale} нет ключей: {', '.join(sorted(missing))}")
+        if texts['start'].count('{name}') != 1:
+            raise ValueError(f"В каталоге {locale} в start должен быть ровно один {{name}}")
+        for markdown in (False, True):
+            compiled[(locale, markdown)] = Replies(locale, texts, markdown)
+    return compiled
+
+
+_COMPILED = compile_catalog(CATALOG)
+# Отдельные словари на вариант: выбор шаблона - один поиск по language_code
+_PLAIN = {locale: _COMPILED[(locale, False)] for locale in CATALOG}
+_MARKDOWN = {locale: _COMPILED[(locale, True)] for locale in CATALOG}
+
+
+def get_replies(language_code, markdown=False):
+    """Шаблоны ответов для языка пользователя; незнакомый язык - язык по умолчанию"""
+    table = _MARKDOWN if markdown else _PLAIN
+    replies = table.get(language_code)
+    if replies is None:
+        # language_code бывает с регионом (en-US, pt-br) или не задан
+        replies = table.get((language_code or DEFAULT_LOCALE)[:2]) or table[DEFAULT_LOCALE]
+    return replies
@@ -0,0 +1,249 @@
+"""
+Сведения о вложениях пересланных сообщений.
+
+extract_media() достает из сообщения то, что Telegram присылает сразу:
+file_id, file_unique_id, размер, MIME-тип, размеры и длительность.
+
+MediaInspector по желанию (MEDIA_HASH) скачивает файл через getFile и
+считает SHA-256. Скачивание идет потоком, кусками, с жестким лимитом байт
+и времени, в ограниченном пуле потоков. Результаты кэшируются по
+file_unique_id: локально (LRU) и в общем хранилище состояния, а
+одновременные запросы одного файла ждут одну и ту же загрузку. Один и тот
+же файл, пересланный тысячу раз, скачивается один раз.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+INSPECT_COUNTER = Counter('media_inspect_total', 'Результаты анализа вложений', ['result'])
+CACHE_COUNTER = Counter('media_cache_total', 'Обращения к кэшу анализа вложений', ['result'])
+DOWNLOADED_BYTES = Counter('media_downloaded_bytes_total', 'Скачано байт вложений')
+PENDING_GAUGE = Gauge('media_pending', 'Вложения в очереди и в обработке')
+
+CHUNK_SIZE = 64 * 1024
+CACHE_PREFIX = 'media:'
+FILE_URL = 'https://api.telegram.org/file/bot{token}/{path}'
+# Таймауты и сетевые ошибки не кэшируются: следующая пересылка попробует снова
+CACHED_STATUSES = ('ok', 'too_large')
+
+# Виды вложений в порядке проверки; для photo берется самый большой размер
+MEDIA_KINDS = ('photo', 'video', 'animation', 'document', 'audio', 'voice', 'video_note', 'sticker')
+
+
+def extract_media(message):
+    """Описание вложения сообщения (dict) или None"""
+    for kind in MEDIA_KINDS:
+        media = getattr(message, kind, None)
+        if not media:
+            continue
+        if kind == 'photo':
+            media = max(media, key=lambda size: (size.width * size.height, size.file_size or 0))
+        info = {
+            'kind': kind,
+            'file_id': media.file_id,
+            'file_unique_id': media.file_unique_id,
+            'file_size': getattr(media, 'file_size', None),
+            'mime_type': getattr(media, 'mime_type', None),
+            'file_name': getattr(media, 'file_name', None),
+            'width': getattr(media, 'width', None),
+            'height': getattr(media, 'height', None),
+            'duration': getattr(media, 'duration', None),
+        }
+        if kind == 'video_note':
+            # video_note квадратный: у него length вместо width/height
+            info['width'] = info['height'] = media.length
+        if hasattr(info['duration'], 'total_seconds'):
+            # Новые версии PTB отдают timedelta
+            info['duration'] = int(info['duration'].total_seconds())
+        return info
+    return None
+
+
+class MediaInspector:
+    """Ограниченное по ресурсам скачивание и хеширование вложений с дедупликацией"""
+
+    def __init__(self, bot, state, enabled=False, max_bytes=20 * 2 ** 20, timeout=10.0, workers=4,
+                 queue_size=64, cache_size=10000, cache_ttl=86400):
+        self.bot = bot
+        self.state = state
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='media')
+        PENDING_GAUGE.set_function(lambda: len(self._inflight))
+
+    def configure(self, max_bytes=None, timeout=None, cache_ttl=None, cache_size=None):
+        """Изменение лимитов на лету; пул и очередь остаются прежними"""
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if timeout is not None:
+            self.timeout = timeout
+        if cache_ttl is not None:
+            self.cache_ttl = cache_ttl
+        if cache_size is not None:
+            with self._lock:
+                self.cache_size = cache_size
+                self._trim_cache()
+
+    def submit(self, media):
+        """Future с результатом анализа или None, если анализ выключен или очередь полна"""
+        if not self.enabled or media is None:
+            return None
+        key = media['file_unique_id']
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                CACHE_COUNTER.inc(result='hit')
+                return self._done(cached)
+            future = self._inflight.get(key)
+            if future is not None:
+                # Этот файл уже скачивается: ждем ту же загрузку
+                CACHE_COUNTER.inc(result='inflight')
+                return future
+            if not self._slots.acquire(blocking=False):
+                INSPECT_COUNTER.inc(result='rejected')
+                return None
+            future = Future()
+            self._inflight[key] = future
+        try:
+            self._pool.submit(self._run, media, future)
+        except RuntimeError:
+            # Пул уже остановлен (завершение процесса)
+            self._finish(key, future, None)
+        return future
+
+    def inspect(self, media, wait):
+        """Результат анализа, если он готов за wait секунд; иначе None"""
+        future = self.submit(media)
+        if future is None:
+            return None
+        try:
+            return future.result(timeout=wait)
+        except Exception:
+            return None
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+    @staticmethod
+    def _done(result):
+        future = Future()
+        future.set_result(result)
+        return future
+
+    def _trim_cache(self):
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _finish(self, key, future, result):
+        with self._lock:
+            if result is not None and result['status'] in CACHED_STATUSES:
+                self._cache[key] = result
+                self._trim_cache()
+            self._inflight.pop(key, None)
+        self._slots.release()
+        if not future.cancelled():
+            future.set_result(result)
+
+    def _run(self, media, future):
+        key = media['file_unique_id']
+        result = None
+        try:
+            result = self._load_shared(key)
+            if result is not None:
+                CACHE_COUNTER.inc(result='shared')
+            else:
+                CACHE_COUNTER.inc(result='miss')
+                result = self._analyze(media)
+                INSPECT_COUNTER.inc(result=result['status'])
+                if result['status'] in CACHED_STATUSES:
+                    self._store_shared(key, result)
+        except Exception as e:
+            INSPECT_COUNTER.inc(result='error')
+            logger.warning(f"Ошибка анализа вложения {key}: {e}")
+        finally:
+            self._finish(key, future, result)
+
+    def _load_shared(self, key):
+        """Результат, посчитанный другим процессом или репликой"""
+        try:
+            raw = self.state.get(CACHE_PREFIX + key)
+        except Exception as e:
+            logger.warning(f"Ошибка чтения кэша вложений: {e}")
+            return None
+        return json.loads(raw) if raw else None
+
+    def _store_shared(self, key, result):
+        try:
+            self.state.set(CACHE_PREFIX + key, json.dumps(result), ttl=self.cache_ttl)
+        except Exception as e:
+            logger.warning(f"Ошибка записи кэша вложений: {e}")
+
+    def _analyze(self, media):
+        """Скачивание и хеширование в пределах max_bytes и timeout"""
+        size = media.get('file_size')
+        if size and size > self.max_bytes:
+            return {'status': 'too_large', 'bytes': 0}
+
+        deadline = time.monotonic() + self.timeout
+        file = self.bot.api_call_sync('getFile', {'file_id': media['file_id']}, timeout=self.timeout)
+        file_path = file.get('file_path')
+        if not file_path:
+            return {'status': 'unavailable', 'bytes': 0}
+
+        import requests
+        url = FILE_URL.format(token=self.bot.application.bot.token, path=file_path)
+        digest = hashlib.sha256()
+        received = 0
+        remaining = max(0.1, deadline - time.monotonic())
+        with requests.get(url, stream=True, timeout=remaining) as response:
+            response.raise_for_status()
+            while True:
+                try:
+                    chunk = self._read_chunk(response, deadline)
+                except Exception:
+                    if time.monotonic() >= deadline:
+                        return {'status': 'timeout', 'bytes': received}
+                    raise
+                if not chunk:
+                    break
+                received += len(chunk)
+                DOWNLOADED_BYTES.inc(len(chunk))
+                # Хеш части файла бесполезен: при превышении лимита прерываемся без хеша
+                if received > self.max_bytes:
+                    return {'status': 'too_large', 'bytes': received}
+                digest.update(chunk)
+        return {'status': 'ok', 'bytes': received, 'sha256': digest.hexdigest()}
+
+    @staticmethod
+    def _read_chunk(response, deadline):
+        """Один кусок тела не позже deadline
+
+        Таймаут requests действует на каждое чтение отдельно, и сервер, отдающий
+        по байту, растянул бы загрузку на много таймаутов. Поэтому перед каждым
+        чтением таймаут сокета сокращается до остатка времени, а read1 делает
+        не больше одного чтения из сокета.
+        """
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("Время скачивания вышло")
+        sock = getattr(response.raw.connection, 'sock', None)
+        if sock is not None:
+            sock.settimeout(remaining)
+        return response.raw.read1(CHUNK_SIZE, decode_content=True)
@@ -0,0 +1,59 @@
+"""
+Семплирующий профилировщик для работающего процесса.
+
+Раз в interval секунд снимает стеки всех потоков через sys._current_frames()
+и возвращает их в "collapsed"-формате (frame;frame;frame count), который
+понимают flamegraph.pl, speedscope и inferno.
+"""
+
+import collections
+import os
+import sys
+import threading
+import time
+
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusyError(Exception):
+    """Профилирование уже запущено"""
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame, thread_name):
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    stack.append(thread_name)
+    stack.reverse()
+    return ';'.join(stack)
+
+
+def sample_stacks(seconds, interval=0.005):
+    """Собрать стеки всех потоков, кроме текущего, за seconds секунд"""
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusyError("Профилирование уже выполняется")
+    try:
+        own_id = threading.get_ident()
+        counts = collections.Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                counts[_collapse(frame, names.get(thread_id, f"thread-{thread_id}"))] += 1
+            time.sleep(interval)
+        return counts
+    finally:
+        _profile_lock.release()
+
+
+def format_collapsed(counts):
+    """Текст в collapsed-формате, самые частые стеки первыми"""
+    return ''.join(f"{stack} {count}\n" for stack, count in counts.most_common())
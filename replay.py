@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+Прогон записанных обновлений через TelegramBot без обращения к Telegram.
+
+Читает JSONL-файл (по update на строку, в том числе сжатые .jsonl.gz из
+capture.py), пропускает каждое обновление через настоящий конвейер разбора
+и форматирования, а отправку ответа подменяет заглушкой. Печатает
+пропускную способность, время по этапам и расхождения с эталонными
+ответами. Время считается от готовности бота: импорт модулей и создание
+TelegramBot в него не входят.
+
+    python replay.py updates.jsonl
+    python replay.py updates.jsonl --workers 4 --mmap
+    python replay.py updates.jsonl --write-golden golden.jsonl
+    python replay.py updates.jsonl --golden golden.jsonl
+    python replay.py updates.jsonl --path async
+"""
+
+import argparse
+import array
+import asyncio
+import difflib
+import gzip
+import json
+import logging
+import mmap
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+REPLAY_TOKEN = '123456:replay'
+
+STAGES = ('parse', 'format', 'send', 'total')
+
+# Обработчики Application форматируют и отправляют ответ в одном вызове,
+# поэтому в асинхронном пути format отдельно не измеряется
+ASYNC_STAGES = ('parse', 'send', 'total')
+
+
+def is_compressed(path):
+    return path.endswith('.gz')
+
+
+def split_ranges(path, parts):
+    """Разбиение файла на диапазоны байт по границам строк"""
+    size = os.path.getsize(path)
+    # Сжатый файл читается только последовательно, одним процессом
+    if parts <= 1 or size == 0 or is_compressed(path):
+        return [(0, size)]
+    bounds = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, parts):
+            f.seek(max(bounds[-1], size * i // parts))
+            f.readline()
+            position = f.tell()
+            if position >= size:
+                break
+            if position > bounds[-1]:
+                bounds.append(position)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def iter_lines(path, start=0, end=None, use_mmap=False):
+    """Строки файла из диапазона [start, end) без загрузки файла целиком"""
+    if is_compressed(path):
+        # Записи capture.py (*.jsonl.gz) распаковываются потоком
+        with gzip.open(path, 'rb') as f:
+            yield from f
+        return
+    with open(path, 'rb') as f:
+        if end is None:
+            end = os.fstat(f.fileno()).st_size
+        if end <= start:
+            return
+        if use_mmap:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                position = start
+                while position < end:
+                    newline = mm.find(b'\n', position, end)
+                    if newline < 0:
+                        newline = end
+                    yield mm[position:newline]
+                    position = newline + 1
+        else:
+            f.seek(start)
+            position = start
+            for line in f:
+                position += len(line)
+                yield line
+                if position >= end:
+                    break
+
+
+class StageStats:
+    """Длительности этапов обработки, собранные из span'ов трассировки"""
+
+    def __init__(self):
+        self.durations = {stage: array.array('d') for stage in STAGES}
+
+    def on_end(self, span):
+        durations = self.durations.get(span.name)
+        if durations is not None:
+            durations.append(span.duration)
+
+    def shutdown(self):
+        pass
+
+    def add_total(self, seconds):
+        self.durations['total'].append(seconds)
+
+    def merge(self, other):
+        for stage, values in other.items():
+            self.durations[stage].extend(values)
+
+
+def make_stub_request(outputs, send_latency, send_durations=None):
+    """Транспорт Bot API для асинхронного пути: ответы без сети
+
+    В send_durations (если задан) добавляется длительность каждого
+    sendMessage - как span 'send' в синхронном пути.
+    """
+    from telegram.request import BaseRequest
+
+    class StubRequest(BaseRequest):
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        async def do_request(self, url, method, request_data=None, **kwargs):
+            api_method = url.rsplit('/', 1)[-1]
+            params = request_data.parameters if request_data is not None else {}
+            if api_method == 'getMe':
+                result = {'id': 123456, 'is_bot': True, 'first_name': 'Replay', 'username': 'replay_bot'}
+            elif api_method == 'sendMessage':
+                started = time.perf_counter()
+                if send_latency:
+                    await asyncio.sleep(send_latency)
+                outputs.append(params.get('text'))
+                if send_durations is not None:
+                    send_durations.append(time.perf_counter() - started)
+                result = {
+                    'message_id': 1,
+                    'date': int(time.time()),
+                    'chat': {'id': params.get('chat_id'), 'type': 'private'},
+                    'text': params.get('text'),
+                }
+            else:
+                result = True
+            return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    return StubRequest()
+
+
+def _isolate_tracer():
+    """Span'ы прогона не должны попадать в коллектор из TRACE_EXPORT"""
+    import bot  # noqa: F401 - при импорте bot подключает выгрузку по TRACE_EXPORT
+    from tracing import tracer
+    tracer.clear_processors()
+
+
+def _make_sync_bot(outputs, send_latency):
+    from bot import TelegramBot
+    from state import MemoryStateBackend
+
+    class ReplayBot(TelegramBot):
+        """TelegramBot, у которого отправка ответа заменена записью в outputs"""
+
+        def _send_message_sync(self, chat_id, text):
+            from tracing import tracer, KIND_CLIENT
+            with tracer.span('send', kind=KIND_CLIENT):
+                if send_latency:
+                    time.sleep(send_latency)
+                outputs.append(text)
+
+    bot = ReplayBot(state=MemoryStateBackend(), token=REPLAY_TOKEN)
+    _disable_live_features(bot)
+    return bot
+
+
+def _disable_live_features(bot):
+    """Отключение того, что зависит от реального времени и сети"""
+    # Запись прогоняется быстрее реального времени: окна ограничителя частоты теряют смысл
+    bot.abuse.configure(limit=0)
+    # С MEDIA_HASH вложения скачивались бы с api.telegram.org, а эталон зависел бы от сети
+    bot.media.enabled = False
+
+
+def _replay_sync(lines, send_latency, collect):
+    from tracing import tracer
+
+    _isolate_tracer()
+    stats = StageStats()
+    tracer.add_processor(stats)
+    outputs, results = [], []
+    processed = errors = 0
+    bot = _make_sync_bot(outputs, send_latency)
+    replay_started = time.perf_counter()
+    try:
+        for line in lines:
+            if not line.strip():
+                continue
+            update = json.loads(line)
+            del outputs[:]
+            started = time.perf_counter()
+            if not bot.webhook_handler_sync(update):
+                errors += 1
+            stats.add_total(time.perf_counter() - started)
+            processed += 1
+            if collect:
+                results.append((update.get('update_id'), '\n'.join(outputs) if outputs else None))
+    finally:
+        tracer.remove_processor(stats)
+    return processed, errors, time.perf_counter() - replay_started, stats, results
+
+
+def _replay_async(lines, send_latency, collect):
+    from bot import TelegramBot
+    from state import MemoryStateBackend
+    from telegram import Update
+
+    _isolate_tracer()
+    stats = StageStats()
+    outputs, results = [], []
+    counters = {'processed': 0, 'errors': 0, 'elapsed': 0.0}
+    failed = []
+
+    async def on_error(update, context):
+        # Application.process_update не пробрасывает исключения обработчиков, а передает их сюда
+        update_id = getattr(update, 'update_id', None)
+        logging.getLogger(__name__).error(f"Ошибка обработки update {update_id}: {context.error}")
+        failed.append(update_id)
+
+    async def run():
+        bot = TelegramBot(state=MemoryStateBackend(), token=REPLAY_TOKEN,
+                          request=make_stub_request(outputs, send_latency, stats.durations['send']))
+        _disable_live_features(bot)
+        application = bot.application
+        application.add_error_handler(on_error)
+        await application.initialize()
+        replay_started = time.perf_counter()
+        try:
+            for line in lines:
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                del outputs[:]
+                del failed[:]
+                started = time.perf_counter()
+                try:
+                    update = Update.de_json(data, application.bot)
+                    stats.durations['parse'].append(time.perf_counter() - started)
+                    await application.process_update(update)
+                except Exception as e:
+                    # Сюда попадают только ошибки разбора update
+                    logging.getLogger(__name__).error(f"Ошибка обработки update {data.get('update_id')}: {e}")
+                    failed.append(data.get('update_id'))
+                if failed:
+                    counters['errors'] += 1
+                stats.add_total(time.perf_counter() - started)
+                counters['processed'] += 1
+                if collect:
+                    results.append((data.get('update_id'), '\n'.join(outputs) if outputs else None))
+        finally:
+            counters['elapsed'] = time.perf_counter() - replay_started
+            await application.shutdown()
+
+    asyncio.run(run())
+    return counters['processed'], counters['errors'], counters['elapsed'], stats, results
+
+
+def replay_range(path, start, end, options):
+    """Прогон диапазона файла; выполняется в процессе пула"""
+    logging.getLogger().setLevel(options['log_level'])
+    lines = iter_lines(path, start, end, options['mmap'])
+    runner = _replay_async if options['path'] == 'async' else _replay_sync
+    processed, errors, elapsed, stats, results = runner(lines, options['send_latency'], options['collect'])
+    return processed, errors, elapsed, {stage: values for stage, values in stats.durations.items()}, results
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def load_golden(path):
+    golden = {}
+    for line in iter_lines(path):
+        if line.strip():
+            item = json.loads(line)
+            golden[item['update_id']] = item.get('text')
+    return golden
+
+
+def write_golden(path, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        for update_id, text in results:
+            f.write(json.dumps({'update_id': update_id, 'text': text}, ensure_ascii=False) + '\n')
+
+
+def compare_golden(golden, results, show):
+    """Количество расхождений; первые show расхождений печатаются как diff"""
+    mismatches = 0
+    for update_id, text in results:
+        expected = golden.get(update_id)
+        if expected == text:
+            continue
+        mismatches += 1
+        if mismatches <= show:
+            diff = difflib.unified_diff(
+                (expected or '').splitlines(), (text or '').splitlines(),
+                fromfile=f'golden/{update_id}', tofile=f'replay/{update_id}', lineterm=''
+            )
+            print('\n'.join(diff) + '\n')
+    missing = len(set(golden) - {update_id for update_id, _ in results})
+    return mismatches, missing
+
+
+def print_report(processed, errors, elapsed, stats, workers, path='sync'):
+    print(f"Обновлений: {processed}, ошибок: {errors}, процессов: {workers}")
+    print(f"Время: {elapsed:.2f} с, пропускная способность: {processed / elapsed if elapsed else 0:.0f} upd/s")
+    print(f"{'Этап':<8} {'кол-во':>9} {'сред, мс':>9} {'p50, мс':>9} {'p99, мс':>9}")
+    for stage in STAGES:
+        values = stats.durations[stage]
+        if path == 'async' and stage not in ASYNC_STAGES:
+            print(f"{stage:<8} нет данных: в --path async входит в total")
+            continue
+        if not values:
+            continue
+        mean = sum(values) / len(values)
+        print(f"{stage:<8} {len(values):>9} {mean * 1000:>9.3f} "
+              f"{percentile(values, 0.5) * 1000:>9.3f} {percentile(values, 0.99) * 1000:>9.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Прогон записанных обновлений через TelegramBot")
+    parser.add_argument('updates', help="JSONL-файл с обновлениями")
+    parser.add_argument('--workers', type=int, default=1, help="Количество процессов")
+    parser.add_argument('--mmap', action='store_true', help="Читать файл через mmap")
+    parser.add_argument('--path', choices=('sync', 'async'), default='sync',
+                        help="sync - webhook_handler_sync, async - обработчики Application")
+    parser.add_argument('--send-latency', type=float, default=0.0,
+                        help="Имитируемая задержка sendMessage, секунды")
+    parser.add_argument('--golden', help="Сравнить ответы с эталонным JSONL-файлом")
+    parser.add_argument('--write-golden', help="Записать ответы как эталон")
+    parser.add_argument('--show-diffs', type=int, default=10, help="Сколько расхождений печатать")
+    parser.add_argument('--log-level', default='WARNING', help="Уровень логирования во время прогона")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level)
+    options = {
+        'mmap': args.mmap,
+        'path': args.path,
+        'send_latency': args.send_latency,
+        'collect': bool(args.golden or args.write_golden),
+        'log_level': args.log_level,
+    }
+
+    ranges = split_ranges(args.updates, args.workers)
+    if len(ranges) == 1:
+        parts = [replay_range(args.updates, ranges[0][0], ranges[0][1], options)]
+    else:
+        with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+            futures = [pool.submit(replay_range, args.updates, start, end, options) for start, end in ranges]
+            parts = [future.result() for future in futures]
+
+    stats = StageStats()
+    processed = errors = 0
+    elapsed = 0.0
+    results = []
+    for part_processed, part_errors, part_elapsed, part_stats, part_results in parts:
+        processed += part_processed
+        errors += part_errors
+        # Процессы работают параллельно: время прогона - по самому долгому из них
+        elapsed = max(elapsed, part_elapsed)
+        stats.merge(part_stats)
+        results.extend(part_results)
+
+    print_report(processed, errors, elapsed, stats, len(ranges), args.path)
+
+    if args.write_golden:
+        write_golden(args.write_golden, results)
+        print(f"Эталон записан: {args.write_golden} ({len(results)} ответов)")
+
+    if args.golden:
+        mismatches, missing = compare_golden(load_golden(args.golden), results, args.show_diffs)
+        print(f"Расхождений с эталоном: {mismatches}, нет в прогоне: {missing}")
+        if mismatches or missing:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,24 +6,18 @@
 
 import os
 import sys
-from dotenv import load_dotenv
-
-# Загружаем переменные окружения
-load_dotenv()
 
 def check_environment():
-    """Проверка необходимых переменных окружения"""
-    required_vars = ['BOT_TOKEN']
-    missing_vars = []
-    
-    for var in required_vars:
-        if not os.getenv(var):
-            missing_vars.append(var)
-    
-    if missing_vars:
-        print("❌ Ошибка: Отсутствуют необходимые переменные окружения:")
-        for var in missing_vars:
-            print(f"   - {var}")
+    """Проверка настроек из .env, переменных окружения и CONFIG_FILE"""
+    # .env читает config: load_dotenv() здесь спрятал бы, откуда взято значение
+    try:
+        from config import load_settings
+        load_settings(require_token=True)
+    except ValueError as e:
+        # ConfigError со списком ошибок; при импорте config он возникает до нашего вызова
+        print("❌ Ошибка: Настройки не прошли проверку:")
+        for error in getattr(e, 'errors', [str(e)]):
+            print(f"   - {error}")
         print("\n📝 Создайте файл .env на основе env.example")
         return False
     
@@ -0,0 +1,264 @@
+"""
+HTTP-сервер webhook с плавной остановкой и передачей сокета новому процессу.
+
+SIGTERM / SIGINT - плавная остановка: сервер перестает принимать соединения,
+ждет завершения уже принятых (не дольше SHUTDOWN_TIMEOUT), затем
+останавливает фоновые задачи, выгружает запись трафика и span'ы и выходит.
+
+SIGUSR2 - передача без простоя: процесс сохраняет снимок памяти хранилища
+состояния, запускает свою копию (тот же интерпретатор и аргументы) и
+передает ей слушающий сокет. Когда новый процесс готов, старый плавно
+останавливается. Если новый процесс не поднялся за HANDOFF_TIMEOUT, старый
+продолжает работать.
+
+Готовность и смена главного процесса сообщаются systemd (sd_notify), если
+сервис запущен с Type=notify.
+"""
+
+import logging
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+from config import settings
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+HANDOFF_COUNTER = Counter('server_handoff_total', 'Передачи сокета новому процессу', ['result'])
+
+# Переменные окружения, через которые старый процесс передает новому сокет и снимок
+LISTEN_FD_ENV = 'WEBHOOK_LISTEN_FD'
+READY_FD_ENV = 'WEBHOOK_READY_FD'
+SNAPSHOT_ENV = 'WEBHOOK_STATE_SNAPSHOT'
+
+
+def sd_notify(message):
+    """Сообщение systemd через NOTIFY_SOCKET; False, если сервис запущен не под systemd"""
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address.startswith('@'):
+        # Абстрактное пространство имен
+        address = '\0' + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(message.encode())
+        return True
+    except OSError as e:
+        logger.warning(f"Не удалось отправить уведомление systemd: {e}")
+        return False
+
+
+class WebhookServer:
+    """Многопоточный WSGI-сервер с плавной остановкой и передачей сокета"""
+
+    def __init__(self, app, host, port, state, on_shutdown=None):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.state = state
+        self.on_shutdown = on_shutdown
+        self.draining = False
+        self._server = None
+        self._lock = threading.Lock()
+        self._stop_requested_at = None
+        self._active = 0
+        self._active_lock = threading.Lock()
+
+    @property
+    def active(self):
+        """Соединения в обработке: от accept до отправки ответа"""
+        return self._active
+
+    def _track_connections(self, server):
+        """Подсчет соединений в обработке
+
+        Счетчик увеличивается в потоке serve_forever при accept, до запуска
+        потока-обработчика. Поэтому после выхода из serve_forever в нем уже
+        учтены все принятые соединения, в том числе те, чей запрос еще не
+        дочитан и не дошел до приложения и адаптивного лимита.
+        """
+        process_request = server.process_request
+        process_request_thread = server.process_request_thread
+
+        def finish():
+            with self._active_lock:
+                self._active -= 1
+
+        def counted_request(request, client_address):
+            with self._active_lock:
+                self._active += 1
+            try:
+                process_request(request, client_address)
+            except Exception:
+                # Поток-обработчик не запустился
+                finish()
+                raise
+
+        def counted_request_thread(request, client_address):
+            try:
+                process_request_thread(request, client_address)
+            finally:
+                finish()
+
+        server.process_request = counted_request
+        server.process_request_thread = counted_request_thread
+
+    def serve(self):
+        """Работа до сигнала остановки; вызывать из главного потока"""
+        inherited_fd = os.environ.pop(LISTEN_FD_ENV, None)
+        fd = int(inherited_fd) if inherited_fd else None
+        self._server = make_server(self.host, self.port, self.app, threaded=True, fd=fd)
+        self._track_connections(self._server)
+        if fd is not None:
+            logger.info(f"Слушающий сокет получен от предыдущего процесса (fd {fd})")
+        self._restore_snapshot()
+
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+        if hasattr(signal, 'SIGUSR2'):
+            signal.signal(signal.SIGUSR2, self._on_signal)
+
+        self._notify_ready()
+        logger.info(f"Сервер слушает {self.host}:{self.port} (pid {os.getpid()})")
+        self._server.serve_forever(poll_interval=0.5)
+
+        # serve_forever вернулся: новые соединения больше не принимаются. Многопоточный
+        # сервер werkzeug отвечает по HTTP/1.1, но werkzeug 3.x закрывает соединение
+        # после каждого ответа (Connection: close); и даже если keep-alive появится,
+        # запрос по уже открытому соединению учтен в счетчике этого соединения
+        self._drain()
+        self._server.server_close()
+        if self.on_shutdown is not None:
+            self.on_shutdown()
+        logger.info("Сервер остановлен")
+
+    def _on_signal(self, signum, frame):
+        # В обработчике сигнала нельзя ждать: shutdown() блокируется до выхода из serve_forever
+        mode = 'handoff' if signum == getattr(signal, 'SIGUSR2', None) else 'stop'
+        threading.Thread(target=self.stop, args=(mode,), name=f'server-{mode}', daemon=True).start()
+
+    def stop(self, mode='stop'):
+        """Плавная остановка; mode='handoff' - сначала запустить процесс-преемник"""
+        with self._lock:
+            if self.draining:
+                return
+            if mode == 'handoff' and not self._handoff():
+                return
+            if mode == 'stop':
+                sd_notify('STOPPING=1')
+            logger.info("Остановка: новые соединения не принимаются, ждем обработки текущих обновлений")
+            self._stop_requested_at = time.monotonic()
+            self.draining = True
+        self._server.shutdown()
+
+    def _drain(self):
+        """Ожидание соединений, которые уже приняты"""
+        deadline = (self._stop_requested_at or time.monotonic()) + settings.SHUTDOWN_TIMEOUT
+        while self.active and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if self.active:
+            logger.warning(f"Не дождались {self.active} запросов за {settings.SHUTDOWN_TIMEOUT} с")
+        else:
+            logger.info("Все принятые запросы обработаны")
+
+    def _notify_ready(self):
+        ready_fd = os.environ.pop(READY_FD_ENV, None)
+        if ready_fd:
+            # Нас запустил предыдущий процесс: сообщаем ему о готовности
+            try:
+                os.write(int(ready_fd), b'1')
+                os.close(int(ready_fd))
+            except OSError as e:
+                logger.warning(f"Не удалось сообщить о готовности предыдущему процессу: {e}")
+        sd_notify(f"READY=1\nMAINPID={os.getpid()}")
+
+    def _restore_snapshot(self):
+        path = os.environ.pop(SNAPSHOT_ENV, None)
+        if not path:
+            return
+        try:
+            started = time.monotonic()
+            restored = self.state.restore(path)
+            logger.info(f"Загружено записей состояния из снимка: {restored} за {time.monotonic() - started:.2f} с")
+        except Exception as e:
+            logger.error(f"Не удалось загрузить снимок состояния {path}: {e}")
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _handoff(self):
+        """Запуск процесса-преемника с тем же сокетом; True, если он готов принимать запросы"""
+        listen_fd = self._server.socket.fileno()
+        env = dict(os.environ)
+        env[LISTEN_FD_ENV] = str(listen_fd)
+
+        snapshot_path = None
+        fd, path = tempfile.mkstemp(prefix='gettginfobot-state-', suffix='.snapshot')
+        os.close(fd)
+        try:
+            if self.state.snapshot(path):
+                snapshot_path = env[SNAPSHOT_ENV] = path
+        except Exception as e:
+            logger.warning(f"Снимок состояния не сохранен, новый процесс начнет с пустым: {e}")
+        if snapshot_path is None:
+            os.remove(path)
+
+        ready_read, ready_write = os.pipe()
+        env[READY_FD_ENV] = str(ready_write)
+        logger.info("Передача: запуск нового процесса")
+        try:
+            child = subprocess.Popen([sys.executable] + sys.argv, env=env, pass_fds=(listen_fd, ready_write))
+        except OSError as e:
+            logger.error(f"Не удалось запустить новый процесс: {e}")
+            HANDOFF_COUNTER.inc(result='error')
+            os.close(ready_read)
+            os.close(ready_write)
+            if snapshot_path:
+                os.remove(snapshot_path)
+            return False
+        os.close(ready_write)
+
+        try:
+            ready = self._wait_ready(ready_read, child, settings.HANDOFF_TIMEOUT)
+        finally:
+            os.close(ready_read)
+        if ready:
+            HANDOFF_COUNTER.inc(result='ok')
+            logger.info(f"Новый процесс {child.pid} готов, старый процесс останавливается")
+            return True
+
+        HANDOFF_COUNTER.inc(result='failed')
+        logger.error(f"Новый процесс {child.pid} не стал готов за {settings.HANDOFF_TIMEOUT} с, работаем дальше")
+        if child.poll() is None:
+            child.kill()
+            child.wait()
+        if snapshot_path and os.path.exists(snapshot_path):
+            os.remove(snapshot_path)
+        return False
+
+    @staticmethod
+    def _wait_ready(ready_read, child, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            readable, _, _ = select.select([ready_read], [], [], min(remaining, 0.5))
+            if readable:
+                # Пустое чтение - процесс закрыл канал, не сообщив о готовности
+                return os.read(ready_read, 1) == b'1'
+            if child.poll() is not None:
+                return False
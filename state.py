@@ -0,0 +1,669 @@
+"""
+Хранилища общего состояния бота.
+
+Все данные, которые бот держит между обновлениями (дедупликация, счетчики,
+лимиты, кэши), проходят через один из бэкендов этого модуля. Бэкенд
+выбирается переменной STATE_BACKEND:
+
+    memory                      - память процесса (один процесс)
+    sqlite:///state.db          - локальный файл (несколько процессов на одном хосте)
+    redis://[:password@]host:port/db - Redis (несколько реплик)
+"""
+
+import itertools
+import logging
+import math
+import os
+import pickle
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from urllib.parse import urlparse, unquote
+
+from compact import IntTable, DELETED
+
+logger = logging.getLogger(__name__)
+
+# Диапазон целых ключей, которые помещаются в IntTable (два значения зарезервированы)
+_INT_KEY_MIN = DELETED + 1
+_INT_KEY_MAX = 2 ** 63 - 1
+
+
+class StateBackendError(Exception):
+    """Ошибка хранилища состояния"""
+
+
+class StateBackend:
+    """Базовый интерфейс хранилища: счетчики, ключи с TTL и token bucket"""
+
+    def get(self, key):
+        """Значение ключа (строка) или None"""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        """Записать значение ключа; ttl в секундах"""
+        raise NotImplementedError
+
+    def add(self, key, value, ttl=None):
+        """Записать значение, только если ключа нет. Возвращает True при записи"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Удалить ключ"""
+        raise NotImplementedError
+
+    def incr(self, key, amount=1, ttl=None):
+        """Увеличить счетчик; ttl задается только при создании ключа"""
+        raise NotImplementedError
+
+    def take_token(self, key, rate, capacity, tokens=1):
+        """Взять токены из корзины (rate токенов в секунду, не более capacity)"""
+        raise NotImplementedError
+
+    def close(self):
+        """Освободить ресурсы"""
+
+    def snapshot(self, path):
+        """Сохранить содержимое в файл для нового процесса; False - хранилище и так общее"""
+        return False
+
+    def restore(self, path):
+        """Загрузить содержимое, сохраненное snapshot(); возвращает число записей"""
+        return 0
+
+
+class _Entry:
+    """Строковое значение со сроком жизни"""
+
+    __slots__ = ('value', 'expires_at')
+
+    def __init__(self, value, expires_at):
+        self.value = value
+        self.expires_at = expires_at
+
+
+class _Bucket:
+    """Состояние token bucket"""
+
+    __slots__ = ('tokens', 'updated_at', 'expires_at')
+
+    def __init__(self, tokens, updated_at, expires_at):
+        self.tokens = tokens
+        self.updated_at = updated_at
+        self.expires_at = expires_at
+
+
+class MemoryStateBackend(StateBackend):
+    """Хранилище в памяти процесса
+
+    Ключи вида "<префикс>:<целое>" с целочисленными значениями (отметки
+    update, счетчики по пользователям и чатам) хранятся в упакованных
+    таблицах IntTable по одной на префикс - их число растет с числом
+    пользователей. Остальные ключи лежат в обычном dict.
+    """
+
+    SWEEP_EVERY = 10000
+    TABLE_SWEEP_EVERY = 1000
+    TABLE_SWEEP_SLOTS = 16384
+    INTERN_MAX_LENGTH = 32
+
+    def __init__(self):
+        self._data = {}
+        self._tables = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._ops = 0
+
+    @staticmethod
+    def _split_int_key(key):
+        """(префикс, число) для ключей "<префикс>:<int64>", иначе (None, None)"""
+        prefix, sep, tail = key.rpartition(':')
+        if not sep or not tail or not (tail.isdigit() or (tail[0] == '-' and tail[1:].isdigit())):
+            return None, None
+        number = int(tail)
+        if not _INT_KEY_MIN <= number <= _INT_KEY_MAX:
+            return None, None
+        return prefix, number
+
+    @staticmethod
+    def _int_value(value):
+        if isinstance(value, bool):
+            return int(value)
+        if isinstance(value, int):
+            return value if _INT_KEY_MIN <= value <= _INT_KEY_MAX else None
+        return None
+
+    def _table(self, prefix, create=False):
+        table = self._tables.get(prefix)
+        if table is None and create:
+            table = self._tables[sys.intern(prefix)] = IntTable()
+        return table
+
+    def _alive(self, key, now):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at is not None and entry.expires_at <= now:
+            del self._data[key]
+            return None
+        return entry
+
+    def _tick(self, now):
+        self._ops += 1
+        if self._ops % self.TABLE_SWEEP_EVERY == 0:
+            for table in self._tables.values():
+                table.sweep(now, self.TABLE_SWEEP_SLOTS)
+        else:
+            # Старые массивы после сжатия освобождаем за счет любых записей,
+            # а не только вставок в эту же таблицу
+            for table in self._tables.values():
+                if table.migrating:
+                    table.migrate(now, IntTable.MIGRATE_SLOTS)
+        if self._ops < self.SWEEP_EVERY:
+            return
+        self._ops = 0
+        expired = [k for k, e in self._data.items() if e.expires_at is not None and e.expires_at <= now]
+        for k in expired:
+            del self._data[k]
+        stale = [k for k, b in self._buckets.items() if b.expires_at <= now]
+        for k in stale:
+            del self._buckets[k]
+
+    @staticmethod
+    def _expires(now, ttl):
+        return now + ttl if ttl else None
+
+    def _make_entry(self, value, now, ttl):
+        value = str(value)
+        if len(value) <= self.INTERN_MAX_LENGTH:
+            # Повторяющиеся короткие значения (типы чатов, флаги) храним в одном экземпляре
+            value = sys.intern(value)
+        return _Entry(value, self._expires(now, ttl))
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            prefix, number = self._split_int_key(key)
+            if prefix is not None:
+                table = self._table(prefix)
+                value = table.get(number, now) if table is not None else None
+                if value is not None:
+                    return str(value)
+            entry = self._alive(key, now)
+            return None if entry is None else entry.value
+
+    def set(self, key, value, ttl=None):
+        now = time.monotonic()
+        with self._lock:
+            self._tick(now)
+            prefix, number = self._split_int_key(key)
+            int_value = self._int_value(value)
+            if prefix is not None and int_value is not None:
+                self._data.pop(key, None)
+                self._table(prefix, create=True).put(number, int_value, self._expires(now, ttl), now)
+                return
+            if prefix is not None and prefix in self._tables:
+                self._tables[prefix].delete(number, now)
+            self._data[key] = self._make_entry(value, now, ttl)
+
+    def add(self, key, value, ttl=None):
+        now = time.monotonic()
+        with self._lock:
+            self._tick(now)
+            prefix, number = self._split_int_key(key)
+            int_value = self._int_value(value)
+            if prefix is not None and int_value is not None and self._alive(key, now) is None:
+                return self._table(prefix, create=True).add(number, int_value, self._expires(now, ttl), now)
+            if self._alive(key, now) is not None:
+                return False
+            if prefix is not None and prefix in self._tables and self._tables[prefix].get(number, now) is not None:
+                return False
+            self._data[key] = self._make_entry(value, now, ttl)
+            return True
+
+    def delete(self, key):
+        now = time.monotonic()
+        with self._lock:
+            prefix, number = self._split_int_key(key)
+            if prefix is not None and prefix in self._tables:
+                self._tables[prefix].delete(number, now)
+            self._data.pop(key, None)
+            self._buckets.pop(key, None)
+
+    def incr(self, key, amount=1, ttl=None):
+        now = time.monotonic()
+        with self._lock:
+            self._tick(now)
+            entry = self._alive(key, now)
+            prefix, number = self._split_int_key(key)
+            if prefix is not None and entry is None:
+                return self._table(prefix, create=True).incr(number, amount, self._expires(now, ttl), now)
+            if entry is None:
+                self._data[key] = self._make_entry(amount, now, ttl)
+                return amount
+            value = int(entry.value) + amount
+            entry.value = str(value)
+            return value
+
+    def take_token(self, key, rate, capacity, tokens=1):
+        now = time.monotonic()
+        with self._lock:
+            self._tick(now)
+            bucket = self._buckets.get(key)
+            if bucket is None or bucket.expires_at <= now:
+                level = float(capacity)
+            else:
+                level = min(capacity, bucket.tokens + (now - bucket.updated_at) * rate)
+            allowed = level >= tokens
+            if allowed:
+                level -= tokens
+            expires_at = now + capacity / rate + 1
+            if bucket is None:
+                self._buckets[key] = _Bucket(level, now, expires_at)
+            else:
+                bucket.tokens, bucket.updated_at, bucket.expires_at = level, now, expires_at
+            return allowed
+
+    def snapshot(self, path):
+        """Таблицы и записи с оставшимся сроком жизни; token bucket'ы не сохраняются (быстро наполняются)"""
+        now = time.monotonic()
+        with self._lock:
+            # Под блокировкой только копирование, обход записей - без нее
+            tables = {prefix: table.copy() for prefix, table in self._tables.items()}
+            entries = [(key, entry.value, entry.expires_at) for key, entry in self._data.items()]
+        packed = {}
+        for prefix, table in tables.items():
+            keys, values, ttls = array('q'), array('q'), array('d')
+            for key, value, expires in table.items(now):
+                keys.append(key)
+                values.append(value)
+                ttls.append(expires - now if expires else 0.0)
+            packed[prefix] = (keys, values, ttls)
+        entries = [(key, value, expires - now if expires is not None else None)
+                   for key, value, expires in entries if expires is None or expires > now]
+        with open(path, 'wb') as f:
+            pickle.dump({'version': 1, 'tables': packed, 'entries': entries}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return True
+
+    def restore(self, path):
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        now = time.monotonic()
+        restored = 0
+        with self._lock:
+            # Записи, появившиеся в этом процессе до загрузки, новее снимка и не заменяются
+            for prefix, (keys, values, ttls) in data['tables'].items():
+                table = self._table(prefix, create=True)
+                table.reserve(len(keys), now)
+                for key, value, ttl in zip(keys, values, ttls):
+                    restored += table.add(key, value, now + ttl if ttl else 0.0, now)
+            for key, value, ttl in data['entries']:
+                if self._alive(key, now) is None:
+                    self._data[key] = self._make_entry(value, now, ttl)
+                    restored += 1
+        return restored
+
+
+class SQLiteStateBackend(StateBackend):
+    """Хранилище в SQLite-файле, общее для процессов одного хоста
+
+    Ключи обновлений уникальны, поэтому просроченные строки не перезаписываются
+    сами: каждые PURGE_EVERY записей процесс удаляет их из kv и buckets.
+    """
+
+    PURGE_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = itertools.count(1)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, expires_at REAL)"
+        )
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(buckets)")]
+        if 'expires_at' not in columns:
+            # Файл создан прежней версией: корзины были без срока жизни
+            conn.execute("ALTER TABLE buckets ADD COLUMN expires_at REAL")
+        conn.execute("CREATE INDEX IF NOT EXISTS kv_expires ON kv (expires_at)")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _tick(self):
+        # next() у itertools.count атомарен, отдельная блокировка не нужна
+        if next(self._writes) % self.PURGE_EVERY == 0:
+            try:
+                self.purge_expired()
+            except sqlite3.Error as e:
+                logger.warning(f"Ошибка очистки просроченных ключей SQLite: {e}")
+
+    def _transaction(self, func):
+        self._tick()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(conn, time.time())
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    @staticmethod
+    def _expires(now, ttl):
+        return now + ttl if ttl else None
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def set(self, key, value, ttl=None):
+        self._tick()
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, str(value), self._expires(now, ttl))
+        )
+
+    def add(self, key, value, ttl=None):
+        def run(conn, now):
+            conn.execute("DELETE FROM kv WHERE key = ? AND expires_at <= ?", (key, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, str(value), self._expires(now, ttl))
+            )
+            return cursor.rowcount == 1
+        return self._transaction(run)
+
+    def delete(self, key):
+        conn = self._conn()
+        conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+        conn.execute("DELETE FROM buckets WHERE key = ?", (key,))
+
+    def incr(self, key, amount=1, ttl=None):
+        def run(conn, now):
+            row = conn.execute(
+                "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, now)
+            ).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, str(amount), self._expires(now, ttl))
+                )
+                return amount
+            value = int(row[0]) + amount
+            conn.execute("UPDATE kv SET value = ? WHERE key = ?", (str(value), key))
+            return value
+        return self._transaction(run)
+
+    def take_token(self, key, rate, capacity, tokens=1):
+        def run(conn, now):
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                level = float(capacity)
+            else:
+                level = min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+            allowed = level >= tokens
+            if allowed:
+                level -= tokens
+            # К этому моменту корзина наполнится целиком, и строка больше не нужна
+            expires_at = now + capacity / rate + 1
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, level, now, expires_at)
+            )
+            return allowed
+        return self._transaction(run)
+
+    def purge_expired(self):
+        """Удалить просроченные ключи и полностью наполнившиеся корзины"""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("DELETE FROM kv WHERE expires_at <= ?", (now,))
+        conn.execute("DELETE FROM buckets WHERE expires_at IS NULL OR expires_at <= ?", (now,))
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RedisStateBackend(StateBackend):
+    """Хранилище в Redis (или любом сервере с протоколом RESP)"""
+
+    # Token bucket выполняется атомарно на сервере; время берется из TIME,
+    # чтобы реплики с расходящимися часами видели одну и ту же корзину
+    TOKEN_BUCKET_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local need = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= need then
+    tokens = tokens - need
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return allowed
+"""
+
+    # Команды, повтор которых после обрыва не меняет результат
+    IDEMPOTENT = frozenset(('PING', 'GET', 'SET', 'DEL'))
+
+    def __init__(self, host='localhost', port=6379, db=0, password=None, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = (sock, sock.makefile('rb'))
+        self._local.conn = conn
+        if self.password:
+            self._roundtrip([('AUTH', self.password)])
+        if self.db:
+            self._roundtrip([('SELECT', self.db)])
+        return conn
+
+    def _drop(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn[1].close()
+                conn[0].close()
+            except OSError:
+                pass
+
+    @staticmethod
+    def _encode(args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if isinstance(arg, bytes):
+                data = arg
+            elif isinstance(arg, float):
+                data = repr(arg).encode()
+            else:
+                data = str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        return b''.join(parts)
+
+    def _read_reply(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Соединение с Redis закрыто")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            raise StateBackendError(payload.decode())
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length == -1:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2].decode()
+        if kind == b'*':
+            length = int(payload)
+            if length == -1:
+                return None
+            # Ошибка внутри массива (ответ EXEC) не должна оставить хвост непрочитанным
+            items, error = [], None
+            for _ in range(length):
+                try:
+                    items.append(self._read_reply(reader))
+                except StateBackendError as e:
+                    items.append(None)
+                    error = error or e
+            if error is not None:
+                raise error
+            return items
+        raise StateBackendError(f"Неизвестный ответ Redis: {line!r}")
+
+    def _roundtrip(self, commands):
+        sock, reader = self._local.conn
+        sock.sendall(b''.join(self._encode(cmd) for cmd in commands))
+        # Все ответы вычитываем до выброса ошибки, чтобы не рассинхронизировать поток
+        replies, error = [], None
+        for _ in commands:
+            try:
+                replies.append(self._read_reply(reader))
+            except StateBackendError as e:
+                replies.append(None)
+                error = error or e
+        if error is not None:
+            raise error
+        return replies
+
+    @classmethod
+    def _idempotent(cls, commands):
+        # SET NX и INCRBY при повторе дали бы другой ответ или прибавили дважды
+        return all(
+            cmd[0] in cls.IDEMPOTENT and 'NX' not in cmd[1:]
+            for cmd in commands
+        )
+
+    def execute(self, *commands):
+        """Выполнить команды одним пакетом (pipeline) и вернуть список ответов
+
+        После обрыва соединения повторяются только идемпотентные команды:
+        остальные могли уже выполниться на сервере до обрыва.
+        """
+        attempts = 2 if self._idempotent(commands) else 1
+        for attempt in range(1, attempts + 1):
+            if getattr(self._local, 'conn', None) is None:
+                self._connect()
+            try:
+                return self._roundtrip(commands)
+            except (OSError, ConnectionError):
+                self._drop()
+                if attempt == attempts:
+                    raise
+
+    @staticmethod
+    def _px(ttl):
+        return int(math.ceil(ttl * 1000))
+
+    def get(self, key):
+        return self.execute(('GET', key))[0]
+
+    def set(self, key, value, ttl=None):
+        if ttl:
+            self.execute(('SET', key, value, 'PX', self._px(ttl)))
+        else:
+            self.execute(('SET', key, value))
+
+    def add(self, key, value, ttl=None):
+        if ttl:
+            reply = self.execute(('SET', key, value, 'PX', self._px(ttl), 'NX'))[0]
+        else:
+            reply = self.execute(('SET', key, value, 'NX'))[0]
+        return reply == 'OK'
+
+    def delete(self, key):
+        self.execute(('DEL', key))
+
+    def incr(self, key, amount=1, ttl=None):
+        if ttl:
+            # MULTI/EXEC: ключ не может истечь между SET и INCRBY, иначе
+            # INCRBY создал бы его заново без срока жизни
+            replies = self.execute(
+                ('MULTI',),
+                ('SET', key, 0, 'PX', self._px(ttl), 'NX'),
+                ('INCRBY', key, amount),
+                ('EXEC',)
+            )
+            return replies[3][1]
+        return self.execute(('INCRBY', key, amount))[0]
+
+    def take_token(self, key, rate, capacity, tokens=1):
+        reply = self.execute(
+            ('EVAL', self.TOKEN_BUCKET_SCRIPT, 1, key, float(rate), float(capacity), float(tokens))
+        )[0]
+        return reply == 1
+
+    def close(self):
+        self._drop()
+
+
+def create_state_backend(url):
+    """Создание хранилища по строке STATE_BACKEND"""
+    url = (url or 'memory').strip()
+    if url == 'memory':
+        return MemoryStateBackend()
+
+    if url.startswith('sqlite:'):
+        # Как в SQLAlchemy: sqlite:///relative.db и sqlite:////absolute/path.db
+        path = unquote(url[len('sqlite:///'):] if url.startswith('sqlite:///') else url[len('sqlite:'):])
+        if not path:
+            raise ValueError(f"Не указан путь к файлу SQLite: {url}")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return SQLiteStateBackend(path)
+
+    parsed = urlparse(url)
+    if parsed.scheme == 'redis':
+        db = parsed.path.lstrip('/')
+        return RedisStateBackend(
+            host=parsed.hostname or 'localhost',
+            port=parsed.port or 6379,
+            db=int(db) if db else 0,
+            password=unquote(parsed.password) if parsed.password else None
+        )
+
+    raise ValueError(f"Неизвестный STATE_BACKEND: {url}")
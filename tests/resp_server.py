@@ -0,0 +1,170 @@
+"""
+Заглушка Redis для тестов: TCP-сервер с протоколом RESP в том же процессе.
+
+Поддерживает команды, которые использует RedisStateBackend (кроме EVAL):
+AUTH, SELECT, PING, GET, SET [PX ms] [NX], DEL, INCRBY, PTTL и MULTI/EXEC.
+Срок жизни ключей считается по time.monotonic(). Неизвестные команды и
+неверные аргументы получают ответ-ошибку, как у настоящего Redis.
+
+server.drop_after - имя команды, после выполнения которой сервер закрывает
+соединение, не отправив ответ (обрыв сети в самый неудобный момент).
+"""
+
+import socketserver
+import threading
+import time
+
+
+class RespError(Exception):
+    pass
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        queued = None
+        while True:
+            try:
+                command = self._read_command()
+            except (ConnectionError, ValueError):
+                return
+            if command is None:
+                return
+            self.server.commands.append(command)
+            name = command[0].upper()
+            if name == 'MULTI':
+                queued, reply = [], True
+            elif name == 'EXEC' and queued is not None:
+                reply, queued = self.server.store.transaction(queued), None
+            elif queued is not None:
+                queued.append(command)
+                reply = 'QUEUED'
+            else:
+                try:
+                    reply = self.server.store.execute(command)
+                except RespError as e:
+                    reply = e
+            if name == self.server.drop_after:
+                return
+            self.wfile.write(_encode(reply))
+            self.wfile.flush()
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if line[:1] != b'*':
+            raise ValueError(line)
+        args = []
+        for _ in range(int(line[1:-2])):
+            header = self.rfile.readline()
+            length = int(header[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2].decode())
+        return args
+
+
+def _encode(reply):
+    if reply is None:
+        return b'$-1\r\n'
+    if reply is True:
+        return b'+OK\r\n'
+    if reply == 'QUEUED':
+        return b'+QUEUED\r\n'
+    if isinstance(reply, RespError):
+        return b'-ERR %s\r\n' % str(reply).encode()
+    if isinstance(reply, int):
+        return b':%d\r\n' % reply
+    if isinstance(reply, list):
+        return b'*%d\r\n' % len(reply) + b''.join(_encode(item) for item in reply)
+    data = str(reply).encode()
+    return b'$%d\r\n%s\r\n' % (len(data), data)
+
+
+class _Store:
+
+    def __init__(self, password=None):
+        self.password = password
+        self.data = {}
+        self.lock = threading.RLock()
+
+    def transaction(self, commands):
+        """EXEC: команды выполняются подряд под одной блокировкой"""
+        replies = []
+        with self.lock:
+            for command in commands:
+                try:
+                    replies.append(self.execute(command))
+                except RespError as e:
+                    replies.append(e)
+        return replies
+
+    def _alive(self, key, now):
+        item = self.data.get(key)
+        if item is not None and item[1] is not None and item[1] <= now:
+            del self.data[key]
+            return None
+        return item
+
+    def execute(self, command):
+        name, args = command[0].upper(), command[1:]
+        now = time.monotonic()
+        with self.lock:
+            if name == 'PING':
+                return True
+            if name == 'AUTH':
+                if args != [self.password]:
+                    raise RespError('invalid password')
+                return True
+            if name == 'SELECT':
+                return True
+            if name == 'GET':
+                item = self._alive(args[0], now)
+                return None if item is None else item[0]
+            if name == 'SET':
+                key, value, options = args[0], args[1], [a.upper() for a in args[2:]]
+                expires = None
+                if 'PX' in options:
+                    expires = now + int(args[2 + options.index('PX') + 1]) / 1000
+                if 'NX' in options and self._alive(key, now) is not None:
+                    return None
+                self.data[key] = (value, expires)
+                return True
+            if name == 'PTTL':
+                item = self._alive(args[0], now)
+                if item is None:
+                    return -2
+                return -1 if item[1] is None else int((item[1] - now) * 1000)
+            if name == 'DEL':
+                return sum(1 for key in args if self.data.pop(key, None) is not None)
+            if name == 'INCRBY':
+                item = self._alive(args[0], now)
+                value, expires = item if item is not None else ('0', None)
+                try:
+                    value = int(value) + int(args[1])
+                except ValueError:
+                    raise RespError('value is not an integer or out of range')
+                self.data[args[0]] = (str(value), expires)
+                return value
+        raise RespError(f"unknown command '{command[0]}'")
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    """Сервер на случайном порту; адрес - server.server_address"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, password=None):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.store = _Store(password)
+        self.commands = []
+        self.drop_after = None
+        self._thread = threading.Thread(target=self.serve_forever, args=(0.01,), daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,107 @@
+import types
+
+import pytest
+
+import abuse
+import state
+from abuse import ALLOW, DROP, WARN, AbuseLimiter
+from state import MemoryStateBackend
+
+LIMIT = 10
+WINDOW = 60
+# Начало окна с номером 100 (четное: счетчик в ключе abuse0)
+START = 100 * WINDOW
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Общие подменные часы для ограничителя и сроков жизни в хранилище"""
+    fake = types.SimpleNamespace(now=float(START))
+    fake.time = fake.monotonic = lambda: fake.now
+    monkeypatch.setattr(abuse, 'time', fake)
+    monkeypatch.setattr(state, 'time', fake)
+    return fake
+
+
+@pytest.fixture
+def limiter(clock):
+    return AbuseLimiter(MemoryStateBackend(), limit=LIMIT, window=WINDOW)
+
+
+def send(limiter, count, user_id=1):
+    return [limiter.check(user_id) for _ in range(count)]
+
+
+def test_tiers_within_one_window(clock, limiter):
+    clock.now = START + 10
+    assert send(limiter, LIMIT) == [ALLOW] * LIMIT
+    # Превышение: один короткий ответ, дальше молча
+    assert send(limiter, 3) == [WARN, DROP, DROP]
+    # Другой пользователь считается отдельно
+    assert limiter.check(2) == ALLOW
+
+
+def test_one_warning_per_window(clock, limiter):
+    clock.now = START + 1
+    send(limiter, LIMIT)
+    assert limiter.check(1) == WARN
+    clock.now = START + 59
+    assert limiter.check(1) == DROP
+    # Через окно после предупреждения пользователь, который так и не
+    # остановился, получает новое: предыдущее окно еще почти целиком в оценке
+    clock.now = START + 61
+    assert send(limiter, 3) == [WARN, DROP, DROP]
+
+
+def test_previous_window_weighted_by_remaining_share(clock, limiter):
+    clock.now = START + 50
+    send(limiter, LIMIT)
+    # Прошла десятая часть нового окна: предыдущее идет с весом 0.9
+    clock.now = START + WINDOW + 6
+    assert limiter.check(1) == ALLOW  # 1 + 10 * 0.9 = 10
+    assert limiter.check(1) == WARN   # 2 + 9 = 11
+
+
+def test_previous_window_fades_out(clock, limiter):
+    clock.now = START + 50
+    send(limiter, LIMIT)
+    # На середине окна предыдущее окно дает половину своих сообщений
+    clock.now = START + WINDOW + 30
+    assert send(limiter, 5) == [ALLOW] * 5  # 5 + 5 = 10
+    assert limiter.check(1) == WARN
+
+
+def test_parity_keys_and_ttl(clock, limiter):
+    backend = limiter.state
+    clock.now = START + 50
+    send(limiter, 3)
+    # Хранилище отдает значения строками, как Redis
+    assert backend.get('abuse0:1') == '3' and backend.get('abuse1:1') is None
+    clock.now = START + WINDOW + 1
+    send(limiter, 2)
+    assert backend.get('abuse1:1') == '2'
+    # Счетчик окна 100 нужен до конца окна 101 как предыдущий
+    clock.now = START + 2 * WINDOW - 0.5
+    assert backend.get('abuse0:1') == '3'
+    # В окне 102 ключ abuse0 переиспользуется и начинается с нуля, а не с 3
+    clock.now = START + 2 * WINDOW + 1
+    assert backend.get('abuse0:1') is None
+    limiter.check(1)
+    assert backend.get('abuse0:1') == '1'
+
+
+def test_disabled_and_anonymous(clock):
+    limiter = AbuseLimiter(MemoryStateBackend(), limit=0, window=WINDOW)
+    assert send(limiter, 100) == [ALLOW] * 100
+    limiter.configure(limit=1)
+    assert limiter.check(None) == ALLOW
+    assert send(limiter, 2) == [ALLOW, WARN]
+
+
+def test_state_error_allows(clock):
+    class BrokenState:
+        def incr(self, *args, **kwargs):
+            raise ConnectionError('state is down')
+
+    limiter = AbuseLimiter(BrokenState(), limit=1, window=WINDOW)
+    assert send(limiter, 3) == [ALLOW] * 3
@@ -0,0 +1,64 @@
+import json
+
+from capture import Redactor
+
+SECRETS = ('Maria', 'Secret', 'maria_s', 'Ivan Editor', 'Anna Author', '+79990001122', 'Hidden Person')
+
+
+def forwarded_update():
+    sender = {'id': 111, 'is_bot': False, 'first_name': 'Maria', 'last_name': 'Secret', 'username': 'maria_s'}
+    return {
+        'update_id': 10,
+        'message': {
+            'message_id': 5,
+            'date': 1700000000,
+            'from': sender,
+            'chat': {'id': 111, 'type': 'private', 'first_name': 'Maria', 'username': 'maria_s'},
+            'forward_sender_name': 'Maria Secret',
+            'forward_signature': 'Ivan Editor',
+            'author_signature': 'Anna Author',
+            'forward_origin': {'type': 'hidden_user', 'date': 1690000000, 'sender_user_name': 'Hidden Person'},
+            'forward_date': 1690000000,
+            'contact': {
+                'phone_number': '+79990001122',
+                'first_name': 'Maria',
+                'user_id': 111,
+                'vcard': 'BEGIN:VCARD\nFN:Maria Secret\nTEL:+79990001122\nEND:VCARD',
+            },
+            'text': '/start',
+        },
+    }
+
+
+def test_no_personal_data_left():
+    redacted = json.dumps(Redactor('salt').redact(forwarded_update()), ensure_ascii=False)
+    for secret in SECRETS:
+        assert secret not in redacted
+
+
+def test_masked_text_keeps_utf16_offsets():
+    text = 'Привет 👋🏽 мир'
+    masked = Redactor('salt')._mask_text(text)
+    # Смещения entities считаются в UTF-16: эмодзи с модификатором - 4 единицы
+    assert masked == 'x' * (len(text) + 2)
+    assert Redactor('salt')._mask_text('/start 👋') == '/start 👋'
+
+
+def test_vcard_masked_even_with_keep_text():
+    redacted = Redactor('salt', keep_text=True).redact(forwarded_update())
+    vcard = redacted['message']['contact']['vcard']
+    assert set(vcard) == {'x'}
+
+
+def test_redaction_is_deterministic():
+    first = Redactor('salt').redact(forwarded_update())
+    second = Redactor('salt').redact(forwarded_update())
+    other = Redactor('pepper').redact(forwarded_update())
+    message = first['message']
+    assert first == second
+    # Одинаковые значения дают одинаковые хеши, поэтому связи сохраняются
+    assert message['from']['id'] == message['chat']['id'] == message['contact']['user_id']
+    assert message['forward_sender_name'].startswith('Name_')
+    assert message['forward_origin']['sender_user_name'].startswith('Name_')
+    assert other['message']['forward_sender_name'] != message['forward_sender_name']
+    assert message['text'] == '/start'
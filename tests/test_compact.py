@@ -0,0 +1,141 @@
+import random
+import time
+
+import pytest
+
+from compact import IntTable, TableFullError
+
+
+def check_against_model(table, model, now):
+    alive = {k: v for k, (v, expires) in model.items() if not expires or expires > now}
+    assert {k: v for k, v, _ in table.items(now)} == alive
+    for key, value in alive.items():
+        assert table.get(key, now) == value
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_fuzz_against_dict(seed):
+    rnd = random.Random(seed)
+    table = IntTable(capacity=8)
+    model = {}
+    now = 1000.0
+    # Узкий диапазон ключей дает повторы и удаления, широкий - рост таблицы
+    key_range = rnd.choice([50, 5000, 2 ** 62])
+    for step in range(20000):
+        key = rnd.randrange(-key_range, key_range)
+        op = rnd.random()
+        expires = now + rnd.choice([0, 0, 0.5, 5])
+        current = model.get(key)
+        if current is not None and current[1] and current[1] <= now:
+            current = None
+            del model[key]
+        if op < 0.35:
+            value = rnd.randrange(-2 ** 63 + 2, 2 ** 63)
+            table.put(key, value, expires, now)
+            model[key] = (value, expires)
+        elif op < 0.55:
+            value = rnd.randrange(1000)
+            assert table.add(key, value, expires, now) == (current is None)
+            if current is None:
+                model[key] = (value, expires)
+        elif op < 0.7:
+            amount = rnd.randrange(-5, 5)
+            expected = amount if current is None else current[0] + amount
+            assert table.incr(key, amount, expires, now) == expected
+            model[key] = (expected, expires if current is None else current[1])
+        elif op < 0.8:
+            assert table.delete(key, now) == (current is not None)
+            model.pop(key, None)
+        elif op < 0.95:
+            assert table.get(key, now) == (None if current is None else current[0])
+        elif op < 0.99:
+            table.sweep(now, rnd.choice([None, 64, 4096]))
+        else:
+            now += rnd.choice([0.1, 1, 10])
+        if step % 2000 == 0:
+            check_against_model(table, model, now)
+    check_against_model(table, model, now)
+    check_against_model(table.copy(), model, now)
+
+
+def test_copy_during_resize_is_independent():
+    table = IntTable(capacity=8)
+    key = 0
+    # Вставляем, пока не начнется расширение крупной таблицы
+    while key < 1000 or table._old_keys is None:
+        table.put(key, key, 0, 0)
+        key += 1
+    clone = table.copy()
+    table.put(1, -1, 0, 0)
+    assert clone.get(1, 0) == 1
+    assert sorted(k for k, _, _ in clone.items(0)) == list(range(key))
+    assert clone.nbytes == table.nbytes
+
+
+def test_resize_does_not_stall_writes():
+    table = IntTable()
+    worst = 0.0
+    for key in range(300000):
+        started = time.perf_counter()
+        table.put(key, key, 0, 0)
+        worst = max(worst, time.perf_counter() - started)
+    # Полная пересборка 300 тысяч записей занимает сотни миллисекунд
+    assert worst < 0.05
+    assert len(table) == 300000
+
+
+def shrunk_table(count=400000, survivors=100):
+    """Большая таблица, у которой после истечения TTL осталось survivors записей"""
+    table = IntTable()
+    for key in range(count):
+        table.put(key, key, 1.0, 0)
+    for key in range(survivors):
+        table.put(-1 - key, key, 0, 0)
+    old_capacity = table._capacity
+    table.sweep(2.0)
+    assert table.migrating and table._capacity < old_capacity
+    return table, old_capacity
+
+
+def test_shrink_leaves_room_for_migration():
+    table, old_capacity = shrunk_table()
+    # Вставок до следующего расширения хватает, чтобы перенести старые массивы
+    room = table._capacity * IntTable.MAX_LOAD - len(table)
+    assert room >= old_capacity / IntTable.MIGRATE_SLOTS
+    worst = 0.0
+    inserts = 0
+    while table.migrating:
+        started = time.perf_counter()
+        table.put(10 ** 9 + inserts, 1, 0, 2.0)
+        worst = max(worst, time.perf_counter() - started)
+        inserts += 1
+    # Перенос всего миллиона слотов за одну вставку занимает около 0.1 с
+    assert worst < 0.02
+    assert len(table) == 100 + inserts
+    assert all(table.get(-1 - key, 2.0) == key for key in range(100))
+
+
+def test_sweep_frees_old_arrays_without_inserts():
+    table, old_capacity = shrunk_table(100000)
+    sweeps = 0
+    while table.migrating:
+        table.sweep(2.0, 16384)
+        sweeps += 1
+    # Пока старые массивы переносятся, следующее сжатие не начинается; после
+    # первого сжатия возможно еще одно, до размера по числу записей
+    assert sweeps <= old_capacity // 16384 + 2
+    assert table.nbytes == table._capacity * 24 <= 1024 * 24
+    assert len(table) == 100
+
+
+def test_shared_table_is_fixed():
+    table = IntTable.shared(100)
+    capacity = table._capacity
+    for key in range(int(capacity * IntTable.MAX_LOAD)):
+        table.put(key, key, 1.0, 0)
+    # Просроченные записи освобождают место пересборкой на месте
+    table.put(-1, 1, 0, 2.0)
+    assert table._capacity == capacity and len(table) == 1
+    with pytest.raises(TableFullError):
+        for key in range(capacity):
+            table.put(key, key, 0, 3.0)
@@ -0,0 +1,106 @@
+import threading
+import types
+
+import pytest
+
+import concurrency
+from concurrency import SHED_COUNTER, AdaptiveLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Подменные часы модуля: observe() видит только то время, что выставил тест"""
+    fake = types.SimpleNamespace(now=100.0)
+    fake.monotonic = lambda: fake.now
+    monkeypatch.setattr(concurrency, 'time', fake)
+    return fake
+
+
+def fill(limiter):
+    """Занять все свободные слоты"""
+    while limiter.try_acquire():
+        pass
+
+
+def test_sheds_over_limit():
+    limiter = AdaptiveLimiter('test_shed', initial_limit=3)
+    shed = SHED_COUNTER.value(limiter='test_shed')
+    assert [limiter.try_acquire() for _ in range(4)] == [True, True, True, False]
+    assert limiter.inflight == 3
+    assert SHED_COUNTER.value(limiter='test_shed') == shed + 1
+    limiter.release()
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+
+
+def test_release_never_goes_negative():
+    limiter = AdaptiveLimiter('test_release', initial_limit=2)
+    limiter.release()
+    assert limiter.inflight == 0
+    assert limiter.try_acquire() and limiter.try_acquire()
+
+
+def test_additive_increase_per_window(clock):
+    limiter = AdaptiveLimiter('test_increase', initial_limit=4, target_latency=0.5)
+    fill(limiter)
+    # +1/limit за каждый быстрый ответ: около +1 за окно из limit ответов
+    for _ in range(4):
+        limiter.observe(0.1)
+    assert limiter.limit == 4
+    limiter.observe(0.1)
+    assert limiter.limit == 5
+
+
+def test_no_increase_when_underused(clock):
+    limiter = AdaptiveLimiter('test_idle', initial_limit=10)
+    limiter.try_acquire()
+    for _ in range(100):
+        limiter.observe(0.1)
+    assert limiter.limit == 10
+
+
+def test_multiplicative_decrease_once_per_target(clock):
+    limiter = AdaptiveLimiter('test_decrease', initial_limit=100, target_latency=0.5, backoff=0.5)
+    limiter.observe(1.0)
+    assert limiter.limit == 50
+    # Пачка медленных ответов от одной перегрузки снижает лимит один раз
+    limiter.observe(1.0)
+    limiter.observe(0.1, ok=False)
+    assert limiter.limit == 50
+    clock.now += 0.5
+    limiter.observe(0.1, ok=False)
+    assert limiter.limit == 25
+
+
+def test_limit_stays_within_bounds(clock):
+    limiter = AdaptiveLimiter('test_bounds', initial_limit=3, min_limit=2, max_limit=4, backoff=0.1)
+    fill(limiter)
+    for _ in range(100):
+        limiter.observe(0.01)
+    assert limiter.limit == 4
+    for _ in range(10):
+        clock.now += 1
+        limiter.observe(5.0)
+    assert limiter.limit == 2
+
+
+def test_initial_and_configure_clamp():
+    limiter = AdaptiveLimiter('test_clamp', initial_limit=1000, max_limit=64)
+    assert limiter.limit == 64
+    limiter.configure(max_limit=8)
+    assert limiter.limit == 8
+    limiter.configure(min_limit=12, max_limit=32)
+    assert limiter.limit == 12
+
+
+def test_acquire_waits_for_release():
+    limiter = AdaptiveLimiter('test_acquire', initial_limit=1)
+    shed = SHED_COUNTER.value(limiter='test_acquire')
+    assert limiter.acquire(timeout=0)
+    assert not limiter.acquire(timeout=0.01)
+    timer = threading.Timer(0.02, limiter.release)
+    timer.start()
+    assert limiter.acquire(timeout=5)
+    timer.join()
+    # Ожидание слота не считается отброшенным запросом
+    assert SHED_COUNTER.value(limiter='test_acquire') == shed
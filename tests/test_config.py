@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+import config
+from config import ConfigError, load_settings
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name in ('BOT_TOKEN', 'FLASK_PORT', 'ABUSE_LIMIT'):
+        monkeypatch.delenv(name, raising=False)
+    return tmp_path
+
+
+def test_sources(workdir, monkeypatch):
+    (workdir / '.env').write_text('BOT_TOKEN=123:abc\nFLASK_PORT=5055\nABUSE_LIMIT=7\n')
+    monkeypatch.setenv('ABUSE_LIMIT', '9')
+    settings = load_settings(config_file='')
+    assert (settings.FLASK_PORT, settings.source('FLASK_PORT')) == (5055, '.env')
+    # Переменная процесса главнее .env
+    assert (settings.ABUSE_LIMIT, settings.source('ABUSE_LIMIT')) == (9, 'env')
+    assert settings.source('LOG_LEVEL') == 'default'
+    # .env не попадает в окружение процесса
+    assert 'FLASK_PORT' not in os.environ
+
+
+def test_reload_picks_up_env_file(workdir, monkeypatch):
+    (workdir / '.env').write_text('ABUSE_LIMIT=7\n')
+    monkeypatch.setattr(config, 'CONFIG_FILE', '')
+    monkeypatch.setattr(config, 'settings', load_settings())
+    (workdir / '.env').write_text('ABUSE_LIMIT=3\nFLASK_PORT=6000\n')
+    changed = config.reload_settings()
+    assert changed == ['ABUSE_LIMIT']
+    assert config.settings.ABUSE_LIMIT == 3
+    # Не reloadable: остается прежним до перезапуска
+    assert config.settings.FLASK_PORT == 5000
+
+
+def test_errors_are_collected(workdir):
+    (workdir / '.env').write_text('FLASK_PORT=0\nABUSE_LIMIT=many\nSHED_MODE=drop\n')
+    with pytest.raises(ConfigError) as e:
+        load_settings(config_file='')
+    assert [error.split('=')[0].split(':')[0] for error in e.value.errors] == ['FLASK_PORT', 'SHED_MODE', 'ABUSE_LIMIT']
+
+
+def test_unknown_key_in_config_file(workdir):
+    (workdir / 'settings.json').write_text('{"ABUSE_LIMT": 5}')
+    with pytest.raises(ConfigError, match='ABUSE_LIMT'):
+        load_settings(config_file='settings.json')
+
+
+def test_constants_match_schema():
+    for setting in config.SCHEMA:
+        assert getattr(config, setting.name) == getattr(config.settings, setting.name)
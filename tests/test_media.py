@@ -0,0 +1,89 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import media
+from media import MediaInspector
+from state import MemoryStateBackend
+
+PAYLOAD = b'a' * 4096
+
+
+class DripHandler(BaseHTTPRequestHandler):
+    """Отдает тело по байту с паузой self.server.delay"""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(PAYLOAD)))
+        self.end_headers()
+        for i in range(len(PAYLOAD)):
+            try:
+                self.wfile.write(PAYLOAD[i:i + 1])
+                self.wfile.flush()
+            except OSError:
+                return
+            time.sleep(self.server.delay)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def file_server(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), DripHandler)
+    server.daemon_threads = True
+    server.delay = 0
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True)
+    thread.start()
+    monkeypatch.setattr(media, 'FILE_URL', 'http://%s:%d/{token}/{path}' % server.server_address)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class FakeBot:
+    class application:
+        class bot:
+            token = 'token'
+
+    def api_call_sync(self, method, params=None, timeout=None):
+        return {'file_path': 'photos/file.jpg'}
+
+
+def make_media():
+    return {'file_id': 'f1', 'file_unique_id': 'u1', 'file_size': None}
+
+
+def test_hash(file_server):
+    inspector = MediaInspector(FakeBot(), MemoryStateBackend(), enabled=True, timeout=5)
+    result = inspector._analyze(make_media())
+    assert result['status'] == 'ok' and result['bytes'] == len(PAYLOAD)
+    inspector.shutdown()
+
+
+def test_slow_drip_respects_deadline(file_server):
+    file_server.delay = 0.05
+    inspector = MediaInspector(FakeBot(), MemoryStateBackend(), enabled=True, timeout=0.5)
+    started = time.monotonic()
+    result = inspector._analyze(make_media())
+    elapsed = time.monotonic() - started
+    assert result['status'] == 'timeout'
+    assert elapsed < 0.8
+    inspector.shutdown()
+
+
+def test_stalled_server_respects_deadline(file_server):
+    file_server.delay = 30
+    inspector = MediaInspector(FakeBot(), MemoryStateBackend(), enabled=True, timeout=0.5)
+    started = time.monotonic()
+    assert inspector._analyze(make_media())['status'] == 'timeout'
+    assert time.monotonic() - started < 0.8
+    inspector.shutdown()
+
+
+def test_size_limit(file_server):
+    inspector = MediaInspector(FakeBot(), MemoryStateBackend(), enabled=True, max_bytes=1024, timeout=5)
+    assert inspector._analyze(make_media())['status'] == 'too_large'
+    inspector.shutdown()
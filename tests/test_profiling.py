@@ -0,0 +1,47 @@
+import collections
+import threading
+
+import pytest
+
+import profiling
+from profiling import ProfilerBusyError, format_collapsed, sample_stacks
+
+
+def busy_worker(stop):
+    while not stop.is_set():
+        stop.wait(0.001)
+
+
+def test_collapsed_stacks_from_root_to_leaf():
+    stop = threading.Event()
+    thread = threading.Thread(target=busy_worker, args=(stop,), name='worker')
+    thread.start()
+    try:
+        counts = sample_stacks(0.05, interval=0.005)
+    finally:
+        stop.set()
+        thread.join()
+
+    stacks = [stack for stack in counts if stack.startswith('worker;')]
+    assert stacks
+    frames = stacks[0].split(';')
+    # Имя потока, затем кадры от внешнего к внутреннему
+    assert frames[0] == 'worker'
+    labels = [frame.split(' (')[0] for frame in frames[1:]]
+    assert labels.index('_bootstrap') < labels.index('busy_worker')
+    assert any(frame.startswith('busy_worker (test_profiling.py:') for frame in frames)
+    # Текущий (профилирующий) поток не попадает в выборку
+    assert not any('test_collapsed_stacks_from_root_to_leaf' in stack for stack in counts)
+
+
+def test_format_collapsed_most_common_first():
+    counts = collections.Counter({'main;a': 2, 'main;a;b': 5, 'worker;c': 1})
+    assert format_collapsed(counts) == 'main;a;b 5\nmain;a 2\nworker;c 1\n'
+    assert format_collapsed(collections.Counter()) == ''
+
+
+def test_only_one_profile_at_a_time():
+    with profiling._profile_lock:
+        with pytest.raises(ProfilerBusyError):
+            sample_stacks(0.01)
+    assert sample_stacks(0.01) is not None
@@ -0,0 +1,165 @@
+import http.client
+import os
+import signal
+import socket
+import threading
+import time
+
+from server import WebhookServer
+from state import MemoryStateBackend
+
+
+class SlowApp:
+    """WSGI-приложение, которое отвечает только после release"""
+
+    def __init__(self, events):
+        self.events = events
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, environ, start_response):
+        self.started.set()
+        self.release.wait(5)
+        self.events.append('response')
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'ok']
+
+
+def run_server(app, events, driver):
+    """serve() в главном потоке (ему нужны сигналы), driver(server, port) - в фоне"""
+    server = WebhookServer(app, '127.0.0.1', 0, state=MemoryStateBackend(),
+                           on_shutdown=lambda: events.append('shutdown'))
+    errors = []
+
+    def drive():
+        try:
+            while server._server is None:
+                time.sleep(0.01)
+            driver(server, server._server.server_port)
+        except BaseException as e:
+            errors.append(e)
+            server.stop()
+
+    handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR2)}
+    thread = threading.Thread(target=drive)
+    thread.start()
+    try:
+        server.serve()
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+        thread.join(5)
+    if errors:
+        raise errors[0]
+    return server
+
+
+def test_stop_waits_for_request_in_flight():
+    events = []
+    app = SlowApp(events)
+    responses = []
+
+    def request(port):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+        conn.request('POST', '/webhook', body=b'{}')
+        response = conn.getresponse()
+        responses.append((response.status, response.read()))
+        conn.close()
+
+    def driver(server, port):
+        client = threading.Thread(target=request, args=(port,))
+        client.start()
+        assert app.started.wait(5)
+        server.stop()
+        # Новые соединения не принимаются, но выход ждет ответа на принятое
+        time.sleep(0.1)
+        assert server.draining and server.active == 1
+        assert 'shutdown' not in events
+        app.release.set()
+        client.join(5)
+
+    server = run_server(app, events, driver)
+    assert responses == [(200, b'ok')]
+    assert events == ['response', 'shutdown']
+    assert server.active == 0
+
+
+def test_stop_waits_for_accepted_connection_before_request():
+    events = []
+    app = SlowApp(events)
+    app.release.set()
+    replies = []
+
+    def driver(server, port):
+        sock = socket.create_connection(('127.0.0.1', port), timeout=5)
+        # Соединение принято, но запрос еще не отправлен и до приложения не дошел
+        deadline = time.monotonic() + 5
+        while server.active == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        stopper = threading.Thread(target=server.stop)
+        stopper.start()
+        time.sleep(0.1)
+        sock.sendall(b'POST /webhook HTTP/1.1\r\nHost: test\r\nContent-Length: 2\r\n\r\n{}')
+        replies.append(sock.makefile('rb').readline())
+        sock.close()
+        stopper.join(5)
+
+    run_server(app, events, driver)
+    assert replies and replies[0].startswith(b'HTTP/1.1 200')
+    assert events == ['response', 'shutdown']
+
+
+class FakeChild:
+
+    def __init__(self, exited=False):
+        self.exited = exited
+
+    def poll(self):
+        return 1 if self.exited else None
+
+
+def test_handoff_waits_for_ready_signal():
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, b'1')
+    try:
+        assert WebhookServer._wait_ready(read_fd, FakeChild(), 1)
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+def test_handoff_fails_when_successor_exits_or_times_out():
+    read_fd, write_fd = os.pipe()
+    try:
+        assert not WebhookServer._wait_ready(read_fd, FakeChild(), 0.1)
+        assert not WebhookServer._wait_ready(read_fd, FakeChild(exited=True), 5)
+        # Преемник закрыл канал, не сообщив о готовности
+        os.close(write_fd)
+        write_fd = None
+        assert not WebhookServer._wait_ready(read_fd, FakeChild(), 5)
+    finally:
+        os.close(read_fd)
+        if write_fd is not None:
+            os.close(write_fd)
+
+
+def test_failed_handoff_keeps_serving():
+    events = []
+    app = SlowApp(events)
+    app.release.set()
+
+    def driver(server, port):
+        server._handoff = lambda: False
+        server.stop('handoff')
+        assert not server.draining
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+        conn.request('GET', '/')
+        assert conn.getresponse().status == 200
+        conn.close()
+        # Преемник готов: старый процесс плавно останавливается
+        server._handoff = lambda: True
+        server.stop('handoff')
+
+    server = run_server(app, events, driver)
+    assert server.draining
+    assert events == ['response', 'shutdown']
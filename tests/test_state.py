@@ -0,0 +1,179 @@
+import time
+
+import pytest
+
+from resp_server import RespServer
+from state import MemoryStateBackend, RedisStateBackend, SQLiteStateBackend, StateBackendError, create_state_backend
+
+
+@pytest.fixture
+def resp_server():
+    with RespServer(password='secret') as server:
+        yield server
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        backend = MemoryStateBackend()
+    elif request.param == 'sqlite':
+        backend = SQLiteStateBackend(str(tmp_path / 'state.db'))
+    else:
+        server = request.getfixturevalue('resp_server')
+        host, port = server.server_address
+        backend = RedisStateBackend(host, port, password='secret')
+    yield backend
+    backend.close()
+
+
+@pytest.mark.parametrize('key', ['update:123', 'note:text', 'plain'])
+def test_set_get_delete(backend, key):
+    assert backend.get(key) is None
+    backend.set(key, 42)
+    assert backend.get(key) == '42'
+    backend.set(key, 'value')
+    assert backend.get(key) == 'value'
+    backend.delete(key)
+    assert backend.get(key) is None
+
+
+@pytest.mark.parametrize('key', ['update:7', 'plain'])
+def test_add_only_once(backend, key):
+    assert backend.add(key, 1, ttl=60) is True
+    assert backend.add(key, 2, ttl=60) is False
+    assert backend.get(key) == '1'
+
+
+@pytest.mark.parametrize('key', ['update:8', 'plain'])
+def test_add_after_expiry(backend, key):
+    assert backend.add(key, 1, ttl=0.05) is True
+    time.sleep(0.1)
+    assert backend.get(key) is None
+    assert backend.add(key, 2, ttl=60) is True
+    assert backend.get(key) == '2'
+
+
+@pytest.mark.parametrize('key', ['abuse0:5', 'counter'])
+def test_incr_keeps_first_ttl(backend, key):
+    assert backend.incr(key, 1, ttl=0.2) == 1
+    assert backend.incr(key, 2, ttl=60) == 3
+    assert backend.get(key) == '3'
+    time.sleep(0.3)
+    # Срок жизни задан первым incr и не продлевается последующими
+    assert backend.get(key) is None
+    assert backend.incr(key, 1, ttl=60) == 1
+
+
+def test_token_bucket_parity(tmp_path):
+    # EVAL заглушка не выполняет, поэтому корзины сравниваются для memory и SQLite
+    backends = [MemoryStateBackend(), SQLiteStateBackend(str(tmp_path / 'state.db'))]
+    for backend in backends:
+        results = [backend.take_token('bucket', rate=1, capacity=3) for _ in range(5)]
+        assert results == [True, True, True, False, False]
+        backend.close()
+
+
+def test_redis_add_sends_nx(resp_server):
+    backend = RedisStateBackend(*resp_server.server_address, password='secret')
+    assert backend.add('update:1', 1, ttl=1.5)
+    assert resp_server.commands[-1] == ['SET', 'update:1', '1', 'PX', '1500', 'NX']
+
+
+def test_redis_incr_atomic_with_ttl(resp_server):
+    backend = RedisStateBackend(*resp_server.server_address, password='secret')
+    assert backend.incr('hits:1', 5, ttl=2) == 5
+    assert resp_server.commands[-4:] == [
+        ['MULTI'], ['SET', 'hits:1', '0', 'PX', '2000', 'NX'], ['INCRBY', 'hits:1', '5'], ['EXEC']
+    ]
+    assert 0 < backend.execute(('PTTL', 'hits:1'))[0] <= 2000
+
+
+def test_redis_incr_recreates_expired_key_with_ttl(resp_server):
+    backend = RedisStateBackend(*resp_server.server_address, password='secret')
+    assert backend.incr('hits:1', 1, ttl=0.05) == 1
+    time.sleep(0.1)
+    assert backend.incr('hits:1', 1, ttl=0.05) == 1
+    assert backend.execute(('PTTL', 'hits:1'))[0] > 0
+
+
+def test_redis_does_not_retry_incr(resp_server):
+    backend = RedisStateBackend(*resp_server.server_address, password='secret')
+    resp_server.drop_after = 'INCRBY'
+    with pytest.raises((OSError, ConnectionError)):
+        backend.incr('hits:1')
+    resp_server.drop_after = None
+    # INCRBY дошел до сервера ровно один раз
+    assert backend.get('hits:1') == '1'
+    assert sum(1 for cmd in resp_server.commands if cmd[0] == 'INCRBY') == 1
+
+
+def test_redis_retries_idempotent_commands(resp_server):
+    backend = RedisStateBackend(*resp_server.server_address, password='secret')
+    backend.set('key', 1)
+    resp_server.drop_after = 'GET'
+    with pytest.raises((OSError, ConnectionError)):
+        backend.get('key')
+    # Повтор тоже оборвался: GET отправлен дважды
+    assert sum(1 for cmd in resp_server.commands if cmd[0] == 'GET') == 2
+
+
+def test_redis_pipeline_error_keeps_stream_in_sync(resp_server):
+    backend = RedisStateBackend(*resp_server.server_address, password='secret')
+    backend.set('text', 'abc')
+    with pytest.raises(StateBackendError):
+        backend.execute(('INCRBY', 'text', 1), ('SET', 'after', 'x'), ('GET', 'text'))
+    # Ответы после ошибки вычитаны: следующая команда получает свой ответ
+    assert backend.get('after') == 'x'
+    with pytest.raises(StateBackendError):
+        backend.execute(('UNKNOWN',))
+    assert backend.get('text') == 'abc'
+
+
+def test_redis_auth_and_reconnect(resp_server):
+    backend = create_state_backend('redis://:secret@%s:%d/0' % resp_server.server_address)
+    backend.set('key', 1)
+    backend._local.conn[0].close()
+    # Оборванное соединение переоткрывается при следующей команде
+    assert backend.get('key') == '1'
+
+
+def test_sqlite_purges_expired_rows(tmp_path):
+    backend = SQLiteStateBackend(str(tmp_path / 'state.db'))
+    backend.PURGE_EVERY = 100
+    for i in range(600):
+        backend.add(f'update:{i}', 1, ttl=0.01)
+    time.sleep(0.05)
+    for i in range(100):
+        backend.add(f'fresh:{i}', 1, ttl=60)
+    conn = backend._conn()
+    assert conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0] <= 100
+    backend.close()
+
+
+def test_sqlite_purges_full_buckets(tmp_path, monkeypatch):
+    backend = SQLiteStateBackend(str(tmp_path / 'state.db'))
+    backend.take_token('bucket', rate=10, capacity=5)
+    backend.purge_expired()
+    conn = backend._conn()
+    assert conn.execute("SELECT COUNT(*) FROM buckets").fetchone()[0] == 1
+    # Через capacity / rate + 1 секунд корзина полна и строка удаляется
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 2)
+    backend.purge_expired()
+    assert conn.execute("SELECT COUNT(*) FROM buckets").fetchone()[0] == 0
+    backend.close()
+
+
+def test_sqlite_upgrades_bucket_table(tmp_path):
+    import sqlite3
+    path = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)")
+    conn.execute("INSERT INTO buckets VALUES ('bucket', 0, 0)")
+    conn.commit()
+    conn.close()
+    backend = SQLiteStateBackend(path)
+    assert backend.take_token('bucket', rate=1, capacity=2)
+    backend.purge_expired()
+    assert backend._conn().execute("SELECT COUNT(*) FROM buckets").fetchone()[0] == 1
+    backend.close()
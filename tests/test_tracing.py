@@ -0,0 +1,123 @@
+import json
+
+from tracing import (KIND_SERVER, STATUS_ERROR, BatchExportProcessor, Tracer, current_span,
+                     to_otlp_json)
+
+
+class Collect:
+    """Процессор, который просто запоминает завершенные span'ы"""
+
+    def __init__(self):
+        self.spans = []
+
+    def on_end(self, span):
+        self.spans.append(span)
+
+    def shutdown(self):
+        pass
+
+
+class MemoryExporter:
+
+    def __init__(self):
+        self.payloads = []
+
+    def export(self, payload):
+        self.payloads.append(json.loads(json.dumps(payload)))
+
+
+def make_tracer():
+    tracer, collect = Tracer(), Collect()
+    tracer.add_processor(collect)
+    return tracer, collect
+
+
+def test_child_spans_share_trace_and_point_to_parent():
+    tracer, collect = make_tracer()
+    with tracer.span('receive', kind=KIND_SERVER) as root:
+        with tracer.span('parse') as parse:
+            assert current_span() is parse
+        with tracer.span('send') as send:
+            pass
+        assert current_span() is root
+    assert current_span() is None
+
+    assert [span.name for span in collect.spans] == ['parse', 'send', 'receive']
+    assert root.parent_id is None
+    assert len(root.trace_id) == 32 and len(root.span_id) == 16
+    assert parse.trace_id == send.trace_id == root.trace_id
+    assert parse.parent_id == send.parent_id == root.span_id
+    assert parse.span_id != send.span_id
+
+
+def test_separate_roots_get_new_traces():
+    tracer, collect = make_tracer()
+    with tracer.span('first'):
+        pass
+    with tracer.span('second'):
+        pass
+    assert collect.spans[0].trace_id != collect.spans[1].trace_id
+
+
+def test_exception_marks_span_as_error():
+    tracer, collect = make_tracer()
+    try:
+        with tracer.span('send'):
+            raise RuntimeError('boom')
+    except RuntimeError:
+        pass
+    span = collect.spans[0]
+    assert span.status == STATUS_ERROR and span.status_message == 'boom'
+    assert span.end_ns >= span.start_ns
+
+
+def test_otlp_json_shape():
+    tracer, collect = make_tracer()
+    with tracer.span('receive', kind=KIND_SERVER, update_id=7, chat='private', ok=True, ratio=0.5):
+        with tracer.span('parse'):
+            pass
+    payload = to_otlp_json(collect.spans, 'bot')
+
+    resource_spans = payload['resourceSpans'][0]
+    assert resource_spans['resource']['attributes'] == [
+        {'key': 'service.name', 'value': {'stringValue': 'bot'}}
+    ]
+    scope = resource_spans['scopeSpans'][0]
+    assert scope['scope'] == {'name': 'gettginfobot'}
+    child, root = scope['spans']
+    assert child['parentSpanId'] == root['spanId']
+    assert 'parentSpanId' not in root
+    assert root['kind'] == KIND_SERVER
+    # 64-битные числа в OTLP/JSON передаются строками
+    assert isinstance(root['startTimeUnixNano'], str) and isinstance(root['endTimeUnixNano'], str)
+    assert root['status'] == {'code': 0}
+    assert root['attributes'] == [
+        {'key': 'update_id', 'value': {'intValue': '7'}},
+        {'key': 'chat', 'value': {'stringValue': 'private'}},
+        {'key': 'ok', 'value': {'boolValue': True}},
+        {'key': 'ratio', 'value': {'doubleValue': 0.5}},
+    ]
+
+
+def test_batch_processor_exports_on_shutdown():
+    exporter = MemoryExporter()
+    processor = BatchExportProcessor(exporter, 'bot', batch_size=2, interval=60)
+    tracer = Tracer()
+    tracer.add_processor(processor)
+    for name in ('a', 'b', 'c'):
+        with tracer.span(name):
+            pass
+    tracer.clear_processors()
+    batches = [payload['resourceSpans'][0]['scopeSpans'][0]['spans'] for payload in exporter.payloads]
+    assert [[span['name'] for span in batch] for batch in batches] == [['a', 'b'], ['c']]
+
+
+def test_batch_processor_drops_when_queue_full():
+    processor = BatchExportProcessor(MemoryExporter(), 'bot', max_queue=1, interval=60)
+    tracer = Tracer()
+    tracer.add_processor(processor)
+    for name in ('a', 'b', 'c'):
+        with tracer.span(name):
+            pass
+    assert processor.dropped == 2
+    processor.shutdown()
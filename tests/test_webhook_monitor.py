@@ -0,0 +1,156 @@
+import pytest
+
+import webhook_monitor
+from concurrency import AdaptiveLimiter
+from state import MemoryStateBackend
+from webhook_monitor import LEADER_KEY, WebhookMonitor
+
+
+class FakeBot:
+    """Очередь Telegram в памяти: getUpdates отдает обновления начиная с offset"""
+
+    def __init__(self, count, failing=()):
+        self.state = MemoryStateBackend()
+        self.limiter = AdaptiveLimiter('test_drain', initial_limit=16)
+        self.queue = [{'update_id': i} for i in range(1, count + 1)]
+        self.failing = set(failing)
+        self.calls = []
+        self.handled = []
+
+    def api_call_sync(self, method, params=None):
+        self.calls.append((method, params))
+        if method == 'getUpdates':
+            offset = (params or {}).get('offset')
+            if offset is not None:
+                self.queue = [u for u in self.queue if u['update_id'] >= offset]
+            return self.queue[:params.get('limit', 100)]
+        return True
+
+    def webhook_handler_sync(self, update):
+        self.handled.append(update['update_id'])
+        return update['update_id'] not in self.failing
+
+
+def make_monitor(bot, **kwargs):
+    monitor = WebhookMonitor(bot, 'https://example.com/webhook', interval=60, drain_workers=2, **kwargs)
+    assert monitor._is_leader()
+    return monitor
+
+
+def test_drain_confirms_everything():
+    bot = FakeBot(250)
+    make_monitor(bot).drain_backlog(250)
+    assert bot.queue == []
+    assert bot.calls[-1][0] == 'setWebhook'
+
+
+def test_drain_stops_before_failed_update():
+    bot = FakeBot(250, failing={150})
+    make_monitor(bot).drain_backlog(250)
+    # Подтверждено все до 150, сама 150 и дальше останутся для webhook
+    assert bot.queue[0]['update_id'] == 150
+    assert max(bot.handled) == 200
+    assert bot.calls[-1][0] == 'setWebhook'
+
+
+def test_drain_renews_lease_per_batch():
+    bot = FakeBot(300)
+    monitor = make_monitor(bot)
+    renewals = []
+    original = monitor._is_leader
+    monitor._is_leader = lambda: renewals.append(1) or original()
+    monitor.drain_backlog(300)
+    assert len(renewals) >= 3
+
+
+def test_drain_stops_when_leadership_lost():
+    bot = FakeBot(300)
+    monitor = make_monitor(bot)
+    bot.state.set(LEADER_KEY, 'other-replica', ttl=60)
+    monitor.drain_backlog(300)
+    assert bot.handled == []
+    assert len(bot.queue) == 300
+
+
+def test_drain_timeout(monkeypatch):
+    bot = FakeBot(1000)
+    monitor = make_monitor(bot, drain_timeout=10)
+    # Каждая пачка getUpdates "длится" 4 секунды
+    clock = {'now': 0}
+    original = bot.api_call_sync
+
+    def slow_api_call(method, params=None):
+        if method == 'getUpdates':
+            clock['now'] += 4
+        return original(method, params)
+
+    bot.api_call_sync = slow_api_call
+    monkeypatch.setattr(webhook_monitor, 'time', type('Clock', (), {'monotonic': lambda: clock['now']}))
+    monitor.drain_backlog(1000)
+    # Пачки в 0..4 и 4..8 успевают, третья (8..12) тоже начата до срока, четвертой нет
+    assert len(bot.handled) == 300
+    assert bot.queue[0]['update_id'] == 301
+
+
+def test_drain_respects_limiter():
+    bot = FakeBot(200)
+    bot.limiter = AdaptiveLimiter('test_drain_limit', initial_limit=1)
+    peak = []
+    original = bot.webhook_handler_sync
+
+    def handler(update):
+        peak.append(bot.limiter.inflight)
+        return original(update)
+
+    bot.webhook_handler_sync = handler
+    make_monitor(bot).drain_backlog(200)
+    # Два потока разбора, но лимит в один слот
+    assert max(peak) == 1
+    assert bot.queue == [] and bot.limiter.inflight == 0
+
+
+def test_drain_stops_when_no_slot_until_deadline():
+    bot = FakeBot(200)
+    bot.limiter = AdaptiveLimiter('test_drain_busy', initial_limit=1)
+    assert bot.limiter.try_acquire()
+    make_monitor(bot, drain_timeout=0.05).drain_backlog(200)
+    # Слот так и не освободился: ничего не обработано и не подтверждено
+    assert bot.handled == [] and len(bot.queue) == 200
+    assert bot.calls[-1][0] == 'setWebhook'
+
+
+def test_drain_retries_webhook_registration(monkeypatch):
+    bot = FakeBot(10)
+    monitor = make_monitor(bot)
+    monkeypatch.setattr(monitor, 'REGISTER_RETRY_DELAYS', (0, 0))
+    failures = {'left': 2}
+    original = bot.api_call_sync
+
+    def flaky_api_call(method, params=None):
+        if method == 'setWebhook' and failures['left']:
+            failures['left'] -= 1
+            raise ConnectionError('network down')
+        return original(method, params)
+
+    bot.api_call_sync = flaky_api_call
+    monitor.drain_backlog(10)
+    assert bot.calls[-1][0] == 'setWebhook' and failures['left'] == 0
+
+
+def test_drain_gives_up_after_retries(monkeypatch):
+    bot = FakeBot(10)
+    monitor = make_monitor(bot)
+    monkeypatch.setattr(monitor, 'REGISTER_RETRY_DELAYS', (0,))
+    attempts = []
+    original = bot.api_call_sync
+
+    def broken_api_call(method, params=None):
+        if method == 'setWebhook':
+            attempts.append(1)
+            raise ConnectionError('network down')
+        return original(method, params)
+
+    bot.api_call_sync = broken_api_call
+    with pytest.raises(ConnectionError):
+        monitor.drain_backlog(10)
+    assert len(attempts) == 2
@@ -0,0 +1,255 @@
+"""
+Трассировка обработки обновлений.
+
+Каждое обновление получает trace (receive -> parse -> format -> send).
+ID текущего trace и span подставляются во все строки лога, а завершенные
+span'ы можно выгружать в формате OTLP/JSON в файл (по строке на пакет)
+или в OpenTelemetry Collector по HTTP (TRACE_EXPORT).
+"""
+
+import contextlib
+import contextvars
+import json
+import logging
+import queue
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+
+class Span:
+    """Один этап обработки"""
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind',
+                 'start_ns', 'end_ns', 'attributes', 'status', 'status_message')
+
+    def __init__(self, name, trace_id, parent_id=None, kind=KIND_INTERNAL, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.status = STATUS_UNSET
+        self.status_message = None
+
+    @property
+    def duration(self):
+        """Длительность в секундах"""
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e9
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_error(self, message):
+        self.status = STATUS_ERROR
+        self.status_message = str(message)
+
+
+def current_span():
+    """Текущий span или None"""
+    return _current_span.get()
+
+
+class Tracer:
+    """Создание span'ов и передача завершенных span'ов процессорам"""
+
+    def __init__(self):
+        self._processors = []
+
+    def add_processor(self, processor):
+        """Процессор - объект с методами on_end(span) и shutdown()"""
+        self._processors.append(processor)
+
+    def remove_processor(self, processor):
+        self._processors.remove(processor)
+
+    def clear_processors(self):
+        """Остановить и убрать все процессоры (в том числе выгрузку по TRACE_EXPORT)"""
+        processors, self._processors = self._processors, []
+        for processor in processors:
+            processor.shutdown()
+
+    @contextlib.contextmanager
+    def span(self, name, kind=KIND_INTERNAL, **attributes):
+        """Span внутри текущего trace (или новый trace, если текущего нет)"""
+        parent = _current_span.get()
+        if parent is None:
+            span = Span(name, f"{random.getrandbits(128):032x}", kind=kind, attributes=attributes)
+        else:
+            span = Span(name, parent.trace_id, parent.span_id, kind=kind, attributes=attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.set_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end_ns = time.time_ns()
+            for processor in self._processors:
+                processor.on_end(span)
+
+    def shutdown(self):
+        for processor in self._processors:
+            processor.shutdown()
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{'key': key, 'value': _otlp_value(value)} for key, value in attributes.items()]
+
+
+def to_otlp_json(spans, service_name):
+    """Пакет span'ов в виде ExportTraceServiceRequest (OTLP/JSON)"""
+    otlp_spans = []
+    for span in spans:
+        item = {
+            'traceId': span.trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            'kind': span.kind,
+            'startTimeUnixNano': str(span.start_ns),
+            'endTimeUnixNano': str(span.end_ns),
+            'attributes': _otlp_attributes(span.attributes),
+            'status': {'code': span.status},
+        }
+        if span.parent_id:
+            item['parentSpanId'] = span.parent_id
+        if span.status_message:
+            item['status']['message'] = span.status_message
+        otlp_spans.append(item)
+    return {
+        'resourceSpans': [{
+            'resource': {'attributes': _otlp_attributes({'service.name': service_name})},
+            'scopeSpans': [{'scope': {'name': 'gettginfobot'}, 'spans': otlp_spans}],
+        }]
+    }
+
+
+class FileSpanExporter:
+    """Запись пакетов в файл: одна строка JSON на пакет"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, payload):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(payload, ensure_ascii=False) + '\n')
+
+
+class OTLPHttpSpanExporter:
+    """Отправка пакетов в OpenTelemetry Collector (OTLP/HTTP, JSON)"""
+
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+
+    def export(self, payload):
+        import requests
+        response = requests.post(self.url, json=payload, timeout=self.timeout)
+        if response.status_code >= 300:
+            logger.warning(f"Collector ответил {response.status_code}: {response.text[:200]}")
+
+
+class BatchExportProcessor:
+    """Фоновая выгрузка span'ов пакетами, чтобы не задерживать обработку"""
+
+    def __init__(self, exporter, service_name, max_queue=10000, batch_size=512, interval=2.0):
+        self.exporter = exporter
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.interval = interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+        self._thread.start()
+
+    def on_end(self, span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self):
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _export(self, batch):
+        try:
+            self.exporter.export(to_otlp_json(batch, self.service_name))
+        except Exception as e:
+            logger.warning(f"Ошибка выгрузки span'ов: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            batch = self._drain()
+            while batch:
+                self._export(batch)
+                batch = self._drain()
+
+    def shutdown(self):
+        """Остановить поток и выгрузить оставшиеся span'ы"""
+        self._stop.set()
+        self._thread.join(timeout=self.interval + 5)
+        batch = self._drain()
+        while batch:
+            self._export(batch)
+            batch = self._drain()
+
+
+def create_exporter(target):
+    """Экспортер по значению TRACE_EXPORT: путь к файлу или URL коллектора"""
+    if target.startswith(('http://', 'https://')):
+        return OTLPHttpSpanExporter(target)
+    return FileSpanExporter(target)
+
+
+def install_log_context():
+    """Добавить trace_id и span_id во все записи лога"""
+    factory = logging.getLogRecordFactory()
+    if getattr(factory, 'with_trace_context', False):
+        return
+
+    def record_factory(*args, **kwargs):
+        record = factory(*args, **kwargs)
+        span = _current_span.get()
+        record.trace_id = span.trace_id if span else '-'
+        record.span_id = span.span_id if span else '-'
+        return record
+
+    record_factory.with_trace_context = True
+    logging.setLogRecordFactory(record_factory)
+
+
+tracer = Tracer()
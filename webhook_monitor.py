@@ -0,0 +1,221 @@
+"""
+Фоновый контроль webhook через getWebhookInfo.
+
+Монитор периодически запрашивает состояние webhook и:
+- экспортирует число ожидающих обновлений и возраст последней ошибки;
+- заново регистрирует webhook, если URL или max_connections разошлись
+  с ожидаемыми;
+- при большой очереди временно снимает webhook и разбирает очередь через
+  getUpdates (пачками по 100, в несколько потоков), затем возвращает webhook.
+  Обновления проходят через тот же адаптивный лимит, что и запросы webhook.
+  Разбор ограничен по времени (drain_timeout) и останавливается на первом
+  необработанном обновлении: оно не подтверждается и придет снова через webhook.
+
+При нескольких репликах работает только одна: лидерство берется через
+общее хранилище состояния.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+PENDING_GAUGE = Gauge('telegram_webhook_pending_updates', 'pending_update_count из getWebhookInfo')
+ERROR_AGE_GAUGE = Gauge('telegram_webhook_last_error_age_seconds',
+                        'Секунд с последней ошибки доставки webhook (-1, если ошибок нет)')
+REREGISTER_COUNTER = Counter('telegram_webhook_reregister_total', 'Повторные регистрации webhook', ['reason'])
+DRAIN_COUNTER = Counter('telegram_webhook_drain_total', 'Переключения на getUpdates для разбора очереди')
+DRAINED_COUNTER = Counter('telegram_webhook_drained_updates_total', 'Обновления, разобранные через getUpdates')
+CHECK_ERRORS_COUNTER = Counter('telegram_webhook_monitor_errors_total', 'Ошибки проверки webhook')
+
+TELEGRAM_MAX_CONNECTIONS = 100
+LEADER_KEY = 'webhook_monitor:leader'
+
+
+class WebhookMonitor:
+    """Периодическая проверка и восстановление webhook"""
+
+    # Паузы между повторами setWebhook после разбора очереди, секунды
+    REGISTER_RETRY_DELAYS = (1, 5, 15)
+
+    def __init__(self, bot, webhook_url, interval=60, max_connections=40,
+                 backlog_threshold=1000, drain_workers=8, drain_timeout=300):
+        self.bot = bot
+        self.webhook_url = webhook_url
+        self.interval = interval
+        self.max_connections = max(1, min(TELEGRAM_MAX_CONNECTIONS, max_connections))
+        self.backlog_threshold = backlog_threshold
+        self.drain_workers = drain_workers
+        self.drain_timeout = drain_timeout
+        self.instance_id = f"{socket.gethostname()}-{os.getpid()}"
+        self._stop = threading.Event()
+        self._thread = None
+
+    def configure(self, max_connections=None, backlog_threshold=None, drain_workers=None, drain_timeout=None):
+        """Изменение параметров на лету; новый max_connections применится при следующей проверке"""
+        if max_connections is not None:
+            self.max_connections = max(1, min(TELEGRAM_MAX_CONNECTIONS, max_connections))
+        if backlog_threshold is not None:
+            self.backlog_threshold = backlog_threshold
+        if drain_workers is not None:
+            self.drain_workers = drain_workers
+        if drain_timeout is not None:
+            self.drain_timeout = drain_timeout
+
+    def start(self):
+        """Запуск фонового потока"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='webhook-monitor', daemon=True)
+        self._thread.start()
+        logger.info(f"Мониторинг webhook запущен (интервал {self.interval} с)")
+
+    def stop(self, timeout=None):
+        """Остановка фонового потока; лидерство сразу передается другим репликам"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+            try:
+                if self.bot.state.get(LEADER_KEY) == self.instance_id:
+                    self.bot.state.delete(LEADER_KEY)
+            except Exception as e:
+                logger.warning(f"Не удалось снять лидерство монитора webhook: {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._is_leader():
+                    self.check_once()
+            except Exception as e:
+                CHECK_ERRORS_COUNTER.inc()
+                logger.error(f"Ошибка проверки webhook: {e}")
+            self._stop.wait(self.interval)
+
+    def _is_leader(self):
+        """Только одна реплика управляет webhook"""
+        ttl = self.interval * 3
+        state = self.bot.state
+        if state.add(LEADER_KEY, self.instance_id, ttl=ttl):
+            return True
+        if state.get(LEADER_KEY) == self.instance_id:
+            state.set(LEADER_KEY, self.instance_id, ttl=ttl)
+            return True
+        return False
+
+    def check_once(self):
+        """Одна проверка getWebhookInfo с восстановлением при необходимости"""
+        info = self.bot.api_call_sync('getWebhookInfo')
+        pending = info.get('pending_update_count', 0)
+        PENDING_GAUGE.set(pending)
+
+        last_error_date = info.get('last_error_date')
+        if last_error_date:
+            ERROR_AGE_GAUGE.set(max(0, time.time() - last_error_date))
+            logger.warning(f"Последняя ошибка доставки webhook: {info.get('last_error_message')}")
+        else:
+            ERROR_AGE_GAUGE.set(-1)
+
+        if pending > self.backlog_threshold:
+            self.drain_backlog(pending)
+            return
+
+        reason = self._drift_reason(info)
+        if reason:
+            self.register(reason)
+
+    def _drift_reason(self, info):
+        if info.get('url') != self.webhook_url:
+            return 'url'
+        if info.get('max_connections') not in (None, self.max_connections):
+            return 'max_connections'
+        return None
+
+    def register(self, reason):
+        """Регистрация webhook с нашими параметрами"""
+        self.bot.api_call_sync('setWebhook', {
+            'url': self.webhook_url,
+            'max_connections': self.max_connections,
+        })
+        REREGISTER_COUNTER.inc(reason=reason)
+        logger.info(f"Webhook зарегистрирован заново ({reason}): {self.webhook_url}, "
+                     f"max_connections={self.max_connections}")
+
+    def drain_backlog(self, pending):
+        """Разбор очереди через getUpdates вместо webhook"""
+        logger.warning(f"В очереди {pending} обновлений, переключаемся на getUpdates")
+        DRAIN_COUNTER.inc()
+        # Без drop_pending_updates: очередь сохраняется и отдается через getUpdates
+        self.bot.api_call_sync('deleteWebhook', {'drop_pending_updates': False})
+        drained = 0
+        deadline = time.monotonic() + self.drain_timeout
+        try:
+            offset = None
+            with ThreadPoolExecutor(max_workers=self.drain_workers, thread_name_prefix='webhook-drain') as pool:
+                while not self._stop.is_set():
+                    if time.monotonic() >= deadline:
+                        logger.warning(f"Разбор очереди идет дольше {self.drain_timeout} с, возвращаем webhook")
+                        break
+                    # Продлеваем лидерство: иначе другая реплика увидит снятый webhook
+                    # как расхождение и вернет его, а getUpdates получит 409 Conflict
+                    if not self._is_leader():
+                        logger.warning("Лидерство монитора перешло к другой реплике, разбор очереди остановлен")
+                        break
+                    params = {'limit': 100, 'timeout': 0}
+                    if offset is not None:
+                        params['offset'] = offset
+                    updates = self.bot.api_call_sync('getUpdates', params)
+                    if not updates:
+                        break
+                    # Пачку обрабатываем целиком до подтверждения ее через offset
+                    results = list(pool.map(lambda update: self._handle(update, deadline), updates))
+                    failed = results.index(False) if False in results else len(updates)
+                    if failed:
+                        offset = updates[failed - 1]['update_id'] + 1
+                        drained += failed
+                        DRAINED_COUNTER.inc(failed)
+                    if failed < len(updates):
+                        # Необработанное обновление и все после него не подтверждаем:
+                        # Telegram доставит их через webhook, уже обработанные отсеет дедупликация
+                        logger.warning(f"Update {updates[failed]['update_id']} не обработан, "
+                                       f"разбор очереди остановлен")
+                        break
+            if offset is not None:
+                # Подтверждаем обработанное, иначе после setWebhook оно придет снова
+                self.bot.api_call_sync('getUpdates', {'offset': offset, 'limit': 1, 'timeout': 0})
+        finally:
+            self._restore_webhook()
+            logger.info(f"Разобрано через getUpdates: {drained} обновлений, webhook восстановлен")
+
+    def _handle(self, update, deadline):
+        """Обработка разобранного обновления в пределах адаптивного лимита"""
+        limiter = self.bot.limiter
+        # Ждем слота, а не отбрасываем: обновление без слота к сроку останется в очереди
+        if not limiter.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            return False
+        try:
+            return self.bot.webhook_handler_sync(update)
+        finally:
+            limiter.release()
+
+    def _restore_webhook(self):
+        """Вернуть webhook после разбора очереди, повторяя setWebhook при ошибках
+
+        Без этого webhook остается снятым до следующей проверки (interval),
+        и обновления все это время копятся в очереди.
+        """
+        for delay in self.REGISTER_RETRY_DELAYS + (None,):
+            try:
+                self.register('drain')
+                return
+            except Exception as e:
+                if delay is None:
+                    raise
+                logger.warning(f"Не удалось вернуть webhook: {e}; повтор через {delay} с")
+                time.sleep(delay)